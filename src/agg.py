@@ -1,21 +1,30 @@
 from pathlib import Path
-from pyrolite_meltsutil.tables.load import (
-    aggregate_tables,
-    import_batch_config,
-    import_tables,
-)
 from pyrolite.util.meta import stream_log
-stream_log('pyrolite_meltsutil')
+from mod.aggregate import aggregate_to_store
+from mod.columnar import store_to_dataset
 
-outputfolder = Path("../data/experiments")
-system, phases = aggregate_tables(outputfolder)
+stream_log("pyrolite_meltsutil")
+stream_log("mod")
 
-system.to_hdf(outputfolder / "system.h5", key="df")
-phases.to_hdf(outputfolder / "phases.h5", key="df")
+if __name__ == "__main__":  # worker processes may re-import this script
+    # experiments are parsed in parallel and streamed to the stores in chunks,
+    # such that memory use doesn't grow with the number of experiments; only new
+    # or changed experiment folders are parsed, use incremental=False to rebuild.
+    outputfolder = Path("../data/experiments")
+    # trace element tables (Trace_main_tbl.txt) are aggregated to a store of their
+    # own, which shares the index of the system and phase stores
+    aggregate_to_store(
+        outputfolder, processes=None, chunksize=50, incremental=True, traces=True
+    )
+    for table in ["system", "phases", "traces"]:  # columnar copies for filtered reads
+        store_to_dataset(
+            outputfolder / (table + ".h5"), outputfolder / (table + ".parquet")
+        )
 
-#%%
-outputfolder = Path("../data/experiments_uncertainty")
-system, phases = aggregate_tables(outputfolder)
-
-system.to_hdf(outputfolder / "system.h5", key="df")
-phases.to_hdf(outputfolder / "phases.h5", key="df")
+    #%%
+    outputfolder = Path("../data/experiments_uncertainty")
+    aggregate_to_store(outputfolder, processes=None, chunksize=50, incremental=True)
+    for table in ["system", "phases"]:  # columnar copies for filtered reads
+        store_to_dataset(
+            outputfolder / (table + ".h5"), outputfolder / (table + ".parquet")
+        )
@@ -0,0 +1,69 @@
+import time
+import pandas as pd
+from collections import defaultdict
+from mod.synthetic import synthetic_phases
+from mod.sequence import (
+    get_appearance_sequence,
+    get_assemblage_sequence,
+    rank_experiments,
+)
+
+
+def recursive_appearance_sequence(
+    phases, ignore=["bulk", "cumulate", "solid"], mode="descending", variable="temperature"
+):
+    """
+    Previous recursive implementation of :func:`get_appearance_sequence`, kept here
+    as a reference for benchmarking.
+    """
+    if "experiment" in phases.columns:
+        if len(phases.experiment.unique()) > 1:
+            return {
+                e: recursive_appearance_sequence(
+                    phases.loc[phases.experiment == e],
+                    ignore=ignore,
+                    mode=mode,
+                    variable=variable,
+                )
+                for e in phases.experiment.unique()
+            }
+    sequence = defaultdict(list)
+    agg = max if mode == "descending" else min
+    for p in phases.phaseID.unique():
+        if p not in ignore and not pd.isnull(p):
+            sequence[int(agg(phases.loc[phases.phaseID == p, variable]))].append(p)
+    return sorted(sequence.items(), key=lambda x: x[0], reverse=mode == "descending")
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+n_experiments = 10000  # synthetic batch size
+phases = synthetic_phases(n_experiments, seed=32)
+print("{} experiments, {} rows".format(n_experiments, phases.index.size))
+#%%
+grouped, t_grouped = timed(get_appearance_sequence, phases)
+recursive, t_recursive = timed(recursive_appearance_sequence, phases)
+
+assert grouped == recursive
+print("Recursive: {:.2f} s".format(t_recursive))
+print("Grouped: {:.2f} s ({:.0f}x)".format(t_grouped, t_recursive / t_grouped))
+#%%
+assemblages, t_assemblages = timed(get_assemblage_sequence, phases)
+print(
+    "Assemblages: {:.2f} s, {} change points".format(
+        t_assemblages, assemblages.index.size
+    )
+)
+#%%
+target = ["liquid", "olivine", "feldspar", "clinopyroxene", "orthopyroxene"]
+ranked, t_ranked = timed(rank_experiments, phases, target, ignore_trailing=True)
+print("Ranking: {:.2f} s".format(t_ranked))
+#%%
+set_ranked, t_set = timed(
+    rank_experiments, phases, target, ignore_trailing=True, metric="set"
+)
+print("Set-aware ranking: {:.2f} s ({:.1f}x flat)".format(t_set, t_set / t_ranked))
@@ -0,0 +1,158 @@
+import sys
+from pathlib import Path
+import matplotlib
+
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+from pyrolite.util.meta import stream_log
+from pyrolite_meltsutil.tables.load import aggregate_tables
+from mod.aggregate import experiment_folders, aggregate_to_store
+from mod.store import append_chunk, read_store
+from mod.columnar import write_dataset, read_dataset
+from mod.sequence import (
+    get_appearance_sequence,
+    get_assemblage_sequence,
+    sequence_distance,
+    rank_experiments,
+)
+from mod.synthetic import (
+    experiment_hashes,
+    synthetic_phases,
+    synthetic_system,
+    synthetic_config,
+    synthetic_folders,
+)
+from mod.vis.phasevolumes import experiment_panels, _phasevolumes
+from mod.benchmark import BenchmarkSuite, read_results, compare_results
+
+logger = stream_log("mod", level="INFO")
+
+# results are appended for each run, keyed by commit; sizes for which the fixtures
+# won't fit in memory are skipped (~1.2 GB of phase tables per 10^4 experiments)
+results = Path("../data/benchmarks.jsonl")
+suite = BenchmarkSuite(results, sizes=[100, 1000, 10000, 100000], repeat=3)
+templates = experiment_folders("../data/experiments")  # tables for synthetic folders
+target = ["liquid", "olivine", "feldspar", "clinopyroxene", "orthopyroxene"]
+
+
+#%% fixtures
+@suite.fixture(per_experiment=3e5)  # including copies made by the hot paths
+def phases(size, folder):
+    return synthetic_phases(size, seed=32)
+
+
+@suite.fixture(per_experiment=3e4, requires=["phases"])
+def system(size, folder):
+    return synthetic_system(suite.get("phases", size), seed=32)
+
+
+@suite.fixture(requires=["phases"])
+def config(size, folder):
+    return synthetic_config(suite.get("phases", size)["experiment"].unique(), seed=32)
+
+
+@suite.fixture(requires=["phases", "system"])
+def stores(size, folder, chunksize=1000):
+    # chunked stores, as written by aggregate_to_store
+    for name in ["system", "phases"]:
+        df = suite.get(name, size)
+        experiments = df["experiment"].unique()
+        for ix in range(0, experiments.size, chunksize):
+            chunk = df.loc[df["experiment"].isin(experiments[ix : ix + chunksize])]
+            append_chunk(folder / (name + ".h5"), chunk)
+    return folder
+
+
+@suite.fixture(requires=["phases"])
+def dataset(size, folder):
+    write_dataset(suite.get("phases", size), folder / "phases.parquet")
+    return folder / "phases.parquet"
+
+
+@suite.fixture()
+def folders(size, folder):
+    experiments = experiment_hashes(size, seed=32)
+    config = synthetic_config(experiments, seed=32)
+    synthetic_folders(folder, experiments, templates, config=config)
+    return folder
+
+
+#%% sequences
+@suite.benchmark(fixtures=["phases"])
+def appearance_sequence(phases):
+    get_appearance_sequence(phases)
+
+
+@suite.benchmark(fixtures=["phases"])
+def assemblage_sequence(phases):
+    get_assemblage_sequence(phases)
+
+
+@suite.benchmark(fixtures=["phases"], max_size=1000, repeat=1)
+def distance(phases):
+    # per-experiment distances, as compared to the vectorized rank_experiments
+    for _, expdf in phases.groupby("experiment", sort=False):
+        sequence_distance(expdf, target, ignore_trailing=True)
+
+
+@suite.benchmark(fixtures=["phases"])
+def rank(phases):
+    rank_experiments(phases, target, ignore_trailing=True)
+
+
+#%% phase volume figures, for which drawing is limited to a page of panels
+@suite.benchmark(fixtures=["phases"], max_size=1000, repeat=1)
+def phasevolume_panels(phases):
+    experiment_panels(phases)
+
+
+@suite.benchmark(fixtures=["phases", "config"], max_size=100, repeat=1)
+def phasevolumes(phases, config):
+    fig, ax = _phasevolumes(phases, config=config)
+    plt.close(fig)
+
+
+#%% aggregation, parsing experiment folders
+# pyrolite_meltsutil.tables.aggregate_tables, which aggregate_to_store replaces
+@suite.benchmark(fixtures=["folders"], max_size=100, repeat=1, memory=False)
+def reference_aggregate(folder):
+    aggregate_tables(folder)
+
+
+@suite.benchmark(fixtures=["folders"], max_size=1000, repeat=1)
+def aggregate(folder):
+    aggregate_to_store(folder, chunksize=50, incremental=False)
+
+
+#%% loads
+@suite.benchmark(fixtures=["stores"])
+def load_phases(folder):
+    read_store(folder / "phases.h5")
+
+
+@suite.benchmark(fixtures=["stores"])
+def load_phases_compact(folder):
+    read_store(folder / "phases.h5", compact=True)
+
+
+@suite.benchmark(fixtures=["stores"])
+def load_system(folder):
+    read_store(folder / "system.h5")
+
+
+@suite.benchmark(fixtures=["dataset"])
+def load_dataset(path):
+    read_dataset(path, columns=["experiment", "phaseID", "temperature"])
+
+
+#%%
+if __name__ == "__main__":  # worker processes may re-import this script
+    # e.g. `python benchmark_suite.py 100 1000` to run only the smaller sizes
+    sizes = [int(s) for s in sys.argv[1:]] or None
+    report = suite.run(sizes=sizes)
+    print(report.set_index(["benchmark", "size"])[["status", "seconds", "peak_mb"]])
+    # compared to the results of the previously benchmarked commit
+    comparison = compare_results(read_results(results))
+    if not comparison.empty:
+        print(comparison.to_string(float_format="{:.3f}".format))
+        print(comparison.loc[comparison["ratio"] > 1.1])  # regressions
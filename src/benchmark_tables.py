@@ -0,0 +1,102 @@
+import time
+import warnings
+import pandas as pd
+from pyrolite_meltsutil.parse import from_melts_cstr
+from pyrolite_meltsutil.tables.load import (
+    import_tables as reference_import_tables,
+    read_melts_tablefile,
+    phasetable_from_alphameltstxt,
+)
+from mod.aggregate import experiment_folders
+from mod.tables import (
+    BLOCK,
+    SECTION,
+    import_tables,
+    read_table_file,
+    read_phase_block,
+    read_phase_file,
+    melts_formula,
+)
+
+warnings.simplefilter("ignore")  # pandas deprecations within pyrolite-meltsutil
+
+
+def timed(func, items):
+    start = time.perf_counter()
+    results = [func(i) for i in items]
+    return results, time.perf_counter() - start
+
+
+def same_table(a, b):
+    # formulae are compared as formulae, other columns exactly
+    if "formula" in a.columns:
+        fa, fb = a["formula"].values, b["formula"].values
+        if not all(
+            str(x) == str(y) and (isinstance(x, float) or x == y)
+            for x, y in zip(fa, fb)
+        ):
+            return False
+        a, b = a.drop(columns="formula"), b.drop(columns="formula")
+    try:
+        pd.testing.assert_frame_equal(a, b, check_exact=True)
+    except AssertionError:
+        return False
+    return True
+
+
+def formula_strings(path):
+    # formulae as written within the phase tables
+    with open(str(path)) as f:
+        sections = [s for s in SECTION.split(f.read().strip()) if s]
+    phasetbl = [s for s in sections if s[0] == s[0].lower()][0]
+    tables = [read_phase_block(b) for b in BLOCK.split(phasetbl.strip())]
+    return [s for df in tables if "formula" in df.columns for s in df["formula"]]
+
+
+folders = experiment_folders("../data/experiments")
+print("{} experiment folders".format(len(folders)))
+#%% single tables
+for name in ["System_main_tbl.txt", "Bulk_comp_tbl.txt", "Solid_comp_tbl.txt"]:
+    paths = [f / name for f in folders]
+    reference, t_reference = timed(read_melts_tablefile, paths)
+    blocks, t_blocks = timed(read_table_file, paths)
+    assert all(same_table(a, b) for a, b in zip(reference, blocks))
+    print(
+        "{}: {:.2f} s, block parser {:.2f} s ({:.1f}x)".format(
+            name, t_reference, t_blocks, t_reference / t_blocks
+        )
+    )
+#%% phase tables
+paths = [f / "alphaMELTS_tbl.txt" for f in folders]
+reference, t_reference = timed(phasetable_from_alphameltstxt, paths)
+blocks, t_blocks = timed(read_phase_file, paths)
+assert all(same_table(a, b) for a, b in zip(reference, blocks))
+print(
+    "Phase tables: {:.2f} s, block parser {:.2f} s ({:.1f}x)".format(
+        t_reference, t_blocks, t_reference / t_blocks
+    )
+)
+#%% formulae, which dominated the time taken to read the phase tables
+strings = [s for path in paths for s in formula_strings(path)]
+melts_formula.cache_clear()
+reference, t_reference = timed(from_melts_cstr, strings)
+parsed, t_parsed = timed(melts_formula, strings)
+assert all(a == b and str(a) == str(b) for a, b in zip(reference, parsed))
+print(
+    "{} formulae: {:.2f} s, direct {:.2f} s ({:.0f}x)".format(
+        len(strings), t_reference, t_parsed, t_reference / t_parsed
+    )
+)
+#%% experiment folders
+reference, t_reference = timed(reference_import_tables, folders)
+blocks, t_blocks = timed(import_tables, folders)
+assert all(
+    same_table(a, b)
+    for pair_a, pair_b in zip(reference, blocks)
+    for a, b in zip(pair_a, pair_b)
+)
+print(
+    "Experiments: {:.3f} s per folder, block parser {:.3f} s ({:.1f}x)".format(
+        t_reference / len(folders), t_blocks / len(folders), t_reference / t_blocks
+    )
+)
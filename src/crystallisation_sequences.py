@@ -1,120 +1,89 @@
-import pandas as pd
-import numpy as np
+import functools
 from pathlib import Path
 import matplotlib.pyplot as plt
 
 import pyrolite.geochem
 from pyrolite.util.pd import read_table
 
-from pyrolite.util.plot import save_figure
-from pyrolite_meltsutil.tables.load import import_batch_config
+from mod.store import read_store
+from mod.catalog import BatchCatalog
+from mod.build import FigureBuild
 from pyrolite_meltsutil.vis.style import COLORS
-from mod.vis.phasevolumes import _phasevolumes
+from mod.vis.phasevolumes import render_phasevolumes
 
 from mod.sequence import (
     get_appearance_sequence,
-    get_assemblage_sequence,
     sequence_distance,
+    rank_experiments,
 )
 
 outputfolder = Path("../data/experiments")
 
-system, phases = (
-    pd.read_hdf(outputfolder / "system.h5"),
-    pd.read_hdf(outputfolder / "phases.h5"),
-)
-cfg = import_batch_config(outputfolder)
-#%%
-exprs = [
-    hsh
-    for (hsh, (name, c, e)) in cfg.items()
-    if (
-        (c["modes"] == ["isobaric"] and c["H2O"] == 0)
-        and (hsh in phases.experiment.unique())
-    )
-]
-
-fig, ax = _phasevolumes(
-    phases.loc[phases.experiment.isin(exprs)],
-    config=cfg,
-    n_across=4,
-    aspect=1,
-    unit_size=5,
-    exprs=sorted(exprs, key=lambda x: cfg[x][1]["Title"]),
-    legend_on=-2,
-)
+# experiments present in the stores are taken from the aggregation index, such
+# that the stores are only read where figures need to be redrawn
+cfg = BatchCatalog.from_folder(outputfolder)
+build = FigureBuild(outputfolder)
+
+
+@functools.lru_cache(maxsize=None)
+def load_phases():
+    return read_store(outputfolder / "phases.h5", compact=True)
+
 
-ax[-1].axis("off")
-save_figure(fig, name="Batch_Dry", save_at="../img/", save_fmts=["png", "pdf"], dpi=800)
 #%%
-exprs = [
-    hsh
-    for (hsh, (name, c, e)) in cfg.items()
-    if (
-        (c["modes"] == ["isobaric"] and c["H2O"] == 1)
-        and (hsh in phases.experiment.unique())
+# independent figures are drawn in parallel, and only redrawn where experiments
+# have been added or changed; panel data are cached for each experiment
+title_order = lambda exprs: sorted(exprs, key=lambda x: cfg[x][1]["Title"])
+dry = title_order(cfg.select(modes="isobaric", H2O=0))
+wet = title_order(cfg.select(modes="isobaric", H2O=1))
+frac = title_order(cfg.select(modes=["isobaric", "fractionate solids"], H2O=1))
+grid = dict(n_across=4, aspect=1, unit_size=5, legend_on=-2, off=[-1])
+figures = {
+    "Batch_Dry": dict(exprs=dry, **grid),
+    "Batch_1Wt%H2O": dict(exprs=wet, **grid),
+    "Batch_1Wt%H2O_start": dict(
+        exprs=wet[:1],  # only run one, so x axis has temp
+        legend_exprs=wet,
+        n_across=4,
+        aspect=0.8,
+        unit_size=5,
+        legend_on=0,
+        hidden=[1, 2, 3],
+        dpi=1000,
+    ),
+    "Frac_1wt%H2O": dict(exprs=frac, **grid),
+}
+
+
+def phasevolume_figure(name, spec):
+    render_phasevolumes(
+        {name: spec},
+        load_phases(),
+        cfg,
+        save_at="../img/",
+        cache=outputfolder / "figure_cache",
+        processes=1,
+        force=True,
     )
-]
-fig, ax = _phasevolumes(
-    phases.loc[phases.experiment.isin(exprs)],
-    config=cfg,
-    n_across=4,
-    aspect=1,
-    unit_size=5,
-    exprs=sorted(exprs, key=lambda x: cfg[x][1]["Title"]),
-    legend_on=-2,
-)
-ax[-1].axis("off")
-save_figure(
-    fig, name="Batch_1Wt%H2O", save_at="../img/", save_fmts=["png", "pdf"], dpi=800
-)
-fig, ax = _phasevolumes(
-    phases.loc[phases.experiment.isin(exprs)],
-    config=cfg,
-    n_across=4,
-    aspect=0.8,
-    unit_size=5,
-    exprs=[sorted(exprs, key=lambda x: cfg[x][1]["Title"])[0]], # only run one, so x axis has temp
-    legend_on=0,
-)
-[a.set_visible(False) for a in ax[1:]]
-save_figure(
-    fig,
-    name="Batch_1Wt%H2O_start",
-    save_at="../img/",
-    save_fmts=["png", "pdf"],
-    dpi=1000,
-)
 
-#%%
 
-exprs = [
-    hsh
-    for (hsh, (name, c, e)) in cfg.items()
-    if (
-        (c["modes"] == ["isobaric", "fractionate solids"] and c["H2O"] == 1)
-        and (hsh in phases.experiment.unique())
+for name, spec in figures.items():
+    build.register(
+        name,
+        functools.partial(phasevolume_figure, name, spec),
+        experiments=set(spec["exprs"]) | set(spec.get("legend_exprs", [])),
     )
-]
-fig, ax = _phasevolumes(
-    phases.loc[phases.experiment.isin(exprs)],
-    config=cfg,
-    n_across=4,
-    aspect=1,
-    unit_size=5,
-    exprs=sorted(exprs, key=lambda x: cfg[x][1]["Title"]),
-    legend_on=-2,
-)
-ax[-1].axis("off")
-save_figure(
-    fig, name="Frac_1wt%H2O", save_at="../img/", save_fmts=["png", "pdf"], dpi=800
-)
+
+if __name__ == "__main__":  # worker processes may re-import this script
+    print(build.build())
 
 #%%
 from mod.sequence import sequence_distance
 
+phases = load_phases()
+
 sequence_distance(
-    phases.loc[phases.experiment == exprs[0]],
+    phases.loc[phases.experiment == frac[0]],
     ["liquid", "clinopyroxene", "feldspar", "olivine"],
     ignore_trailing=True,
 )
@@ -124,26 +93,34 @@ sequence_distance(
     for e in phases.experiment.unique()
 }
 
-# could use graph edit distance for measuring distance between sequences where
-# multiple things can come in at once
-
-better_models = sorted(
-    [
-        (
-            e,
-            sequence_distance(
-                phases.loc[phases.experiment == e],
-                ["liquid", "olivine", "feldspar", "clinopyroxene", "orthopyroxene",],
-                ignore_trailing=True,
-            )[-1],
-        )
-        for e in phases.experiment.unique()
-    ],
-    key=lambda x: x[1],
+
+better_models = rank_experiments(
+    phases,
+    ["liquid", "olivine", "feldspar", "clinopyroxene", "orthopyroxene",],
+    ignore_trailing=True,
 )
 
-[(cfg[m][1]["Suite"], cfg[m][1]["Title"], d) for m, d in better_models][:10]
+[
+    (cfg[m][1]["Suite"], cfg[m][1]["Title"], d)
+    for m, d in better_models.itertuples(index=False)
+][:10]
 
 fig, ax = plt.subplots(1)
 
-ax.hist2d(*np.array([(dist, cfg[e][1]["H2O"]) for (e, dist) in better_models]).T,)
+ax.hist2d(
+    better_models["distance"],
+    cfg.table.loc[better_models["experiment"], "H2O"],
+)
+
+#%%
+# set-aware distances for sequences where multiple things can come in at once
+set_models = rank_experiments(
+    phases,
+    ["liquid", "olivine", "feldspar", "clinopyroxene", "orthopyroxene",],
+    ignore_trailing=True,
+    metric="set",
+)
+[
+    (cfg[m][1]["Suite"], cfg[m][1]["Title"], d)
+    for m, d in set_models.itertuples(index=False)
+][:10]
@@ -7,48 +7,53 @@ import pyrolite.geochem
 from pyrolite.util.pd import read_table
 
 from pyrolite.util.plot import save_figure
-from pyrolite_meltsutil.tables.load import import_batch_config
+from mod.store import read_store
+from mod.catalog import BatchCatalog
+from mod.build import FigureBuild
 from pyrolite_meltsutil.vis.style import COLORS
 from mod.vis.phasevolumes import _phasevolumes
 
 outputfolder = Path("../data/experiments")
 
-system, phases = (
-    pd.read_hdf(outputfolder / "system.h5"),
-    pd.read_hdf(outputfolder / "phases.h5"),
-)
-cfg = import_batch_config(outputfolder)
+# experiments present in the stores are taken from the aggregation index, such
+# that the stores are only read where figures need to be redrawn
+cfg = BatchCatalog.from_folder(outputfolder)
+build = FigureBuild(outputfolder)
 
 #%%
-exprs = [
-    hsh
-    for (hsh, (name, c, e)) in cfg.items()
-    if (
-        ((c["modes"] == ["isobaric"]) and c["Title"] == "Mr2")
-        and (hsh in phases.experiment.unique())
+exprs = cfg.select(modes="isobaric", Title="Mr2", sort_by="H2O")
+
+
+@build.figure("Mr2_H2O_variation", experiments=exprs)
+def mr2_h2o_variation():
+    phases = read_store(outputfolder / "phases.h5", compact=True)
+    fig, ax = _phasevolumes(
+        phases.loc[phases.experiment.isin(exprs)],
+        config=cfg,
+        n_across=3,
+        aspect=1,
+        unit_size=5,
+        exprs=exprs,
+        cache=outputfolder / "figure_cache",
     )
-]
-
-exprs = sorted(exprs, key=lambda e: cfg[e][1]["H2O"])  # sort by H2O content
-
-fig, ax = _phasevolumes(
-    phases.loc[phases.experiment.isin(exprs)],
-    config=cfg,
-    n_across=3,
-    aspect=1,
-    unit_size=5,
-    exprs=exprs,
-)
-for a, expr in zip(ax, exprs):
-    name, config, env = cfg[expr]
-    a.set_title(
-        "$\mathrm{H_2O="
-        + "{:.1f}".format(np.round(config.get("H2O", 0), 1))
-        + "}$ Wt%",
-        y=1.05,
-        fontsize="x-large",
+    for a, expr in zip(ax, exprs):
+        name, config, env = cfg[expr]
+        a.set_title(
+            "$\mathrm{H_2O="
+            + "{:.1f}".format(np.round(config.get("H2O", 0), 1))
+            + "}$ Wt%",
+            y=1.05,
+            fontsize="x-large",
+        )
+
+    save_figure(
+        fig,
+        name="Mr2_H2O_variation",
+        save_at="../img/",
+        save_fmts=["png", "pdf"],
+        dpi=800,
     )
 
-save_figure(
-    fig, name="Mr2_H2O_variation", save_at="../img/", save_fmts=["png", "pdf"], dpi=800
-)
+
+if __name__ == "__main__":  # worker processes may re-import this script
+    print(build.build())
@@ -0,0 +1,19 @@
+from pathlib import Path
+from mod.store import read_store
+from mod.compact import memory_report, FLOAT32_RTOL
+
+# memory used by the aggregated tables before and after conversion to compact dtypes
+tables = {}
+for outputfolder in [
+    Path("../data/experiments"),
+    Path("../data/experiments_uncertainty"),
+]:
+    for table in ["system", "phases"]:
+        tables["{}/{}".format(outputfolder.name, table)] = read_store(
+            outputfolder / (table + ".h5")
+        )
+#%% lossless compaction (categorical identifiers), as used for the figures
+print(memory_report(tables).to_string(float_format="{:.2f}".format))
+#%% also downcasting compositions to the precision of the alphaMELTS tables
+report = memory_report(tables, rtol=FLOAT32_RTOL)
+print(report.to_string(float_format="{:.2f}".format))
@@ -1,10 +1,16 @@
+import functools
 import pandas as pd
 import numpy as np
 import pyrolite.geochem
 from pyrolite.util.pd import read_table
 from pathlib import Path
 import matplotlib.pyplot as plt
-from pyrolite_meltsutil.tables.load import import_batch_config
+from mod.columnar import read_dataset, dataset_experiments
+from mod.catalog import BatchCatalog
+from mod.build import FigureBuild
+from mod.density import density
+from mod.index import PhaseIndex
+from mod.misfit import MineralReference, score_phases, rank_misfit
 from pyrolite_meltsutil.vis.style import COLORS
 
 from pyrolite.util.plot.style import mappable_from_values
@@ -14,63 +20,79 @@ from pyrolite.util.plot import save_figure, save_axes
 
 outputfolder = Path("../data/experiments")
 
-system, phases = (
-    pd.read_hdf(outputfolder / "system.h5"),
-    pd.read_hdf(outputfolder / "phases.h5"),
+cfg = BatchCatalog.from_folder(
+    outputfolder, present=dataset_experiments(outputfolder / "phases.parquet")
 )
-cfg = import_batch_config(outputfolder)
+build = FigureBuild(outputfolder, save_at="../img")
 
-exprs = [
-    hsh
-    for (hsh, (name, c, e)) in cfg.items()
-    if ((c["modes"] == ["isobaric"]) and (hsh in phases.experiment.unique()))
-]
+exprs = cfg.select(modes="isobaric")
+nexps = len(exprs)
 
-phases = phases.loc[phases.experiment.isin(exprs)]
 
-ndexprs = phases.experiment.isin(
-    [
-        hsh
-        for (hsh, (name, c, e)) in cfg.items()
-        if (c["Title"].startswith("Nd") and (hsh in phases.experiment.unique()))
-    ]
-)
+@functools.lru_cache(maxsize=None)
+def load_phases():
+    # only the isobaric experiments and the phases plotted below are read
+    return read_dataset(
+        outputfolder / "phases.parquet",
+        experiments=exprs,
+        phases=[
+            "clinopyroxene",
+            "orthopyroxene",
+            "spinel",
+            "feldspar",
+            "olivine",
+            "liquid",
+            "cumulate",
+        ],
+        compact=True,
+    )
 
-greenexprs = phases.experiment.isin(
-    [
-        hsh
-        for (hsh, (name, c, e)) in cfg.items()
-        if ((not c["Title"].startswith("Nd")) and (hsh in phases.experiment.unique()))
-    ]
-)
 
-nexps = len(exprs)
+@functools.lru_cache(maxsize=None)
+def phase_index():
+    # rows for each phase and suite are indexed once, rather than masked per plot
+    return PhaseIndex(
+        load_phases(),
+        groups={
+            "Nd": cfg.select(Title=lambda t: t.startswith("Nd")),
+            "green": cfg.select(Title=lambda t: not t.startswith("Nd")),
+        },
+    )
+
+
+# Nd experiments are coloured with plasma, others with viridis
+suites = [("Nd", "plasma"), ("green", "viridis")]
+
+
+def scatter_phase(ax, phase, targets, suite=None, **kwargs):
+    df = phase_index().take(phase, group=suite, columns=targets + ["temperature"])
+    return df[targets].pyroplot.scatter(ax=ax, c=df["temperature"], **kwargs)
+
 
-exp_cpx = phases.phase.isin(["clinopyroxene"])
-exp_opx = phases.phase.isin(["orthopyroxene"])
+def phase_temperatures(phase):
+    return phase_index().take(phase, columns=["temperature"])["temperature"]
 
-exp_spinel = phases.phase.isin(["spinel"])
-exp_feldspar = phases.phase.isin(["feldspar"])
-exp_olivine = phases.phase.isin(["olivine"])
-exp_liquid = phases.phase.isin(["liquid"])
-exp_cumulate = phases.phase.isin(["cumulate"])
 
 #%% load real data
-minchem = read_table("../data/all_traces.csv")
-spinel_chem = read_table("../data/spinel_majors.csv")
-spinel_chem.columns = [c.replace("_pct", "") for c in spinel_chem.columns]
-minchem.columns = [c.replace("_pct", "") for c in minchem.columns]
-minchem = minchem.rename(
-    columns={"2Al/3O": "Al2O3", "2Cr/3O": "Cr2O3", "2V/5O": "V2O5"}
-)
-minchem.pyrochem.compositional = minchem.pyrochem.compositional.apply(
-    pd.to_numeric, errors="coerce"
-)
-minchem = minchem.pyrochem.add_MgNo()
-plag = minchem.Mineral == "plagioclase"
-olivine = minchem.Mineral == "olivine"
-clinopyroxene = minchem.Mineral == "pyroxene"
-orthopyroxene = minchem.Mineral == "orthopyroxene"
+@functools.lru_cache(maxsize=None)
+def load_minchem():
+    minchem = read_table("../data/all_traces.csv")
+    minchem.columns = [c.replace("_pct", "") for c in minchem.columns]
+    minchem = minchem.rename(
+        columns={"2Al/3O": "Al2O3", "2Cr/3O": "Cr2O3", "2V/5O": "V2O5"}
+    )
+    minchem.pyrochem.compositional = minchem.pyrochem.compositional.apply(
+        pd.to_numeric, errors="coerce"
+    )
+    return minchem.pyrochem.add_MgNo()
+
+
+@functools.lru_cache(maxsize=None)
+def load_spinel_chem():
+    spinel_chem = read_table("../data/spinel_majors.csv")
+    spinel_chem.columns = [c.replace("_pct", "") for c in spinel_chem.columns]
+    return spinel_chem
+
 
 #%%
 title_kw = {"y": 0.95, "x": 0.3, "ha": "right", "va": "top"}
@@ -82,126 +104,188 @@ density_kw = dict(
     linewidths=2,
     colors="r",
 )
-#%%
-targets = ["Al2O3", "CaO", "MgO"]
-
-fig, ax = plt.subplots(1, 2, figsize=(8, 4), subplot_kw={"projection": "ternary"})
-ax[0].set_title("Clinopyroxene", **title_kw)
-ax[1].set_title("Orthopyroxene", **title_kw)
+# figures are only redrawn where their inputs have changed
+minchem_csv, spinel_csv = "../data/all_traces.csv", "../data/spinel_majors.csv"
 
-for fltr, cmap in [(ndexprs, "plasma"), (greenexprs, "viridis")]:
-    phases.loc[exp_cpx & fltr, targets].pyroplot.scatter(
-        ax=ax[0], c=phases.loc[exp_cpx & fltr, "temperature"], s=3, cmap=cmap
-    )
-    phases.loc[exp_opx & fltr, targets].pyroplot.scatter(
-        ax=ax[1], c=phases.loc[exp_opx & fltr, "temperature"], s=3, cmap=cmap
-    )
 
-minchem.loc[clinopyroxene, targets].pyroplot.density(ax=ax[0], **density_kw)
-minchem.loc[orthopyroxene, targets].pyroplot.density(ax=ax[1], **density_kw)
+def observed_density(df, mineral, ax=None):
+    # density grids for the observed compositions are cached between builds
+    cache = outputfolder / "figure_cache"
+    return density(df, ax=ax, name=mineral, cache=cache, **density_kw)
 
-plt.tight_layout()
 
-save_figure(
-    fig, name="Pyroxenes-Ternary", save_at="../img", save_fmts=["png", "pdf"], dpi=600
-)
 #%%
-targets = ["Mg#", "Al2O3"]
-fig, ax = plt.subplots(1, 2, sharex=True, sharey=True, figsize=(11, 4))
-ax[0].set_title("Clinopyroxene", fontsize="x-large")
-ax[1].set_title("Orthopyroxene", fontsize="x-large")
-for fltr, cmap in [(ndexprs, "plasma"), (greenexprs, "viridis")]:
-    phases.loc[exp_cpx & fltr, targets].pyroplot.scatter(
-        ax=ax[0], c=phases.loc[exp_cpx & fltr, "temperature"], s=3, cmap=cmap
-    )
-    phases.loc[exp_opx & fltr, targets].pyroplot.scatter(
-        ax=ax[1], c=phases.loc[exp_opx & fltr, "temperature"], s=3, cmap=cmap
+@build.figure("Pyroxenes-Ternary", experiments=exprs, inputs=[minchem_csv])
+def pyroxenes_ternary():
+    minchem = load_minchem()
+    targets = ["Al2O3", "CaO", "MgO"]
+
+    fig, ax = plt.subplots(1, 2, figsize=(8, 4), subplot_kw={"projection": "ternary"})
+    ax[0].set_title("Clinopyroxene", **title_kw)
+    ax[1].set_title("Orthopyroxene", **title_kw)
+
+    for suite, cmap in suites:
+        scatter_phase(ax[0], "clinopyroxene", targets, suite, s=3, cmap=cmap)
+        scatter_phase(ax[1], "orthopyroxene", targets, suite, s=3, cmap=cmap)
+
+    cpx, opx = minchem.Mineral == "pyroxene", minchem.Mineral == "orthopyroxene"
+    observed_density(minchem.loc[cpx, targets], "clinopyroxene", ax=ax[0])
+    observed_density(minchem.loc[opx, targets], "orthopyroxene", ax=ax[1])
+
+    plt.tight_layout()
+
+    save_figure(
+        fig,
+        name="Pyroxenes-Ternary",
+        save_at="../img",
+        save_fmts=["png", "pdf"],
+        dpi=600,
     )
 
-minchem.loc[clinopyroxene, targets].pyroplot.density(ax=ax[0], **density_kw)
-minchem.loc[orthopyroxene, targets].pyroplot.density(ax=ax[1], **density_kw)
-ax[0].set_ylim(0, 6)
 
-plt.subplots_adjust(wspace=0.2)
-cb = fig.colorbar(mappable_from_values(phases.loc[exp_opx, "temperature"]), ax=ax)
-cb.set_label("Temperature", rotation=270, labelpad=20)
-save_figure(fig, name="Pyroxenes", save_at="../img", save_fmts=["png", "pdf"], dpi=800)
+#%%
+@build.figure("Pyroxenes", experiments=exprs, inputs=[minchem_csv])
+def pyroxenes():
+    minchem = load_minchem()
+    targets = ["Mg#", "Al2O3"]
+    fig, ax = plt.subplots(1, 2, sharex=True, sharey=True, figsize=(11, 4))
+    ax[0].set_title("Clinopyroxene", fontsize="x-large")
+    ax[1].set_title("Orthopyroxene", fontsize="x-large")
+    for suite, cmap in suites:
+        scatter_phase(ax[0], "clinopyroxene", targets, suite, s=3, cmap=cmap)
+        scatter_phase(ax[1], "orthopyroxene", targets, suite, s=3, cmap=cmap)
+
+    cpx, opx = minchem.Mineral == "pyroxene", minchem.Mineral == "orthopyroxene"
+    observed_density(minchem.loc[cpx, targets], "clinopyroxene", ax=ax[0])
+    observed_density(minchem.loc[opx, targets], "orthopyroxene", ax=ax[1])
+    ax[0].set_ylim(0, 6)
+
+    plt.subplots_adjust(wspace=0.2)
+    cb = fig.colorbar(mappable_from_values(phase_temperatures("orthopyroxene")), ax=ax)
+    cb.set_label("Temperature", rotation=270, labelpad=20)
+    save_figure(
+        fig, name="Pyroxenes", save_at="../img", save_fmts=["png", "pdf"], dpi=800
+    )
+
 
 #%%
-targets = ["Al2O3", "CaO", "Na2O"]
+@build.figure("Feldspar", experiments=exprs, inputs=[minchem_csv])
+def feldspar():
+    minchem = load_minchem()
+    targets = ["Al2O3", "CaO", "Na2O"]
+
+    fig, ax = plt.subplots(1)
+    ax.set_title("Plagoiclase", **title_kw)
+    plag = minchem.Mineral == "plagioclase"
+    ax = observed_density(minchem.loc[plag, targets], "plagioclase", ax=ax)
+    ax = scatter_phase(ax, "feldspar", targets)
+
+    save_figure(
+        fig, name="Feldspar", save_at="../img", save_fmts=["png", "pdf"], dpi=800
+    )
 
-fig, ax = plt.subplots(1)
-ax.set_title("Plagoiclase", **title_kw)
-ax = minchem.loc[plag, targets].pyroplot.density(ax=ax, **density_kw)
-ax = phases.loc[exp_feldspar, targets].pyroplot.scatter(
-    ax=ax, c=phases.loc[exp_feldspar, "temperature"],
-)
 
-save_figure(fig, name="Feldspar", save_at="../img", save_fmts=["png", "pdf"], dpi=800)
 #%%
-targets = ["Cr2O3", "Al2O3", "FeO"]
+@build.figure("Spinel", experiments=exprs, inputs=[spinel_csv])
+def spinel():
+    spinel_chem = load_spinel_chem()
+    targets = ["Cr2O3", "Al2O3", "FeO"]
 
-fig, ax = plt.subplots(1, 2, subplot_kw={"projection": "ternary"}, figsize=(8, 4))
+    fig, ax = plt.subplots(1, 2, subplot_kw={"projection": "ternary"}, figsize=(8, 4))
 
-for fltr, cmap in [(ndexprs, "plasma"), (greenexprs, "viridis")]:
-    phases.loc[exp_spinel & fltr, targets].pyroplot.scatter(
-        ax=ax[0], c=phases.loc[exp_spinel & fltr, "temperature"], s=3, cmap=cmap
-    )
+    for suite, cmap in suites:
+        scatter_phase(ax[0], "spinel", targets, suite, s=3, cmap=cmap)
 
-spinel_chem.loc[:, targets].pyroplot.density(ax=ax[0], **density_kw)
+    observed_density(spinel_chem.loc[:, targets], "spinel", ax=ax[0])
 
-targets = ["Cr2O3", "Al2O3", "MgO"]
-for fltr, cmap in [(ndexprs, "plasma"), (greenexprs, "viridis")]:
-    phases.loc[exp_spinel & fltr, targets].pyroplot.scatter(
-        ax=ax[1], c=phases.loc[exp_spinel & fltr, "temperature"], s=3, cmap=cmap
-    )
+    targets = ["Cr2O3", "Al2O3", "MgO"]
+    for suite, cmap in suites:
+        scatter_phase(ax[1], "spinel", targets, suite, s=3, cmap=cmap)
+
+    observed_density(spinel_chem.loc[:, targets], "spinel", ax=ax[1])
+    plt.tight_layout()
+    save_figure(fig, name="Spinel", save_at="../img", save_fmts=["png", "pdf"], dpi=800)
 
-spinel_chem.loc[:, targets].pyroplot.density(ax=ax[1], **density_kw)
-plt.tight_layout()
-save_figure(fig, name="Spinel", save_at="../img", save_fmts=["png", "pdf"], dpi=800)
 
 #%%
-targets = ["Mg#", "FeO"]
-"""
-ax = phases.loc[exp_liquid, targets].pyroplot.scatter(
-    c=phases.loc[exp_liquid, "temperature"], cmap="plasma"
+@build.figure(
+    "Olivine",
+    experiments=exprs,
+    inputs=[minchem_csv],
+    outputs=["Olivine", "Olivine-Zoom"],
 )
-"""
-ax = minchem.loc[olivine, targets].pyroplot.density(**density_kw)
-phases.loc[exp_olivine, :].pyrochem.oxides.describe()
-for fltr, cmap in [(ndexprs, "plasma"), (greenexprs, "viridis")]:
-    phases.loc[exp_olivine & fltr, targets].pyroplot.scatter(
-        ax=ax, c=phases.loc[exp_olivine & fltr, "temperature"], s=3, cmap=cmap
+def olivine():
+    minchem = load_minchem()
+    targets = ["Mg#", "FeO"]
+    """
+    ax = phases.loc[exp_liquid, targets].pyroplot.scatter(
+        c=phases.loc[exp_liquid, "temperature"], cmap="plasma"
     )
+    """
+    ax = observed_density(minchem.loc[minchem.Mineral == "olivine", targets], "olivine")
+    for suite, cmap in suites:
+        scatter_phase(ax, "olivine", targets, suite, s=3, cmap=cmap)
 
-ax.set_title("Olivine", **{**title_kw, "x": 0.9, "y": 0.9})
+    ax.set_title("Olivine", **{**title_kw, "x": 0.9, "y": 0.9})
+
+    cb = add_colorbar(mappable_from_values(phase_temperatures("olivine")), ax=ax)
+    cb.set_label("Temperature", rotation=270, labelpad=20)
+
+    save_figure(
+        ax.figure, name="Olivine", save_at="../img", save_fmts=["png", "pdf"], dpi=600
+    )
+    ax.set(xlim=(0.65, 0.9), ylim=(14, 27))
+    save_figure(
+        ax.figure,
+        name="Olivine-Zoom",
+        save_at="../img",
+        save_fmts=["png", "pdf"],
+        dpi=600,
+    )
 
-cb = add_colorbar(mappable_from_values(phases.loc[exp_olivine, "temperature"]), ax=ax,)
-cb.set_label("Temperature", rotation=270, labelpad=20)
 
-save_figure(
-    ax.figure, name="Olivine", save_at="../img", save_fmts=["png", "pdf"], dpi=600
-)
-ax.set(xlim=(0.65, 0.9), ylim=(14, 27))
-save_figure(
-    ax.figure, name="Olivine-Zoom", save_at="../img", save_fmts=["png", "pdf"], dpi=600
-)
 #%%
-targets = ["Al2O3", "MgO", "FeO"]
-fig, ax = plt.subplots(2, 1, figsize=(4, 8), subplot_kw={"projection": "ternary"})
+@build.figure("Liquid-Cumulate", experiments=exprs)
+def liquid_cumulate():
+    targets = ["Al2O3", "MgO", "FeO"]
+    fig, ax = plt.subplots(2, 1, figsize=(4, 8), subplot_kw={"projection": "ternary"})
 
-ax[0].set_title("Liqiud", **title_kw)
-ax[1].set_title("Cumulate", **title_kw)
+    ax[0].set_title("Liqiud", **title_kw)
+    ax[1].set_title("Cumulate", **title_kw)
 
-for fltr, cmap in [(ndexprs, "plasma"), (greenexprs, "viridis")]:
-    phases.loc[exp_liquid & fltr, targets].pyroplot.scatter(
-        ax=ax[0], c=phases.loc[exp_liquid & fltr, "temperature"], s=3, cmap=cmap
-    )
-    phases.loc[exp_cumulate & fltr, targets].pyroplot.scatter(
-        ax=ax[1], c=phases.loc[exp_cumulate & fltr, "temperature"], s=3, cmap=cmap
+    for suite, cmap in suites:
+        scatter_phase(ax[0], "liquid", targets, suite, s=3, cmap=cmap)
+        scatter_phase(ax[1], "cumulate", targets, suite, s=3, cmap=cmap)
+    plt.tight_layout()
+
+    save_figure(
+        fig, name="Liquid-Cumulate", save_at="../img", save_fmts=["png", "pdf"], dpi=600
     )
-plt.tight_layout()
 
-save_figure(
-    fig, name="Liquid-Cumulate", save_at="../img", save_fmts=["png", "pdf"], dpi=600
-)
+
+#%% misfit of the modelled minerals to the observed compositions
+def misfit_references():
+    minchem, spinel_chem = load_minchem(), load_spinel_chem()
+    cpx, opx = minchem.Mineral == "pyroxene", minchem.Mineral == "orthopyroxene"
+    plag, ol = minchem.Mineral == "plagioclase", minchem.Mineral == "olivine"
+    return [
+        MineralReference(minchem.loc[cpx], ["Al2O3", "CaO", "MgO"], "clinopyroxene"),
+        MineralReference(minchem.loc[opx], ["Al2O3", "CaO", "MgO"], "orthopyroxene"),
+        MineralReference(minchem.loc[plag], ["Al2O3", "CaO", "Na2O"], "feldspar"),
+        MineralReference(spinel_chem, ["Cr2O3", "Al2O3", "FeO", "MgO"], "spinel"),
+        # Mg# isn't compositional, so olivine is compared in standardised units
+        MineralReference(minchem.loc[ol], ["Mg#", "FeO"], "olivine", space="standard"),
+    ]
+
+
+def misfit(metric="distance"):
+    scores = score_phases(load_phases(), misfit_references())
+    ranked = rank_misfit(scores, metric=metric)
+    ranked.join(cfg.table[["name", "Title"]]).to_csv(outputfolder / "misfit.csv")
+    return ranked
+
+
+#%%
+if __name__ == "__main__":  # worker processes may re-import this script
+    print(build.build())
+    print(misfit().head(20))
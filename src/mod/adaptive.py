@@ -0,0 +1,354 @@
+"""
+Adaptive early stopping for Monte Carlo uncertainty studies, where replicates are
+run in rounds and outcome statistics are updated incrementally until their
+confidence intervals are within a tolerance.
+"""
+import numpy as np
+import pandas as pd
+import scipy.stats
+from pyrolite_meltsutil.util.log import Handle
+from .aggregate import stream_tables
+from .sequence import appearance_table, rank_experiments
+
+logger = Handle(__name__)
+
+
+class RunningStats(object):
+    """
+    Streaming mean and variance (Welford's algorithm).
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def update(self, values):
+        """
+        Update the statistics with a batch of values.
+
+        Parameters
+        -----------
+        values : :class:`numpy.ndarray`
+            Values to add.
+        """
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[np.isfinite(values)]
+        if not values.size:
+            return
+        # combine with the batch statistics (Chan et al.)
+        n, mean = values.size, values.mean()
+        m2 = ((values - mean) ** 2).sum()
+        delta = mean - self.mean
+        total = self.count + n
+        self.mean += delta * n / total
+        self._m2 += m2 + delta ** 2 * self.count * n / total
+        self.count = total
+
+    @property
+    def variance(self):
+        """
+        Sample variance.
+        """
+        return self._m2 / (self.count - 1) if self.count > 1 else np.nan
+
+    def interval(self, confidence=0.95):
+        """
+        Half-width of the confidence interval for the mean.
+
+        Parameters
+        -----------
+        confidence : :class:`float`
+            Confidence level.
+
+        Returns
+        -------
+        :class:`float`
+        """
+        if self.count < 2:
+            return np.inf
+        t = scipy.stats.t.ppf(0.5 + confidence / 2, self.count - 1)
+        return t * np.sqrt(self.variance / self.count)
+
+
+class P2Quantile(object):
+    """
+    Streaming estimate of a quantile with constant memory (the P² algorithm of
+    Jain and Chlamtac, 1985).
+
+    Parameters
+    -----------
+    q : :class:`float`
+        Quantile to estimate.
+    """
+
+    def __init__(self, q):
+        self.q = q
+        self._initial = []
+        self._heights = None
+        self._positions = None
+        self._desired = None
+        self._increments = np.array([0, q / 2, q, (1 + q) / 2, 1])
+
+    def update(self, values):
+        """
+        Update the estimate with a batch of values.
+
+        Parameters
+        -----------
+        values : :class:`numpy.ndarray`
+            Values to add.
+        """
+        for x in np.asarray(values, dtype=float).ravel():
+            if np.isfinite(x):
+                self._add(x)
+
+    def _add(self, x):
+        if self._heights is None:
+            self._initial.append(x)
+            if len(self._initial) == 5:
+                self._heights = np.sort(self._initial)
+                self._positions = np.arange(1.0, 6.0)
+                q = self.q
+                self._desired = np.array([1, 1 + 2 * q, 1 + 4 * q, 3 + 2 * q, 5])
+            return
+        h, n = self._heights, self._positions
+        if x < h[0]:
+            h[0] = x
+            k = 0
+        elif x >= h[4]:
+            h[4] = x
+            k = 3
+        else:
+            k = np.searchsorted(h, x, side="right") - 1
+        n[k + 1 :] += 1
+        self._desired += self._increments
+        for i in range(1, 4):
+            d = self._desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = np.sign(d)
+                # piecewise-parabolic prediction, falling back to linear
+                hp = h[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (h[i + 1] - h[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (h[i] - h[i - 1]) / (n[i] - n[i - 1])
+                )
+                if not h[i - 1] < hp < h[i + 1]:
+                    j = i + int(d)
+                    hp = h[i] + d * (h[j] - h[i]) / (n[j] - n[i])
+                h[i] = hp
+                n[i] += d
+
+    @property
+    def value(self):
+        """
+        Current estimate of the quantile.
+        """
+        if self._heights is None:
+            if not self._initial:
+                return np.nan
+            return np.quantile(self._initial, self.q)
+        return self._heights[2]
+
+
+class StreamingSummary(object):
+    """
+    Streaming summary of a set of named outcome statistics, each with a running
+    mean and variance and quantile sketches.
+
+    Parameters
+    -----------
+    quantiles : :class:`list`
+        Quantiles to estimate for each statistic.
+    confidence : :class:`float`
+        Confidence level for intervals on the means.
+    """
+
+    def __init__(self, quantiles=[0.1, 0.5, 0.9], confidence=0.95):
+        self.quantiles = quantiles
+        self.confidence = confidence
+        self.samples = 0
+        self.stats = {}
+        self.sketches = {}
+
+    def update(self, values, samples):
+        """
+        Update the summary with the outcomes of a round of samples.
+
+        Parameters
+        -----------
+        values : :class:`dict`
+            Dictionary of arrays of values for each statistic.
+        samples : :class:`int`
+            Number of samples within the round.
+        """
+        self.samples += samples
+        for name, v in values.items():
+            if name not in self.stats:
+                self.stats[name] = RunningStats()
+                self.sketches[name] = [P2Quantile(q) for q in self.quantiles]
+            self.stats[name].update(v)
+            for sketch in self.sketches[name]:
+                sketch.update(v)
+
+    def table(self):
+        """
+        Summarise the statistics.
+
+        Returns
+        -------
+        :class:`pandas.DataFrame`
+            Count, mean, standard deviation, confidence interval half-width and
+            quantiles for each statistic, which is empty before any are observed.
+        """
+        columns = ["statistic", "count", "mean", "std", "interval"]
+        columns += ["q{:g}".format(q) for q in self.quantiles]
+        rows = []
+        for name, stats in self.stats.items():
+            row = {
+                "statistic": name,
+                "count": stats.count,
+                "mean": stats.mean,
+                "std": np.sqrt(stats.variance),
+                "interval": stats.interval(self.confidence),
+            }
+            row.update(
+                {"q{:g}".format(s.q): s.value for s in self.sketches[name]}
+            )
+            rows.append(row)
+        return pd.DataFrame(rows, columns=columns).set_index("statistic")
+
+    def converged(self, tolerance, tolerances={}, min_fraction=0.1):
+        """
+        Check whether the confidence intervals on the means of the statistics are
+        within tolerance.
+
+        Parameters
+        -----------
+        tolerance : :class:`float`
+            Tolerance for the interval half-widths.
+        tolerances : :class:`dict`
+            Tolerances for specific statistics, overriding the default.
+        min_fraction : :class:`float`
+            Statistics observed in fewer than this fraction of samples (e.g. the
+            appearance of a rare phase) aren't required to converge.
+
+        Returns
+        -------
+        :class:`bool`
+        """
+        if not self.stats:
+            return False
+        for name, stats in self.stats.items():
+            if stats.count < min_fraction * self.samples:
+                continue
+            if stats.interval(self.confidence) > tolerances.get(name, tolerance):
+                return False
+        return True
+
+
+def outcome_statistics(
+    folders,
+    target_sequence,
+    ignore=["bulk", "cumulate", "solid"],
+    processes=None,
+):
+    """
+    Calculate outcome statistics for a set of experiment folders: the appearance
+    temperature of each phase and the sequence distance to a target sequence.
+
+    Parameters
+    -----------
+    folders : :class:`list`
+        Experiment folders.
+    target_sequence : :class:`list`
+        Target sequence of phases (see :func:`mod.sequence.rank_experiments`).
+    ignore : :class:`list`
+        Phases to ignore.
+    processes : :class:`int`
+        Number of worker processes to parse the experiment folders with.
+
+    Returns
+    -------
+    :class:`dict`
+        Dictionary of arrays of values for each statistic.
+    """
+    values = {}
+    for _, phases in stream_tables(folders, processes=processes):
+        table = appearance_table(phases, ignore=ignore)
+        for phaseID, first in table.groupby("phaseID", sort=False)["first"]:
+            values.setdefault("T({})".format(phaseID), []).append(first.values)
+        ranked = rank_experiments(
+            phases, target_sequence, ignore_trailing=True, ignore=ignore
+        )
+        values.setdefault("distance", []).append(ranked["distance"].values)
+    return {k: np.concatenate(v) for k, v in values.items()}
+
+
+def run_adaptive(
+    sampler,
+    run,
+    evaluate,
+    tolerance,
+    tolerances={},
+    round_size=16,
+    max_samples=1024,
+    min_rounds=2,
+    start=0,
+    summary=None,
+):
+    """
+    Run replicates in rounds until the confidence intervals on the outcome
+    statistics are within tolerance, or the maximum number of samples is reached.
+
+    Parameters
+    -----------
+    sampler : :class:`mod.sampling.CompositionSampler`
+        Sampler for replicates.
+    run : :class:`callable`
+        Function to run a dataframe of replicates, returning the experiment folders
+        for those which are complete, including any skipped as already run.
+    evaluate : :class:`callable`
+        Function to calculate outcome statistics for a list of experiment folders
+        (e.g. :func:`outcome_statistics`).
+    tolerance : :class:`float`
+        Tolerance for the confidence interval half-widths.
+    tolerances : :class:`dict`
+        Tolerances for specific statistics (e.g. :code:`{"distance": 0.1}`).
+    round_size : :class:`int`
+        Number of replicates per round.
+    max_samples : :class:`int`
+        Maximum number of replicates.
+    min_rounds : :class:`int`
+        Minimum number of rounds before stopping.
+    start : :class:`int`
+        Index of the first replicate, such that a study can be resumed.
+    summary : :class:`StreamingSummary`
+        Summary to update, where resuming a study.
+
+    Returns
+    -------
+    :class:`StreamingSummary`
+    """
+    summary = summary or StreamingSummary()
+    rounds = 0
+    stop = start + max_samples
+    while start < stop:
+        end = min(start + round_size, stop)
+        folders = run(sampler.sample(start, end))
+        summary.update(evaluate(folders), samples=end - start)
+        rounds += 1
+        start = end
+        if not summary.stats:  # e.g. where every experiment of the round failed
+            logger.warning(
+                "Round {}: {} samples, no outcomes yet.".format(rounds, summary.samples)
+            )
+            continue
+        logger.info(
+            "Round {}: {} samples, widest interval {:.3g}.".format(
+                rounds, summary.samples, summary.table()["interval"].max()
+            )
+        )
+        if rounds >= min_rounds and summary.converged(tolerance, tolerances):
+            logger.info("Converged after {} samples.".format(summary.samples))
+            break
+    return summary
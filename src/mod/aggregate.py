@@ -0,0 +1,328 @@
+"""
+Streaming, parallel aggregation of alphaMELTS experiment folders to on-disk stores.
+"""
+import os
+import json
+import itertools
+import functools
+from pathlib import Path
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from pyrolite_meltsutil.util.log import Handle
+from .tables import import_tables, import_traces
+from .store import append_chunk, drop_experiments, _normalise_index
+from .cache import OUTPUTS, file_digest
+
+INDEX = "aggregate.json"
+
+logger = Handle(__name__)
+
+
+def experiment_folders(outputfolder, validate_path=lambda x: len(x.name) == 10):
+    """
+    Find the experiment folders within an output folder.
+
+    Parameters
+    -----------
+    outputfolder : :class:`str` | :class:`pathlib.Path`
+        Folder containing experiment folders.
+    validate_path :
+        Function to validate path names.
+
+    Returns
+    -------
+    :class:`list`
+        Sorted list of experiment folders.
+    """
+    return sorted(
+        x for x in Path(outputfolder).iterdir() if (x.is_dir() and validate_path(x))
+    )
+
+
+def folder_signature(folder, checksums=False):
+    """
+    Get a signature for the output tables within an experiment folder, such that
+    changes to the folder can be detected.
+
+    Parameters
+    -----------
+    folder : :class:`str` | :class:`pathlib.Path`
+        Experiment folder.
+    checksums : :class:`bool`
+        Whether to use checksums of the tables, rather than their sizes and
+        modification times.
+
+    Returns
+    -------
+    :class:`dict`
+        Dictionary of signatures for each table present.
+    """
+    folder = Path(folder)
+    signature = {}
+    for name in OUTPUTS:
+        path = folder / name
+        if path.exists():
+            if checksums:
+                signature[name] = file_digest(path)
+            else:
+                stat = path.stat()
+                signature[name] = [stat.st_size, stat.st_mtime_ns]
+    return signature
+
+
+def read_index(path):
+    """
+    Read the index of experiments ingested into a pair of stores.
+
+    Parameters
+    -----------
+    path : :class:`str` | :class:`pathlib.Path`
+        Path to the index.
+
+    Returns
+    -------
+    :class:`dict`
+        Dictionary of experiment records, with the chunk each was written to and
+        the folder signature (see :func:`folder_signature`) at ingestion.
+    """
+    try:
+        with open(str(path), "r") as f:
+            return json.loads(f.read())
+    except (OSError, ValueError):
+        return {}
+
+
+def write_index(path, index):
+    """
+    Write the index of experiments ingested into a pair of stores.
+
+    Parameters
+    -----------
+    path : :class:`str` | :class:`pathlib.Path`
+        Path to the index.
+    index : :class:`dict`
+        Dictionary of experiment records.
+    """
+    path = Path(path)
+    tmp = path.parent / (path.name + ".tmp")
+    with open(str(tmp), "w") as f:
+        f.write(json.dumps(index, indent=1, sort_keys=True))
+    os.replace(str(tmp), str(path))
+
+
+def import_experiment(path, kelvin=False, traces=False):
+    """
+    Import the system and phase tables for an experiment folder, labelled with the
+    experiment name. Used as the unit of work for worker processes.
+
+    Parameters
+    -----------
+    path : :class:`pathlib.Path`
+        Experiment folder.
+    kelvin : :class:`bool`
+        Whether to keep temperatures in kelvin.
+    traces : :class:`bool`
+        Whether to also import the trace element table (see
+        :func:`mod.tables.import_traces`).
+
+    Returns
+    -------
+    :class:`tuple`
+        Experiment name, system table, phase table (and trace table, where traces
+        are imported) and error message (:code:`None` where the import succeeded,
+        otherwise the tables are :code:`None`).
+    """
+    path = Path(path)
+    try:
+        tables = list(import_tables(path, kelvin=kelvin))
+        if traces:
+            tables.append(import_traces(path, kelvin=kelvin))
+    except Exception as e:
+        return (path.name, *[None] * (2 + traces), str(e))
+    for ix, df in enumerate(tables):
+        df["experiment"] = path.name
+        df = df.reindex(
+            columns=["experiment"] + [c for c in df.columns if c != "experiment"]
+        )
+        tables[ix] = _normalise_index(df)  # namedtuple indexes can't be pickled
+    return (path.name, *tables, None)
+
+
+def _bounded_map(pool, func, items, inflight):
+    """
+    Map a function over items with a pool, keeping at most a fixed number of items
+    in flight such that results don't accumulate faster than they're consumed.
+
+    Parameters
+    -----------
+    pool : :class:`concurrent.futures.Executor`
+        Pool to submit to.
+    func : :class:`callable`
+        Function to map.
+    items
+        Iterable of items.
+    inflight : :class:`int`
+        Maximum number of submitted items awaiting consumption.
+
+    Yields
+    -------
+    Results of the function, in order.
+    """
+    items = iter(items)
+    pending = deque(pool.submit(func, i) for i in itertools.islice(items, inflight))
+    while pending:
+        result = pending.popleft().result()
+        pending.extend(pool.submit(func, i) for i in itertools.islice(items, 1))
+        yield result
+
+
+def stream_tables(folders, processes=None, chunksize=50, kelvin=False, traces=False):
+    """
+    Parse experiment folders in a pool of worker processes, yielding aggregated
+    tables a chunk at a time.
+
+    Parameters
+    -----------
+    folders : :class:`list`
+        Experiment folders to parse.
+    processes : :class:`int`
+        Number of worker processes, defaulting to the number of cores.
+    chunksize : :class:`int`
+        Number of experiments per chunk.
+    kelvin : :class:`bool`
+        Whether to keep temperatures in kelvin.
+    traces : :class:`bool`
+        Whether to also parse the trace element tables.
+
+    Yields
+    -------
+    :class:`tuple`
+        System and phase tables (and trace tables, where traces are parsed) for a
+        chunk of experiments.
+    """
+    processes = processes or os.cpu_count()
+    func = functools.partial(import_experiment, kelvin=kelvin, traces=traces)
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        results = _bounded_map(pool, func, folders, inflight=2 * processes)
+        while True:
+            chunk = list(itertools.islice(results, chunksize))
+            if not chunk:
+                break
+            tables = [[] for _ in range(2 + traces)]
+            for name, *frames, error in chunk:
+                if error is not None:
+                    logger.warning("{} at {}.".format(error, name))  # record the error
+                    continue
+                for table, df in zip(tables, frames):
+                    table.append(df)
+            if tables[0]:
+                yield tuple(pd.concat(table, sort=False) for table in tables)
+
+
+def aggregate_to_store(
+    outputfolder,
+    system_store=None,
+    phases_store=None,
+    processes=None,
+    chunksize=50,
+    kelvin=False,
+    incremental=False,
+    checksums=False,
+    traces=False,
+    traces_store=None,
+):
+    """
+    Aggregate the tables from the experiment folders within an output folder,
+    streaming chunks of experiments to appendable stores (see
+    :func:`mod.store.append_chunk`) such that peak memory is bounded by the chunk
+    size rather than the number of experiments.
+
+    Parameters
+    -----------
+    outputfolder : :class:`str` | :class:`pathlib.Path`
+        Folder containing experiment folders.
+    system_store, phases_store : :class:`str` | :class:`pathlib.Path`
+        Paths for the system and phase stores, defaulting to :code:`system.h5` and
+        :code:`phases.h5` within the output folder.
+    processes : :class:`int`
+        Number of worker processes, defaulting to the number of cores.
+    chunksize : :class:`int`
+        Number of experiments per chunk.
+    kelvin : :class:`bool`
+        Whether to keep temperatures in kelvin.
+    incremental : :class:`bool`
+        Whether to update existing stores, parsing only the experiment folders which
+        are new or have changed since they were last ingested and removing the rows
+        for folders which no longer exist. Otherwise, existing stores are replaced.
+    checksums : :class:`bool`
+        Whether to detect changes with checksums of the tables, rather than their
+        sizes and modification times.
+    traces : :class:`bool`
+        Whether to also aggregate the trace element tables (see
+        :func:`mod.tables.import_traces`) to a store of their own, with chunks
+        aligned to those of the system and phase stores. As the stores share an
+        index, traces should be aggregated for each update once they're included.
+    traces_store : :class:`str` | :class:`pathlib.Path`
+        Path for the trace store, defaulting to :code:`traces.h5` within the output
+        folder.
+
+    Returns
+    -------
+    :class:`int`
+        Number of experiments aggregated.
+
+    Notes
+    -----
+    The experiments ingested into the stores are recorded in an index
+    (:code:`aggregate.json`) next to the phase store.
+    """
+    outputfolder = Path(outputfolder)
+    system_store = Path(system_store or outputfolder / "system.h5")
+    phases_store = Path(phases_store or outputfolder / "phases.h5")
+    index_path = phases_store.parent / INDEX
+    stores = [system_store, phases_store]
+    if traces:
+        stores.append(Path(traces_store or outputfolder / "traces.h5"))
+    index = read_index(index_path)
+    if not (incremental and index and all(s.exists() for s in stores)):
+        for path in stores + [index_path]:
+            if path.exists():
+                path.unlink()
+        index = {}
+
+    folders = experiment_folders(outputfolder)
+    signatures = {f.name: folder_signature(f, checksums=checksums) for f in folders}
+    stale = [
+        name
+        for name, record in index.items()
+        if signatures.get(name) != record["signature"]
+    ]
+    if stale:
+        keys = {index[name]["chunk"] for name in stale}
+        for path in stores:
+            drop_experiments(path, stale, keys=keys)
+        for name in stale:
+            index.pop(name)
+        write_index(index_path, index)
+        logger.info("Removed {} changed or deleted experiments.".format(len(stale)))
+
+    folders = [f for f in folders if f.name not in index]
+    logger.info(
+        "Skipping {} ingested experiments, aggregating {}.".format(
+            len(index), len(folders)
+        )
+    )
+    count = 0
+    for system, *tables in stream_tables(
+        folders, processes=processes, chunksize=chunksize, kelvin=kelvin, traces=traces
+    ):
+        key = append_chunk(system_store, system)
+        for path, df in zip(stores[1:], tables):
+            append_chunk(path, df, key=key)
+        for name in system.experiment.unique():
+            index[name] = {"chunk": key, "signature": signatures[name]}
+        write_index(index_path, index)  # such that an interrupted run can resume
+        count += system.experiment.nunique()
+        logger.info("Aggregated {} experiments.".format(count))
+    return count
@@ -0,0 +1,409 @@
+"""
+Parallel execution of batches of alphaMELTS experiments.
+"""
+import os
+import json
+import time
+import logging
+import signal
+import datetime
+import threading
+import subprocess
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from pyrolite_meltsutil import automation
+from pyrolite_meltsutil.automation import MeltsBatch, MeltsExperiment
+from pyrolite_meltsutil.automation.process import MeltsProcess
+from pyrolite_meltsutil.meltsfile import dict_to_meltsfile
+from pyrolite_meltsutil.parse import read_envfile
+from . import cache
+from .telemetry import METRICS, BatchProgress, append_metrics, experiment_metrics
+
+
+def expected_steps(exp, env):
+    """
+    Estimate the number of calculation steps for an experiment from its
+    temperature range and temperature increment.
+
+    Parameters
+    -----------
+    exp : :class:`dict`
+        Experiment configuration.
+    env : :class:`pyrolite_meltsutil.env.MELTS_Env` | :class:`dict`
+        Environment for the experiment, or a dictionary of environment variables.
+
+    Returns
+    -------
+    :class:`float`
+        Expected number of steps.
+    """
+    variables = env if isinstance(env, dict) else env.dump()
+    deltaT = abs(float(variables.get("DELTAT") or 10.0)) or 10.0
+    T0 = exp.get("Initial Temperature", 0.0)
+    T1 = exp.get("Final Temperature", T0)
+    return abs(T0 - T1) / deltaT + 1
+
+
+def _ignore_interrupt():
+    """
+    Leave handling of interrupts to the parent process, which cancels pending
+    experiments.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _run_experiment(
+    hsh,
+    title,
+    exp,
+    envfile,
+    fromdir,
+    exclude=[],
+    superliquidus_start=True,
+    timeout=None,
+    executable=None,
+):
+    """
+    Run a single experiment within its own folder. Used as the unit of work for
+    worker processes.
+
+    Parameters
+    -----------
+    hsh : :class:`str`
+        Experiment hash, used for the experiment folder name.
+    title : :class:`str`
+        Experiment title, used for the meltsfile name.
+    exp : :class:`dict`
+        Experiment configuration.
+    envfile : :class:`str`
+        Multiline string representation of the environment file.
+    fromdir : :class:`pathlib.Path`
+        Directory to create the experiment folder in.
+    exclude : :class:`list`
+        Phases to exclude.
+    superliquidus_start : :class:`bool`
+        Whether to start the calculation above the liquidus.
+    timeout : :class:`float`
+        Timeout for the alphaMELTS process.
+    executable : :class:`str` | :class:`pathlib.Path`
+        alphaMELTS executable to use, defaulting to the local installation.
+
+    Returns
+    -------
+    :class:`tuple`
+        Experiment hash, status (:code:`"completed"`, :code:`"incomplete"` or
+        :code:`"failed"`), wall time in seconds and run metrics (see
+        :func:`mod.telemetry.experiment_metrics`).
+
+    Notes
+    -----
+    A completion manifest is written to the experiment folder once alphaMELTS
+    exits (see :func:`mod.cache.write_manifest`). Run metrics are parsed from the
+    folder by the worker, such that parsing logfiles doesn't hold up the batch.
+    """
+    started = time.time()
+    config = exp
+    exp = {k: v for k, v in exp.items() if k != "exclude"}
+    meltsfile = dict_to_meltsfile(exp, modes=exp["modes"], exclude=exclude)
+    M = MeltsExperiment(
+        name=hsh,
+        title=title,
+        meltsfile=meltsfile,
+        env=envfile,
+        fromdir=fromdir,
+        timeout=timeout,
+    )
+    cache.invalidate(M.folder)  # a crash from here on leaves no manifest
+    returncode = None
+    try:
+        mp = MeltsProcess(
+            executable=executable,
+            meltsfile=str(title) + ".melts",
+            env="environment.txt",
+            fromdir=str(M.folder),
+            timeout=timeout,
+        )
+        mp.write([3, [0, 1][superliquidus_start], 4], wait=True)
+        # alphaMELTS waits at its menu once the calculation is done; an exit before
+        # it's terminated is the exit status of alphaMELTS itself
+        returncode = mp.process.poll()
+        try:
+            mp.terminate()
+        except subprocess.TimeoutExpired:
+            mp.process.kill()
+            mp.cleanup()
+        status = "completed" if not returncode else "failed"
+    except (OSError, subprocess.TimeoutExpired):
+        status = "failed"
+    status = cache.write_manifest(
+        M.folder, config, envfile, status=status, returncode=returncode
+    )["status"]
+    metrics = experiment_metrics(M.folder, status, returncode, started=started)
+    return hsh, status, metrics["seconds"], metrics
+
+
+class ParallelMeltsBatch(MeltsBatch):
+    """
+    Batch of :class:`~pyrolite_meltsutil.automation.MeltsExperiment` which are
+    dispatched to a bounded pool of worker processes, each of which runs
+    alphaMELTS within the folder for its experiment under :code:`fromdir`.
+
+    Parameters
+    -----------
+    comp_df : :class:`pandas.DataFrame`
+        Dataframe of compositions.
+    processes : :class:`int`
+        Number of worker processes, defaulting to the number of cores.
+    executable : :class:`str` | :class:`pathlib.Path`
+        alphaMELTS executable to use, defaulting to the local installation.
+    merge : :class:`bool`
+        Whether to merge the configuration with any existing batch configuration
+        in :code:`fromdir` when it's serialized, rather than replacing it, such
+        that a study can be run as a sequence of batches (see
+        :func:`stream_batches`).
+    report_interval : :class:`float`
+        Minimum number of seconds between progress reports while the batch runs
+        (see :class:`mod.telemetry.BatchProgress`).
+
+    Notes
+    -----
+    Experiments are scheduled longest-expected-first (see :func:`expected_steps`)
+    such that long calculations don't hold up the end of the batch.
+
+    Unless :code:`verify=False` is passed to :meth:`run`, only experiments whose
+    folders are verified against their completion manifest are skipped, such that
+    partial or crashed experiments are run again.
+
+    Run metrics for each experiment are appended to :code:`run_metrics.jsonl`
+    within :code:`fromdir` as experiments finish, and can be read and summarised
+    by configuration with :func:`mod.telemetry.read_metrics` and
+    :func:`mod.telemetry.cost_summary`.
+    """
+
+    def __init__(
+        self,
+        comp_df,
+        processes=None,
+        executable=None,
+        merge=False,
+        report_interval=30.0,
+        **kwargs
+    ):
+        super().__init__(comp_df, **kwargs)
+        self.processes = processes or os.cpu_count()
+        self.executable = executable
+        self.merge = merge
+        self.report_interval = report_interval
+        self._cancelled = threading.Event()
+
+    def dump(self, experiments=None, to_dir=None):
+        """
+        Serialize the configuration to a json file, merging it with any existing
+        configuration where :code:`merge=True`.
+
+        Parameters
+        -----------
+        experiments : :class:`dict`
+            Dictionary of experiments to be serialized.
+        to_dir : :class:`str` | :class:`pathlib.Path`
+            Directory to export file to.
+        """
+        to_dir = Path(to_dir or self.fromdir)
+        target = to_dir / "meltsBatchConfig.json"
+        if not (self.merge and target.exists()):
+            return super().dump(experiments=experiments, to_dir=to_dir)
+        experiments = experiments or self.experiments
+        with open(str(target), "r") as f:
+            config = json.loads(f.read())
+        config.update(
+            {
+                h: (t, exp, env.dump(unset_variables=False))
+                for (h, (t, exp, env)) in experiments.items()
+            }
+        )
+        tmp = to_dir / "meltsBatchConfig.json.tmp"
+        with open(str(tmp), "wb") as f:
+            f.write(json.dumps(config, ensure_ascii=False).encode("utf8"))
+        os.replace(str(tmp), str(target))
+
+    def schedule(self, experiments=None):
+        """
+        Order experiments such that those expected to take longest run first.
+
+        Parameters
+        -----------
+        experiments : :class:`dict`
+            Dictionary of experiments to schedule.
+
+        Returns
+        -------
+        :class:`list`
+            List of (hash, (title, experiment, env)) tuples.
+        """
+        if experiments is None:
+            experiments = self.experiments
+        return sorted(
+            experiments.items(),
+            key=lambda x: expected_steps(x[1][1], x[1][2]),
+            reverse=True,
+        )
+
+    def cancel(self):
+        """
+        Cancel the experiments which have not yet started. Experiments which are
+        running will be allowed to finish.
+        """
+        self._cancelled.set()
+
+    def is_complete(self, hsh, verify=True):
+        """
+        Check whether an experiment has already been completed.
+
+        Parameters
+        -----------
+        hsh : :class:`str`
+            Experiment hash.
+        verify : :class:`bool`
+            Whether to verify the experiment folder against its completion manifest
+            (see :func:`mod.cache.verify`), rather than assuming any existing folder
+            is complete.
+
+        Returns
+        -------
+        :class:`bool`
+        """
+        title, exp, env = self.experiments[hsh]
+        folder = self.fromdir / hsh
+        if verify:
+            return cache.verify(folder, exp=exp, envfile=read_envfile(env)[0])
+        return folder.exists()
+
+    def run(
+        self,
+        overwrite=False,
+        exclude=[],
+        superliquidus_start=True,
+        timeout=None,
+        verify=True,
+    ):
+        self.dump()  # Serialize the config first
+        timeout = self.timeout or timeout
+        self.started = time.time()
+        self._cancelled.clear()
+        experiments = self.experiments
+        if not overwrite:
+            experiments = {
+                h: (t, exp, env)
+                for h, (t, exp, env) in experiments.items()
+                if not self.is_complete(h, verify=verify)
+            }
+            self.logger.info(
+                "Skipping {} completed calculations.".format(
+                    len(self.experiments) - len(experiments)
+                )
+            )
+        self.logger.info(
+            "Starting {} Calculations on {} processes.".format(
+                len(experiments), self.processes
+            )
+        )
+        self.completed, self.failed, self.cancelled = [], [], []
+        self.metrics = []
+        scheduled = self.schedule(experiments)
+        self.progress = BatchProgress(
+            {hsh: expected_steps(exp, env) for hsh, (_, exp, env) in scheduled},
+            logger=self.logger,
+            interval=self.report_interval,
+        )
+        with ProcessPoolExecutor(
+            max_workers=self.processes, initializer=_ignore_interrupt
+        ) as pool:
+            pending = {
+                pool.submit(
+                    _run_experiment,
+                    hsh,
+                    title,
+                    exp,
+                    read_envfile(env)[0],
+                    self.fromdir,
+                    exclude=exclude + exp.get("exclude", []),
+                    superliquidus_start=superliquidus_start,
+                    timeout=timeout,
+                    executable=self.executable,
+                ): (hsh, title)
+                for hsh, (title, exp, env) in scheduled
+            }
+            while pending:
+                try:
+                    done, _ = wait(pending, timeout=1.0, return_when=FIRST_COMPLETED)
+                except KeyboardInterrupt:
+                    self.cancel()
+                    continue
+                if self._cancelled.is_set():
+                    for future in [f for f in pending if f.cancel()]:
+                        self.cancelled.append(pending.pop(future)[0])
+                records = []
+                for future in done:
+                    hsh, title = pending.pop(future)
+                    try:
+                        _, status, duration, record = future.result()
+                    except Exception as e:
+                        self.logger.warning("{} at {}.".format(e, title))
+                        status = "failed"
+                        record = experiment_metrics(self.fromdir / hsh, status)
+                    if status == "completed":
+                        self.completed.append(hsh)
+                        self.logger.debug("Finished {}.".format(title))
+                    else:
+                        self.failed.append(hsh)
+                    self.progress.update(record)
+                    records.append(record)
+                if records:
+                    append_metrics(self.fromdir / METRICS, records)
+                    self.metrics.extend(records)
+                self.progress.report()
+        if scheduled:
+            self.progress.report(force=True)
+        if self.cancelled:
+            self.logger.warning("Cancelled {} calculations.".format(len(self.cancelled)))
+        self.duration = datetime.timedelta(seconds=time.time() - self.started)
+        self.logger.info("Calculations Complete after {}".format(self.duration))
+        if self.failed:
+            self.logger.warning("Some calculations errored:")
+            titles = {hsh: title for hsh, (title, _, _) in scheduled}
+            for hsh in self.failed:
+                self.logger.warning("{} ({})".format(titles[hsh], hsh))
+
+
+def stream_batches(chunks, run_kwargs={}, **kwargs):
+    """
+    Run a study as a sequence of batches, one for each chunk of compositions, such
+    that the full set of compositions need not be held in memory (e.g. chunks from
+    :meth:`mod.sampling.CompositionSampler.chunks`). The batch configurations are
+    merged into a single configuration file.
+
+    Parameters
+    -----------
+    chunks
+        Iterable of dataframes of compositions.
+    run_kwargs : :class:`dict`
+        Keyword arguments for :meth:`ParallelMeltsBatch.run`.
+
+    Yields
+    -------
+    :class:`ParallelMeltsBatch`
+        Each batch, after it has been run.
+    """
+    for comp_df in chunks:
+        handlers = list(kwargs.get("logger", automation.logger).handlers)
+        batch = ParallelMeltsBatch(comp_df, merge=True, **kwargs)
+        try:
+            batch.run(**run_kwargs)
+        finally:
+            # each batch adds a file handler to the logger, which are removed to
+            # avoid duplicated log records
+            for handler in [h for h in batch.logger.handlers if h not in handlers]:
+                if isinstance(handler, logging.FileHandler):
+                    batch.logger.removeHandler(handler)
+                    handler.close()
+        yield batch
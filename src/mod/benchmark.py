@@ -0,0 +1,454 @@
+"""
+Benchmarks of analysis hot paths at a range of batch sizes, profiling their wall
+time and peak memory and recording results by commit, such that regressions can
+be found by comparing the results of two commits.
+"""
+import gc
+import os
+import json
+import time
+import shutil
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from pyrolite_meltsutil.util.log import Handle
+
+logger = Handle(__name__)
+
+SIZES = [100, 1000, 10000, 100000]
+
+
+def git_revision(path="."):
+    """
+    Get the commit checked out within a repository, and whether the working tree
+    has uncommitted changes to tracked files.
+
+    Parameters
+    -----------
+    path : :class:`str` | :class:`pathlib.Path`
+        Folder within the repository.
+
+    Returns
+    -------
+    :class:`str`
+        Short commit hash, suffixed with :code:`+` where there are uncommitted
+        changes, or None outside of a repository.
+    """
+    try:
+        commit, status = [
+            subprocess.run(
+                ["git"] + args,
+                cwd=str(path),
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout.strip()
+            for args in [
+                ["rev-parse", "--short", "HEAD"],
+                ["status", "--porcelain", "--untracked-files=no"],
+            ]
+        ]
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("+" if status else "")
+
+
+def available_memory():
+    """
+    Get the memory available to new allocations, in bytes.
+
+    Returns
+    -------
+    :class:`int`
+        Available memory, or None where it can't be found.
+    """
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:  # free memory, excluding that which could be reclaimed from caches
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def profile(func, args=(), repeat=3, memory=True):
+    """
+    Profile the wall time and peak memory of a function.
+
+    Parameters
+    -----------
+    func : :class:`callable`
+        Function to profile.
+    args : :class:`tuple`
+        Arguments for the function.
+    repeat : :class:`int`
+        Number of times to time the function.
+    memory : :class:`bool`
+        Whether to measure the peak memory allocated by the function, in a
+        separate call such that tracing doesn't affect the timing.
+
+    Returns
+    -------
+    :class:`dict`
+        Fastest and mean wall times in seconds, and the peak memory in MB.
+
+    Notes
+    -----
+    Memory is traced with :mod:`tracemalloc`, which includes the buffers of numpy
+    arrays but not memory allocated by other processes (e.g. worker processes) or
+    by extensions which bypass the Python allocator (e.g. HDF5).
+    """
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    peak = None
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            func(*args)
+            peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        finally:
+            tracemalloc.stop()
+    return {"seconds": min(times), "mean_seconds": np.mean(times), "peak_mb": peak}
+
+
+class BenchmarkSuite(object):
+    """
+    Registry of benchmarks and the fixtures they run on, which are run at each of a
+    range of batch sizes with results appended to a results file.
+
+    Fixtures (e.g. synthetic phase tables or experiment folders, see
+    :mod:`mod.synthetic`) are generated once for each size and shared between the
+    benchmarks at that size. Sizes for which the fixtures of a benchmark are
+    estimated not to fit within the available memory are skipped, and recorded as
+    such.
+
+    Parameters
+    -----------
+    results : :class:`str` | :class:`pathlib.Path`
+        File results are appended to, as json records.
+    sizes : :class:`list`
+        Numbers of experiments to run benchmarks at.
+    repeat : :class:`int`
+        Number of times each benchmark is timed.
+    memory : :class:`bool`
+        Whether to profile peak memory.
+    workdir : :class:`str` | :class:`pathlib.Path`
+        Folder for fixtures written to disk, defaulting to a temporary folder
+        which is removed after the suite is run.
+    memory_limit : :class:`int`
+        Bytes available for fixtures, defaulting to the available memory.
+    """
+
+    def __init__(
+        self,
+        results="benchmarks.jsonl",
+        sizes=SIZES,
+        repeat=3,
+        memory=True,
+        workdir=None,
+        memory_limit=None,
+    ):
+        self.results = Path(results)
+        self.sizes = list(sizes)
+        self.repeat = repeat
+        self.memory = memory
+        self.workdir = None if workdir is None else Path(workdir)
+        self.memory_limit = memory_limit
+        self.fixtures, self.targets = {}, {}
+        self._cache = {}
+
+    def fixture(self, name=None, per_experiment=0, requires=[]):
+        """
+        Decorator to register a fixture, being a function of the number of
+        experiments and a folder it can write to.
+
+        Parameters
+        -----------
+        name : :class:`str`
+            Fixture name, defaulting to the name of the function.
+        per_experiment : :class:`float`
+            Estimated bytes of memory held by the fixture for each experiment.
+        requires : :class:`list`
+            Fixtures this fixture is generated from (with :meth:`get`).
+        """
+
+        def decorator(func):
+            self.fixtures[name or func.__name__] = dict(
+                func=func, per_experiment=per_experiment, requires=list(requires)
+            )
+            return func
+
+        return decorator
+
+    def register(
+        self, name, func, fixtures=[], max_size=None, repeat=None, memory=None
+    ):
+        """
+        Register a benchmark.
+
+        Parameters
+        -----------
+        name : :class:`str`
+            Benchmark name.
+        func : :class:`callable`
+            Function to benchmark, taking the fixtures as arguments.
+        fixtures : :class:`list`
+            Names of the fixtures the function takes.
+        max_size : :class:`int`
+            Largest number of experiments to run the benchmark at (e.g. for
+            reference implementations which scale poorly).
+        repeat : :class:`int`
+            Number of times to time the benchmark, overriding that of the suite.
+        memory : :class:`bool`
+            Whether to profile peak memory, overriding that of the suite; tracing
+            allocations slows pure-Python code several-fold, which can be
+            prohibitive for slow benchmarks.
+
+        Returns
+        -------
+        :class:`callable`
+            The benchmark function.
+        """
+        self.targets[name] = dict(
+            func=func,
+            fixtures=list(fixtures),
+            max_size=max_size,
+            repeat=repeat,
+            memory=memory,
+        )
+        return func
+
+    def benchmark(self, name=None, **kwargs):
+        """
+        Decorator to register a benchmark (see :meth:`register`).
+
+        Parameters
+        -----------
+        name : :class:`str`
+            Benchmark name, defaulting to the name of the function.
+        """
+
+        def decorator(func):
+            return self.register(name or func.__name__, func, **kwargs)
+
+        return decorator
+
+    def _requirements(self, names):
+        """
+        Get the fixtures required for a set of fixtures, including themselves.
+        """
+        required, stack = set(), list(names)
+        while stack:
+            name = stack.pop()
+            if name not in required:
+                required.add(name)
+                stack.extend(self.fixtures[name]["requires"])
+        return required
+
+    def estimate(self, fixtures, size):
+        """
+        Estimate the memory held by fixtures for a number of experiments.
+
+        Parameters
+        -----------
+        fixtures : :class:`list`
+            Fixture names.
+        size : :class:`int`
+            Number of experiments.
+
+        Returns
+        -------
+        :class:`float`
+            Estimated bytes.
+        """
+        required = self._requirements(fixtures)
+        return size * sum(self.fixtures[f]["per_experiment"] for f in required)
+
+    def get(self, name, size):
+        """
+        Get a fixture for a number of experiments, generating it where it hasn't
+        been already.
+
+        Parameters
+        -----------
+        name : :class:`str`
+            Fixture name.
+        size : :class:`int`
+            Number of experiments.
+        """
+        key = (name, size)
+        if key not in self._cache:
+            folder = self.workdir / str(size) / name
+            folder.mkdir(parents=True, exist_ok=True)
+            start = time.perf_counter()
+            self._cache[key] = self.fixtures[name]["func"](size, folder)
+            logger.info(
+                "Generated {} for {} experiments in {:.1f} s.".format(
+                    name, size, time.perf_counter() - start
+                )
+            )
+        return self._cache[key]
+
+    def _record(self, name, size, status, revision, **values):
+        """
+        Append a result to the results file, along with the versions and machine
+        it was run with.
+
+        Returns
+        -------
+        :class:`dict`
+            Result record.
+        """
+        record = {
+            "benchmark": name,
+            "size": size,
+            "status": status,
+            "revision": revision,
+            "seconds": None,
+            "mean_seconds": None,
+            "peak_mb": None,
+            "written": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "machine": platform.node(),
+            **values,
+        }
+        self.results.parent.mkdir(parents=True, exist_ok=True)
+        with open(str(self.results), "a") as f:
+            f.write(json.dumps(record) + "\n")
+        return record
+
+    def _run_target(self, name, size, revision, limit=None):
+        """
+        Run a benchmark at a size, unless it's above the largest size for the
+        benchmark or its fixtures won't fit within a memory limit.
+
+        Returns
+        -------
+        :class:`dict`
+            Result record.
+        """
+        target = self.targets[name]
+        if target["max_size"] is not None and size > target["max_size"]:
+            return self._record(name, size, "skipped", revision, reason="size")
+        if limit is not None and self.estimate(target["fixtures"], size) > limit:
+            return self._record(name, size, "skipped", revision, reason="memory")
+        memory = self.memory if target["memory"] is None else target["memory"]
+        try:
+            args = [self.get(f, size) for f in target["fixtures"]]
+            values = profile(
+                target["func"],
+                args,
+                repeat=target["repeat"] or self.repeat,
+                memory=memory,
+            )
+        except Exception as e:
+            logger.warning("{} failed at {}: {}".format(name, size, e))
+            return self._record(name, size, "failed", revision, reason=str(e))
+        logger.info("{} at {}: {:.3f} s".format(name, size, values["seconds"]))
+        return self._record(name, size, "completed", revision, **values)
+
+    def run(self, names=None, sizes=None):
+        """
+        Run benchmarks at each size, appending the results to the results file.
+
+        Parameters
+        -----------
+        names : :class:`list`
+            Benchmarks to run, defaulting to all registered benchmarks.
+        sizes : :class:`list`
+            Numbers of experiments, defaulting to the sizes of the suite.
+
+        Returns
+        -------
+        :class:`pandas.DataFrame`
+            Results, with a row for each benchmark at each size.
+        """
+        names = names or list(self.targets)
+        revision = git_revision(self.results.resolve().parent)
+        temporary = self.workdir is None
+        if temporary:
+            self.workdir = Path(tempfile.mkdtemp(prefix="benchmarks"))
+        limit = self.memory_limit or available_memory()
+        records = []
+        try:
+            for size in sizes or self.sizes:
+                for name in names:
+                    records.append(self._run_target(name, size, revision, limit))
+                # fixtures are released before generating those for the next size
+                self._cache.clear()
+                gc.collect()
+        finally:
+            if temporary:
+                shutil.rmtree(str(self.workdir), ignore_errors=True)
+                self.workdir = None
+        return pd.DataFrame.from_records(records)
+
+
+def read_results(path):
+    """
+    Read benchmark results.
+
+    Parameters
+    -----------
+    path : :class:`str` | :class:`pathlib.Path`
+        Results file (see :class:`BenchmarkSuite`).
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+    """
+    with open(str(path), "r") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return pd.DataFrame.from_records(records)
+
+
+def compare_results(results, base=None, head=None, metric="seconds"):
+    """
+    Compare benchmark results between two revisions, using the most recent result
+    of each benchmark at each size for each revision.
+
+    Parameters
+    -----------
+    results : :class:`pandas.DataFrame`
+        Benchmark results (see :func:`read_results`).
+    base, head : :class:`str`
+        Revisions to compare (see :func:`git_revision`), defaulting to the two
+        most recently benchmarked revisions.
+    metric : :class:`str`
+        Either :code:`"seconds"`, :code:`"mean_seconds"` or :code:`"peak_mb"`.
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+        Metric for each revision and their ratio (head / base), indexed by
+        benchmark and size; ratios above one are regressions. Where there is no
+        earlier revision to compare to, this is empty.
+    """
+    completed = results.loc[results["status"] == "completed"]
+    revisions = list(pd.unique(completed["revision"].values[::-1]))
+    head = head or next(iter(revisions), None)
+    base = base or next((r for r in revisions if r != head), None)
+    if base is None or base == head:
+        logger.warning("No earlier revision to compare {} to.".format(head))
+        index = pd.MultiIndex.from_arrays([[], []], names=["benchmark", "size"])
+        return pd.DataFrame(columns=["ratio"], index=index, dtype=float)
+    latest = completed.drop_duplicates(["revision", "benchmark", "size"], keep="last")
+    table = latest.pivot(index=["benchmark", "size"], columns="revision", values=metric)
+    table = table.reindex(columns=list(dict.fromkeys([base, head])))
+    table["ratio"] = table[head] / table[base]
+    return table
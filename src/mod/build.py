@@ -0,0 +1,373 @@
+"""
+Figure builds with dependency tracking, such that figures are only regenerated
+where their inputs (experiments, data files or the code which draws them) have
+changed.
+"""
+import os
+import json
+import time
+import inspect
+import functools
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import matplotlib.pyplot as plt
+from pyrolite_meltsutil.util.log import Handle
+from .cache import digest, file_digest
+from .aggregate import INDEX, read_index, folder_signature
+
+logger = Handle(__name__)
+
+RECORD = "build.json"
+# cache folder within the experiment folder, shared with the phase volume panels
+CACHE = "figure_cache"
+
+
+def _source(func, seen=None):
+    """
+    Get the source of a function to digest, including the arguments of partial
+    functions, and the functions and simple values (e.g. style dictionaries) it
+    refers to within the same module.
+
+    Parameters
+    -----------
+    func : :class:`callable`
+        Function.
+    seen : :class:`set`
+        Functions already included.
+
+    Returns
+    -------
+    :class:`str`
+    """
+    seen = set() if seen is None else seen
+    if isinstance(func, functools.partial):
+        arguments = repr((func.args, sorted(func.keywords.items())))
+        return _source(func.func, seen) + arguments
+    func = inspect.unwrap(func)
+    if func in seen:
+        return ""
+    seen.add(func)
+    try:
+        parts = [inspect.getsource(func)]
+    except (OSError, TypeError):
+        return getattr(func, "__qualname__", repr(func))
+    namespace = getattr(func, "__globals__", {})
+    for name in getattr(getattr(func, "__code__", None), "co_names", []):
+        value = namespace.get(name)
+        if isinstance(value, (str, int, float, list, tuple, dict)):
+            parts.append("{}={!r}".format(name, value))
+        elif callable(value) and getattr(value, "__module__", None) == func.__module__:
+            if inspect.isfunction(inspect.unwrap(value)):
+                parts.append(_source(value, seen))
+    return "\n".join(parts)
+
+
+def _run_target(func):
+    """
+    Run the function for a target, within a worker process.
+
+    Parameters
+    -----------
+    func : :class:`callable`
+        Function which draws and saves the figures for the target.
+
+    Returns
+    -------
+    :class:`tuple`
+        Run time in seconds and an error message (:code:`None` where successful).
+    """
+    start = time.perf_counter()
+    try:
+        func()
+        error = None
+    except Exception as e:
+        error = "{}: {}".format(type(e).__name__, e)
+    finally:
+        plt.close("all")
+    return time.perf_counter() - start, error
+
+
+class FigureBuild(object):
+    """
+    Registry of figures and the inputs they're drawn from, which rebuilds only
+    those figures which are stale, running independent figures concurrently.
+
+    A figure is stale where the content of its input files, the signatures of its
+    input experiments (from the aggregation index, see
+    :func:`mod.aggregate.aggregate_to_store`) or the source of its function have
+    changed since it was last built, or where any of its outputs are missing. The
+    source of a function includes that of the functions and simple values (e.g.
+    style dictionaries) it refers to within the same module; other values it
+    depends on should be passed as arguments (e.g. with :class:`functools.partial`)
+    or registered as inputs. The build record, including the time taken to build
+    each figure, is kept in a cache folder next to the experiment data rather than
+    with the (tracked) figures, such that builds from different scripts drawing on
+    the same experiments share it.
+
+    Parameters
+    -----------
+    outputfolder : :class:`str` | :class:`pathlib.Path`
+        Folder containing the experiments figures are drawn from.
+    save_at : :class:`str` | :class:`pathlib.Path`
+        Folder figures are saved to.
+    save_fmts : :class:`list`
+        Default formats figures are saved in.
+    cache : :class:`str` | :class:`pathlib.Path`
+        Folder to keep the build record in, defaulting to :code:`figure_cache`
+        within the output folder, or within the working directory where no output
+        folder is given.
+    """
+
+    def __init__(
+        self, outputfolder=None, save_at="../img/", save_fmts=["png", "pdf"], cache=None
+    ):
+        self.outputfolder = None if outputfolder is None else Path(outputfolder)
+        self.save_at = Path(save_at)
+        self.save_fmts = save_fmts
+        if cache is None:
+            cache = (self.outputfolder or Path(".")) / CACHE
+        self.cache = Path(cache)
+        self.targets = {}
+
+    def register(
+        self, name, func, experiments=[], inputs=[], outputs=None, save_fmts=None
+    ):
+        """
+        Register a figure.
+
+        Parameters
+        -----------
+        name : :class:`str`
+            Figure name.
+        func : :class:`callable`
+            Function which draws and saves the figure, taking no arguments. For the
+            figure to be built in a worker process, this needs to be defined at the
+            top level of a module (or be a :class:`functools.partial` of one).
+        experiments : :class:`list`
+            Experiments within the output folder the figure is drawn from.
+        inputs : :class:`list`
+            Other files the figure is drawn from (e.g. CSVs of measured data).
+        outputs : :class:`list`
+            Names of the figures saved by the function, defaulting to the figure
+            name.
+        save_fmts : :class:`list`
+            Formats the figures are saved in.
+
+        Returns
+        -------
+        :class:`callable`
+            The figure function.
+        """
+        self.targets[name] = dict(
+            func=func,
+            experiments=list(experiments),
+            inputs=[Path(p) for p in inputs],
+            outputs=outputs or [name],
+            save_fmts=save_fmts or self.save_fmts,
+        )
+        return func
+
+    def figure(self, name=None, **kwargs):
+        """
+        Decorator to register a figure function (see :meth:`register`).
+
+        Parameters
+        -----------
+        name : :class:`str`
+            Figure name, defaulting to the name of the function.
+        """
+
+        def decorator(func):
+            return self.register(name or func.__name__, func, **kwargs)
+
+        return decorator
+
+    def _experiment_signatures(self, experiments):
+        """
+        Get the signatures of a set of experiments, from the aggregation index where
+        present, otherwise from the experiment folders.
+
+        Parameters
+        -----------
+        experiments : :class:`list`
+            Experiment hashes.
+
+        Returns
+        -------
+        :class:`dict`
+        """
+        if not experiments:
+            return {}
+        index = read_index(self.outputfolder / INDEX)
+        return {
+            e: index[e]["signature"]
+            if e in index
+            else folder_signature(self.outputfolder / e)
+            for e in experiments
+        }
+
+    def key(self, name):
+        """
+        Get the key for the current inputs of a figure.
+
+        Parameters
+        -----------
+        name : :class:`str`
+            Figure name.
+
+        Returns
+        -------
+        :class:`str`
+        """
+        target = self.targets[name]
+        return digest(
+            {
+                "source": _source(target["func"]),
+                "experiments": self._experiment_signatures(target["experiments"]),
+                "inputs": {
+                    str(p): file_digest(p) if p.exists() else None
+                    for p in target["inputs"]
+                },
+                "outputs": target["outputs"],
+                "save_fmts": target["save_fmts"],
+            }
+        )
+
+    def read_record(self):
+        """
+        Read the build record.
+
+        Returns
+        -------
+        :class:`dict`
+        """
+        try:
+            with open(str(self.cache / RECORD), "r") as f:
+                return json.loads(f.read())
+        except (OSError, ValueError):
+            return {}
+
+    def _write_record(self, updates):
+        """
+        Update the build record, keeping the records of other figures.
+
+        Parameters
+        -----------
+        updates : :class:`dict`
+            Records for each figure built.
+        """
+        record = self.read_record()
+        record.update(updates)
+        self.cache.mkdir(parents=True, exist_ok=True)
+        path = self.cache / RECORD
+        tmp = path.parent / (path.name + ".tmp")
+        with open(str(tmp), "w") as f:
+            f.write(json.dumps(record, indent=1, sort_keys=True))
+        os.replace(str(tmp), str(path))
+
+    def stale(self, names=None):
+        """
+        Get the figures which need to be rebuilt.
+
+        Parameters
+        -----------
+        names : :class:`list`
+            Figures to check, defaulting to all registered figures.
+
+        Returns
+        -------
+        :class:`dict`
+            Current keys of the stale figures, indexed by name.
+        """
+        record = self.read_record()
+        stale = {}
+        for name in names or list(self.targets):
+            target, key = self.targets[name], self.key(name)
+            outputs = [
+                self.save_at / "{}.{}".format(o, fmt)
+                for o in target["outputs"]
+                for fmt in target["save_fmts"]
+            ]
+            if record.get(name, {}).get("key") != key or not all(
+                p.exists() for p in outputs
+            ):
+                stale[name] = key
+        return stale
+
+    def build(self, names=None, force=False, processes=None):
+        """
+        Build stale figures, running them concurrently in worker processes.
+
+        Parameters
+        -----------
+        names : :class:`list`
+            Figures to build, defaulting to all registered figures.
+        force : :class:`bool`
+            Whether to rebuild figures which are up to date.
+        processes : :class:`int`
+            Number of worker processes, defaulting to the number of cores. Where a
+            single process is used, figures are built in the current process.
+
+        Returns
+        -------
+        :class:`pandas.DataFrame`
+            Timing report, with the status of each figure (:code:`"built"`,
+            :code:`"current"` or :code:`"failed"`) and the time taken to build it.
+        """
+        names = names or list(self.targets)
+        if force:
+            stale = {name: self.key(name) for name in names}
+        else:
+            stale = self.stale(names)
+        results = {}
+        if stale:
+            self.save_at.mkdir(parents=True, exist_ok=True)
+            funcs = [self.targets[name]["func"] for name in stale]
+            processes = min(processes or os.cpu_count(), len(stale))
+            if processes == 1:
+                outcomes = map(_run_target, funcs)
+                results = dict(zip(stale, outcomes))
+            else:
+                with ProcessPoolExecutor(max_workers=processes) as pool:
+                    results = dict(zip(stale, pool.map(_run_target, funcs)))
+        updates, rows = {}, []
+        for name in names:
+            if name not in stale:
+                rows.append({"figure": name, "status": "current", "seconds": 0.0})
+                continue
+            seconds, error = results[name]
+            if error is None:
+                updates[name] = {
+                    "key": stale[name],
+                    "seconds": seconds,
+                    "built": time.strftime("%Y-%m-%d %H:%M:%S"),
+                }
+                logger.info("Built {} in {:.1f} s.".format(name, seconds))
+            else:
+                logger.warning("Failed to build {}: {}".format(name, error))
+            status = "built" if error is None else "failed"
+            rows.append({"figure": name, "status": status, "seconds": seconds})
+        if updates:
+            self._write_record(updates)
+        return pd.DataFrame(rows, columns=["figure", "status", "seconds"]).set_index(
+            "figure"
+        )
+
+    def report(self):
+        """
+        Get the build times recorded for each figure, from the last time each was
+        built.
+
+        Returns
+        -------
+        :class:`pandas.DataFrame`
+        """
+        record = self.read_record()
+        rows = [
+            {"figure": name, "seconds": r.get("seconds"), "built": r.get("built")}
+            for name, r in record.items()
+        ]
+        return pd.DataFrame(rows, columns=["figure", "seconds", "built"]).set_index(
+            "figure"
+        )
@@ -0,0 +1,183 @@
+"""
+Completion manifests for experiment folders, such that re-runs of a batch can skip
+experiments which are verified to be complete and redo those which are partial or
+crashed.
+"""
+import os
+import json
+import time
+import hashlib
+from pathlib import Path
+from pyrolite_meltsutil.tables.load import TABLES
+
+MANIFEST = "manifest.json"
+OUTPUTS = sorted(TABLES | {"alphaMELTS_tbl.txt"})
+
+
+def digest(data, algorithm="sha1"):
+    """
+    Get the digest of a string or a JSON-serializable object.
+
+    Parameters
+    -----------
+    data : :class:`str` | :class:`dict`
+        Data to digest.
+    algorithm : :class:`str`
+        Name of hash algorithm to use.
+
+    Returns
+    -------
+    :class:`str`
+    """
+    if not isinstance(data, str):
+        data = json.dumps(data, sort_keys=True, ensure_ascii=False)
+    return hashlib.new(algorithm, data.encode("utf8")).hexdigest()
+
+
+def file_digest(path, algorithm="sha1", blocksize=2 ** 20):
+    """
+    Get the digest of a file.
+
+    Parameters
+    -----------
+    path : :class:`str` | :class:`pathlib.Path`
+        Path to the file.
+    algorithm : :class:`str`
+        Name of hash algorithm to use.
+    blocksize : :class:`int`
+        Number of bytes to read at a time.
+
+    Returns
+    -------
+    :class:`str`
+    """
+    hsh = hashlib.new(algorithm)
+    with open(str(path), "rb") as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            hsh.update(block)
+    return hsh.hexdigest()
+
+
+def invalidate(folder):
+    """
+    Remove the manifest from an experiment folder, such that it will be treated as
+    incomplete until a new manifest is written.
+
+    Parameters
+    -----------
+    folder : :class:`str` | :class:`pathlib.Path`
+        Experiment folder.
+    """
+    manifest = Path(folder) / MANIFEST
+    if manifest.exists():
+        manifest.unlink()
+
+
+def write_manifest(folder, exp, envfile, status="completed", returncode=None):
+    """
+    Record a completion manifest for an experiment folder, including the
+    configuration and environment digests and the sizes and checksums of the
+    output tables.
+
+    Parameters
+    -----------
+    folder : :class:`str` | :class:`pathlib.Path`
+        Experiment folder.
+    exp : :class:`dict`
+        Experiment configuration, including the composition.
+    envfile : :class:`str`
+        Multiline string representation of the environment file.
+    status : :class:`str`
+        Status of the experiment (e.g. :code:`"completed"` or :code:`"failed"`).
+    returncode : :class:`int`
+        Exit status of the alphaMELTS process.
+
+    Returns
+    -------
+    :class:`dict`
+        Manifest.
+    """
+    folder = Path(folder)
+    tables = {}
+    for name in OUTPUTS:
+        path = folder / name
+        if path.exists():
+            tables[name] = {"size": path.stat().st_size, "sha1": file_digest(path)}
+    if status == "completed" and set(tables) != set(OUTPUTS):
+        status = "incomplete"  # alphaMELTS exited without writing all tables
+    manifest = {
+        "experiment": folder.name,
+        "config": digest(exp),
+        "env": digest(envfile),
+        "status": status,
+        "returncode": returncode,
+        "tables": tables,
+        "written": time.time(),
+    }
+    # write then rename, such that a partially written manifest is never read
+    tmp = folder / (MANIFEST + ".tmp")
+    with open(str(tmp), "w") as f:
+        f.write(json.dumps(manifest, indent=1))
+    os.replace(str(tmp), str(folder / MANIFEST))
+    return manifest
+
+
+def read_manifest(folder):
+    """
+    Read the completion manifest for an experiment folder.
+
+    Parameters
+    -----------
+    folder : :class:`str` | :class:`pathlib.Path`
+        Experiment folder.
+
+    Returns
+    -------
+    :class:`dict`
+        Manifest, or :code:`None` where it doesn't exist or can't be read.
+    """
+    manifest = Path(folder) / MANIFEST
+    try:
+        with open(str(manifest), "r") as f:
+            return json.loads(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+def verify(folder, exp=None, envfile=None, checksums=True):
+    """
+    Check whether an experiment folder holds a verified-complete experiment.
+
+    Parameters
+    -----------
+    folder : :class:`str` | :class:`pathlib.Path`
+        Experiment folder.
+    exp : :class:`dict`
+        Experiment configuration to check against the manifest.
+    envfile : :class:`str`
+        Environment file to check against the manifest.
+    checksums : :class:`bool`
+        Whether to verify the table checksums, rather than only their sizes.
+
+    Returns
+    -------
+    :class:`bool`
+    """
+    folder = Path(folder)
+    manifest = read_manifest(folder)
+    if manifest is None or manifest.get("status") != "completed":
+        return False
+    if exp is not None and manifest.get("config") != digest(exp):
+        return False
+    if envfile is not None and manifest.get("env") != digest(envfile):
+        return False
+    tables = manifest.get("tables", {})
+    if set(tables) != set(OUTPUTS):
+        return False
+    for name, record in tables.items():
+        path = folder / name
+        if not path.exists() or path.stat().st_size != record["size"]:
+            return False
+        if checksums and file_digest(path) != record["sha1"]:
+            return False
+    return True
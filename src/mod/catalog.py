@@ -0,0 +1,205 @@
+"""
+Queryable catalog of the experiments within a batch configuration.
+"""
+import json
+from pathlib import Path
+from collections.abc import Mapping
+import pandas as pd
+
+# columns of the catalog table and the configuration keys they're taken from
+FIELDS = {
+    "Suite": "Suite",
+    "Title": "Title",
+    "modes": "modes",
+    "H2O": "H2O",
+    "fO2": "Log fO2 Path",
+    "pressure": "Initial Pressure",
+    "Tstart": "Initial Temperature",
+    "Tend": "Final Temperature",
+    "Replicate": "Replicate",
+}
+
+
+def read_batch_config(outputfolder):
+    """
+    Read the batch configuration within an output folder, as for
+    :func:`~pyrolite_meltsutil.tables.load.import_batch_config` but without
+    importing pyrolite_meltsutil, such that the catalog is quick to load.
+
+    Parameters
+    -----------
+    outputfolder : :class:`str` | :class:`pathlib.Path`
+        Folder containing :code:`meltsBatchConfig.json`.
+
+    Returns
+    -------
+    :class:`dict`
+        Configuration dictionary indexed by hashes.
+    """
+    with open(Path(outputfolder) / "meltsBatchConfig.json", "r") as f:
+        return json.load(f)
+
+
+def _modes_key(modes):
+    """
+    Get a hashable key for a list of modes, where a single mode can be given as a
+    string.
+
+    Parameters
+    -----------
+    modes : :class:`str` | :class:`list`
+        Mode or list of modes.
+
+    Returns
+    -------
+    :class:`tuple`
+    """
+    if isinstance(modes, str):
+        return (modes,)
+    return tuple(modes)
+
+
+class BatchCatalog(Mapping):
+    """
+    Catalog of the experiments within a batch configuration, flattened into a table
+    which can be queried by configuration values (see :meth:`select`).
+
+    The catalog can be used in place of the configuration dictionary returned by
+    :func:`~pyrolite_meltsutil.tables.load.import_batch_config`, mapping
+    experiment hashes to (name, config, env) tuples.
+
+    Parameters
+    -----------
+    config : :class:`dict`
+        Batch configuration, indexed by experiment hashes.
+    present : :class:`set` | :class:`pandas.DataFrame`
+        Experiments which are present in the aggregated tables, or a table with an
+        :code:`experiment` column from which to find them. Where not given, all
+        experiments are considered present.
+    """
+
+    def __init__(self, config, present=None):
+        self.config = config
+        records = []
+        for hsh, (name, cfg, env) in config.items():
+            record = {k: cfg.get(v) for k, v in FIELDS.items()}
+            record["modes"] = _modes_key(record["modes"] or [])
+            record["name"] = name
+            records.append(record)
+        self.table = pd.DataFrame(
+            records, index=pd.Index(list(config.keys()), name="experiment")
+        ).reindex(columns=["name"] + list(FIELDS))
+        for c in ["H2O", "pressure", "Tstart", "Tend", "Replicate"]:
+            self.table[c] = pd.to_numeric(self.table[c], errors="coerce")
+        # positions of the experiments for each value of each column, for lookups
+        self._indexes = {
+            c: {k: set(v) for k, v in self.table.groupby(c, sort=False).indices.items()}
+            for c in self.table.columns
+        }
+        self.set_present(present)
+
+    @classmethod
+    def from_folder(cls, outputfolder, present=None):
+        """
+        Build a catalog from the batch configuration within an output folder.
+
+        Parameters
+        -----------
+        outputfolder : :class:`str` | :class:`pathlib.Path`
+            Folder containing the batch configuration and experiment folders.
+        present : :class:`set` | :class:`pandas.DataFrame`
+            Experiments which are present in the aggregated tables, or a table from
+            which to find them. Where not given, these are taken from the
+            aggregation index (see :func:`mod.aggregate.aggregate_to_store`).
+
+        Returns
+        -------
+        :class:`BatchCatalog`
+
+        Raises
+        ------
+        FileNotFoundError
+            Where the experiments present aren't given and the batch hasn't been
+            aggregated, as selections of the catalog would be empty.
+        """
+        outputfolder = Path(outputfolder)
+        if present is None:
+            from .aggregate import INDEX, read_index
+
+            if not (outputfolder / INDEX).exists():
+                raise FileNotFoundError(
+                    "No aggregation index in {}; aggregate the batch first (agg.py "
+                    "or python -m mod aggregate).".format(outputfolder)
+                )
+            present = set(read_index(outputfolder / INDEX))
+        return cls(read_batch_config(outputfolder), present=present)
+
+    def set_present(self, present=None):
+        """
+        Set the experiments which are present in the aggregated tables.
+
+        Parameters
+        -----------
+        present : :class:`set` | :class:`pandas.DataFrame`
+            Experiments which are present, or a table with an :code:`experiment`
+            column from which to find them.
+        """
+        if isinstance(present, pd.DataFrame):
+            present = pd.unique(present["experiment"].values)
+        self.present = set(self.config) if present is None else set(present)
+        self.table["present"] = self.table.index.isin(self.present)
+
+    def select(self, present=True, sort_by=None, **criteria):
+        """
+        Select experiments by their configuration.
+
+        Parameters
+        -----------
+        present : :class:`bool`
+            Whether to select only those experiments present in the aggregated
+            tables.
+        sort_by : :class:`str` | :class:`list`
+            Catalog columns to sort the selection by, otherwise experiments are
+            returned in configuration order.
+        criteria
+            Values for catalog columns to select (e.g. :code:`modes="isobaric"`,
+            :code:`H2O=1`). Modes are matched exactly, with a single mode able to
+            be given as a string. Callables can be used to select by a condition
+            (e.g. :code:`H2O=lambda x: x > 0`).
+
+        Returns
+        -------
+        :class:`list`
+            List of experiment hashes.
+        """
+        positions = None
+        for column, value in criteria.items():
+            if column not in self._indexes:
+                raise KeyError("Unknown catalog column: {}".format(column))
+            if callable(value):
+                matched = set(
+                    (self.table[column].map(value).values.astype(bool)).nonzero()[0]
+                )
+            else:
+                if column == "modes":
+                    value = _modes_key(value)
+                matched = self._indexes[column].get(value, set())
+            positions = matched if positions is None else positions & matched
+        if positions is None:
+            selection = self.table
+        else:
+            selection = self.table.iloc[sorted(positions)]
+        if present:
+            selection = selection.loc[selection["present"]]
+        if sort_by is not None:
+            selection = selection.sort_values(sort_by, kind="mergesort")
+        return list(selection.index)
+
+    def __getitem__(self, hsh):
+        return self.config[hsh]
+
+    def __iter__(self):
+        return iter(self.config)
+
+    def __len__(self):
+        return len(self.config)
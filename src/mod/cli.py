@@ -0,0 +1,378 @@
+"""
+Command line interface to run, aggregate, rank and plot batches of alphaMELTS
+experiments, as :code:`python -m mod <command>` with the src folder on the path.
+Folders default to those within the data folder of the repository, wherever the
+command is run from.
+
+Modules are imported by the commands which use them rather than up front, such
+that quick queries (ranking experiments, listing configurations) don't wait on
+pyrolite and alphaMELTS utilities being imported. The time taken to import each
+is reported with :code:`--timing`.
+"""
+import os
+import sys
+import time
+import argparse
+import functools
+import importlib
+from pathlib import Path
+
+STARTED = time.perf_counter()
+SRC = Path(__file__).resolve().parents[1]
+DATA = SRC.parent / "data"  # defaults don't depend on the working directory
+# scripts with a FigureBuild (named build) which can be built by the plot command
+SCRIPTS = [
+    "run",
+    "mineral_chem",
+    "h2o_variation",
+    "crystallisation_sequences",
+    "plot_uncertainty",
+    "trace_elements",
+]
+TARGET = ["liquid", "olivine", "feldspar", "clinopyroxene", "orthopyroxene"]
+
+# seconds taken to import each module, in the order imported
+import_times = {}
+
+
+def _import(name):
+    """
+    Import a module, recording the time taken to import it.
+
+    Parameters
+    -----------
+    name : :class:`str`
+        Module name.
+
+    Returns
+    -------
+    :class:`module`
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    import_times[name] = time.perf_counter() - start
+    return module
+
+
+def _stream_log(*names):
+    """
+    Stream logging from packages to the console, importing pyrolite to do so.
+    """
+    meta = _import("pyrolite.util.meta")
+    return [meta.stream_log(name, level="INFO") for name in names]
+
+
+def _criteria(pairs):
+    """
+    Parse :code:`key=value` selection criteria for :meth:`BatchCatalog.select`,
+    where numbers are converted and modes can be given separated by commas.
+
+    Parameters
+    -----------
+    pairs : :class:`list`
+        List of :code:`key=value` strings.
+
+    Returns
+    -------
+    :class:`dict`
+    """
+    criteria = {}
+    for pair in pairs or []:
+        key, sep, value = pair.partition("=")
+        if not sep:
+            raise argparse.ArgumentTypeError("Expected key=value, got {}".format(pair))
+        if key == "modes":
+            value = tuple(m.strip() for m in value.split(","))
+        else:
+            try:
+                value = float(value)
+            except ValueError:
+                pass
+        criteria[key] = value
+    return criteria
+
+
+def _catalog(folder):
+    """
+    Get the catalog of a batch, with the experiments present taken from the
+    phase dataset where it exists, otherwise from the aggregation index, and with
+    none present where the batch hasn't been aggregated.
+
+    Parameters
+    -----------
+    folder : :class:`pathlib.Path`
+        Output folder of the batch.
+
+    Returns
+    -------
+    :class:`mod.catalog.BatchCatalog` | :class:`None`
+        Catalog, or None where the folder has no batch configuration.
+    """
+    if not (folder / "meltsBatchConfig.json").exists():
+        return None
+    catalog = _import("mod.catalog")
+    present = None
+    if (folder / "phases.parquet").exists():
+        columnar = _import("mod.columnar")
+        present = columnar.dataset_experiments(folder / "phases.parquet")
+    elif not (folder / "aggregate.json").exists():  # mod.aggregate.INDEX
+        present = set()  # configurations can be listed before aggregation
+    return catalog.BatchCatalog.from_folder(folder, present=present)
+
+
+def run(args):
+    """
+    Run the experiments of the batch (see :mod:`mod.study`) which aren't complete.
+    """
+    logger, _ = _stream_log("pyrolite-meltsutil", "mod")
+    study = _import("mod.study")
+    batch = _import("mod.batch")
+    df = study.starting_compositions(args.compositions)
+    batch.ParallelMeltsBatch(
+        df,
+        default_config=study.DEFAULT_CONFIG,
+        config_grid=study.CONFIG_GRID,
+        env=study.melts_env(),
+        fromdir=args.folder,
+        logger=logger,
+        processes=args.processes,
+    ).run(overwrite=args.overwrite)
+
+
+def aggregate(args):
+    """
+    Aggregate experiment folders to stores, and copy these to columnar datasets.
+    """
+    _stream_log("pyrolite_meltsutil", "mod")
+    aggregate = _import("mod.aggregate")
+    aggregate.aggregate_to_store(
+        args.folder,
+        processes=args.processes,
+        chunksize=args.chunksize,
+        incremental=not args.full,
+        traces=args.traces,
+    )
+    if args.dataset:
+        columnar = _import("mod.columnar")
+        tables = ["system", "phases"] + (["traces"] if args.traces else [])
+        for table in tables:
+            columnar.store_to_dataset(
+                args.folder / (table + ".h5"), args.folder / (table + ".parquet")
+            )
+
+
+def rank(args):
+    """
+    Rank experiments by the distance of their sequence to a target sequence.
+    """
+    sequence = _import("mod.sequence")
+    cfg = _catalog(args.folder)
+    experiments = None
+    if args.select:
+        if cfg is None:
+            raise SystemExit("Selection requires a batch configuration.")
+        experiments = cfg.select(**_criteria(args.select))
+    columns = ["experiment", "phaseID", "temperature"]
+    if (args.folder / "phases.parquet").exists():
+        columnar = _import("mod.columnar")
+        phases = columnar.read_dataset(
+            args.folder / "phases.parquet", experiments=experiments, columns=columns
+        )
+    else:
+        store = _import("mod.store")
+        phases = store.read_store(args.folder / "phases.h5")[columns]
+        if experiments is not None:
+            phases = phases.loc[phases["experiment"].isin(experiments)]
+    target = [t.split("+") if "+" in t else t for t in args.target]
+    ranked = sequence.rank_experiments(
+        phases, target, ignore_trailing=args.ignore_trailing, metric=args.metric
+    )
+    if cfg is not None:
+        ranked = ranked.join(cfg.table[["name", "Title"]], on="experiment")
+    if args.output is not None:
+        ranked.to_csv(args.output, index=False)
+    print(ranked.head(args.top).to_string(index=False))
+
+
+def list_configs(args):
+    """
+    List the configurations of the experiments within a batch.
+    """
+    cfg = _catalog(args.folder)
+    if cfg is None:
+        raise SystemExit("No batch configuration in {}".format(args.folder))
+    experiments = cfg.select(present=not args.all, **_criteria(args.select))
+    table = cfg.table.loc[experiments]
+    table = table.assign(modes=table["modes"].map(", ".join))
+    print(table.to_string())
+    print("{} of {} experiments".format(len(table), len(cfg)))
+
+
+def metrics(args):
+    """
+    Summarise the compute cost of a batch by configuration, from its run metrics.
+    """
+    telemetry = _import("mod.telemetry")
+    table = telemetry.read_metrics(args.folder, latest=not args.all)
+    if table.empty:
+        raise SystemExit("No run metrics in {}".format(args.folder))
+    cfg = _catalog(args.folder)
+    if cfg is not None:
+        table = table.join(cfg.table[["name", "Title"]], on="experiment")
+    print(telemetry.cost_summary(table, catalog=cfg, by=args.by).to_string())
+    if args.slowest:
+        columns = ["experiment", "Title", "status", "seconds", "steps", "warnings"]
+        columns = [c for c in columns if c in table.columns]
+        slowest = table.sort_values("seconds", ascending=False).head(args.slowest)
+        print(slowest[columns].to_string(index=False))
+
+
+def plot(args):
+    """
+    Build the stale figures of figure scripts (see :class:`mod.build.FigureBuild`).
+    """
+    _stream_log("mod")
+    # figure scripts read their data relative to the src folder
+    os.chdir(SRC)
+    if str(SRC) not in sys.path:
+        sys.path.insert(0, str(SRC))
+    unknown = set(args.scripts) - set(SCRIPTS)
+    if unknown:
+        raise SystemExit("Unknown figure scripts: {}".format(", ".join(unknown)))
+    for script in args.scripts:
+        module = _import(script)
+        names = [n for n in args.figures or [] if n in module.build.targets] or None
+        if args.figures and names is None:
+            continue
+        print(module.build.build(names, force=args.force, processes=args.processes))
+
+
+def parser():
+    """
+    Get the argument parser for the command line interface.
+
+    Returns
+    -------
+    :class:`argparse.ArgumentParser`
+    """
+    experiments = DATA / "experiments"
+    root = argparse.ArgumentParser(prog="python -m mod", description=__doc__)
+    root.add_argument(
+        "--timing", action="store_true", help="report the time taken by imports"
+    )
+    # --timing can also be given after the command, where it's suppressed by default
+    # such that commands don't reset it
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument(
+        "--timing",
+        action="store_true",
+        default=argparse.SUPPRESS,
+        help="report the time taken by imports",
+    )
+    commands = root.add_subparsers(dest="command", required=True)
+    add_parser = functools.partial(commands.add_parser, parents=[common])
+
+    cmd = add_parser("run", help=run.__doc__.strip())
+    cmd.add_argument("folder", type=Path, nargs="?", default=experiments)
+    cmd.add_argument(
+        "--compositions",
+        type=Path,
+        default=DATA / "starting_compositions_all.csv",
+    )
+    cmd.add_argument("--processes", type=int, default=None)
+    cmd.add_argument(
+        "--overwrite", action="store_true", help="rerun completed experiments"
+    )
+    cmd.set_defaults(func=run)
+
+    cmd = add_parser("aggregate", help=aggregate.__doc__.strip())
+    cmd.add_argument("folder", type=Path, nargs="?", default=experiments)
+    cmd.add_argument("--processes", type=int, default=None)
+    cmd.add_argument("--chunksize", type=int, default=50)
+    cmd.add_argument(
+        "--full", action="store_true", help="rebuild rather than update the stores"
+    )
+    cmd.add_argument(
+        "--traces", action="store_true", help="aggregate trace element tables"
+    )
+    cmd.add_argument(
+        "--no-dataset",
+        dest="dataset",
+        action="store_false",
+        help="skip copying the stores to columnar datasets",
+    )
+    cmd.set_defaults(func=aggregate)
+
+    cmd = add_parser("rank", help=rank.__doc__.strip())
+    cmd.add_argument("folder", type=Path, nargs="?", default=experiments)
+    cmd.add_argument(
+        "--target",
+        nargs="+",
+        default=TARGET,
+        help="target sequence, joining phases which appear together with +",
+    )
+    cmd.add_argument("--metric", choices=["levenshtein", "set"], default="levenshtein")
+    cmd.add_argument("--ignore-trailing", action="store_true")
+    cmd.add_argument(
+        "--select", nargs="+", metavar="KEY=VALUE", help="catalog columns to select"
+    )
+    cmd.add_argument("--top", type=int, default=20)
+    cmd.add_argument("--output", type=Path, default=None, help="csv for the ranking")
+    cmd.set_defaults(func=rank)
+
+    cmd = add_parser("list", help=list_configs.__doc__.strip())
+    cmd.add_argument("folder", type=Path, nargs="?", default=experiments)
+    cmd.add_argument(
+        "--select", nargs="+", metavar="KEY=VALUE", help="catalog columns to select"
+    )
+    cmd.add_argument(
+        "--all", action="store_true", help="include experiments not aggregated"
+    )
+    cmd.set_defaults(func=list_configs)
+
+    cmd = add_parser("metrics", help=metrics.__doc__.strip())
+    cmd.add_argument("folder", type=Path, nargs="?", default=experiments)
+    cmd.add_argument(
+        "--by",
+        nargs="+",
+        default=["modes", "H2O"],
+        help="metrics or catalog columns to group by",
+    )
+    cmd.add_argument("--slowest", type=int, default=10)
+    cmd.add_argument("--all", action="store_true", help="include earlier runs")
+    cmd.set_defaults(func=metrics)
+
+    cmd = add_parser("plot", help=plot.__doc__.strip())
+    cmd.add_argument(
+        "scripts", nargs="*", default=SCRIPTS, help=", ".join(SCRIPTS), metavar="script"
+    )
+    cmd.add_argument("--figures", nargs="+", help="figures to build, defaulting to all")
+    cmd.add_argument("--force", action="store_true", help="rebuild current figures")
+    cmd.add_argument("--processes", type=int, default=None)
+    cmd.set_defaults(func=plot)
+    return root
+
+
+def main(argv=None):
+    """
+    Run a command, optionally reporting the time taken by imports.
+
+    Parameters
+    -----------
+    argv : :class:`list`
+        Command line arguments, defaulting to those of the process.
+    """
+    args = parser().parse_args(argv)
+    args.func(args)
+    if args.timing:
+        total = time.perf_counter() - STARTED
+        imports = sum(import_times.values())
+        sys.stderr.write(
+            "{:.2f} s total, {:.2f} s importing:\n".format(total, imports)
+            + "".join(
+                "  {:<28} {:.2f} s\n".format(name, seconds)
+                for name, seconds in import_times.items()
+            )
+        )
@@ -0,0 +1,184 @@
+"""
+Columnar (Parquet) datasets for aggregated system and phase tables, partitioned by
+experiment and with dictionary-encoded phase names, such that filters on
+experiment, phase and temperature and selections of columns can be pushed down to
+the file scan.
+"""
+import shutil
+from pathlib import Path
+import pyarrow as pa
+import pyarrow.parquet as pq
+from .store import iter_store, _normalise_index
+from .compact import compact as _compact
+
+DICTIONARY_COLUMNS = ["phase", "phaseID"]
+
+
+def _to_arrow(df):
+    """
+    Convert an aggregated table to an Arrow table, dictionary-encoding the phase
+    names and converting formulae to strings.
+
+    Parameters
+    -----------
+    df : :class:`pandas.DataFrame`
+        Aggregated system or phase table.
+
+    Returns
+    -------
+    :class:`pyarrow.Table`
+    """
+    df = _normalise_index(df.copy())
+    for c in DICTIONARY_COLUMNS:
+        if c in df.columns:
+            df[c] = df[c].astype("category")
+    if "formula" in df.columns:  # periodictable formulae aren't serializable
+        df["formula"] = df["formula"].map(lambda f: None if f is None else str(f))
+    return pa.Table.from_pandas(df, preserve_index=True)
+
+
+def write_dataset(df, path):
+    """
+    Write an aggregated table to a dataset partitioned by experiment, replacing the
+    partitions for any experiments which are already present.
+
+    Parameters
+    -----------
+    df : :class:`pandas.DataFrame`
+        Aggregated system or phase table, including an :code:`experiment` column.
+    path : :class:`str` | :class:`pathlib.Path`
+        Root folder of the dataset.
+    """
+    pq.write_to_dataset(
+        _to_arrow(df),
+        str(path),
+        partition_cols=["experiment"],
+        existing_data_behavior="delete_matching",
+    )
+
+
+def dataset_experiments(path):
+    """
+    Get the experiments present in a dataset from its partitions, without reading
+    any data.
+
+    Parameters
+    -----------
+    path : :class:`str` | :class:`pathlib.Path`
+        Root folder of the dataset.
+
+    Returns
+    -------
+    :class:`list`
+    """
+    path = Path(path)
+    if not path.exists():
+        return []
+    return sorted(
+        p.name.split("=", 1)[1]
+        for p in path.iterdir()
+        if p.is_dir() and p.name.startswith("experiment=")
+    )
+
+
+def drop_dataset_experiments(path, experiments):
+    """
+    Remove the partitions for a set of experiments from a dataset.
+
+    Parameters
+    -----------
+    path : :class:`str` | :class:`pathlib.Path`
+        Root folder of the dataset.
+    experiments : :class:`list`
+        Names of experiments to remove.
+    """
+    for name in experiments:
+        partition = Path(path) / "experiment={}".format(name)
+        if partition.exists():
+            shutil.rmtree(str(partition))
+
+
+def store_to_dataset(store, path, overwrite=True):
+    """
+    Convert a store of aggregated tables (see :mod:`mod.store`) to a dataset, a
+    chunk at a time.
+
+    Parameters
+    -----------
+    store : :class:`str` | :class:`pathlib.Path`
+        Path to the HDF store.
+    path : :class:`str` | :class:`pathlib.Path`
+        Root folder of the dataset.
+    overwrite : :class:`bool`
+        Whether to remove an existing dataset first, rather than only replacing the
+        partitions for experiments within the store.
+    """
+    if overwrite and Path(path).exists():
+        shutil.rmtree(str(path))
+    for df in iter_store(store):
+        write_dataset(df, path)
+
+
+def read_dataset(
+    path,
+    experiments=None,
+    phases=None,
+    phaseIDs=None,
+    temperature=None,
+    columns=None,
+    compact=False,
+):
+    """
+    Read an aggregated table from a dataset, reading only the partitions, row groups
+    and columns required for the filters and columns given.
+
+    Parameters
+    -----------
+    path : :class:`str` | :class:`pathlib.Path`
+        Root folder of the dataset.
+    experiments : :class:`list`
+        Experiments to read, defaulting to all.
+    phases : :class:`list`
+        Phase names (e.g. :code:`"clinopyroxene"`) to read, defaulting to all.
+    phaseIDs : :class:`list`
+        Phase IDs (e.g. :code:`"clinopyroxene_0"`) to read, defaulting to all.
+    temperature : :class:`tuple`
+        Inclusive range of temperatures to read.
+    columns : :class:`list`
+        Columns to read, defaulting to all.
+    compact : :class:`bool`
+        Whether to convert the table to compact dtypes (see
+        :func:`mod.compact.compact`), keeping the dictionary-encoded columns as
+        categoricals rather than strings.
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+    """
+    filters = []
+    if experiments is not None:
+        filters.append(("experiment", "in", list(experiments)))
+    if phases is not None:
+        filters.append(("phase", "in", list(phases)))
+    if phaseIDs is not None:
+        filters.append(("phaseID", "in", list(phaseIDs)))
+    if temperature is not None:
+        tmin, tmax = temperature
+        filters += [("temperature", ">=", tmin), ("temperature", "<=", tmax)]
+    table = pq.read_table(
+        str(path),
+        columns=list(columns) if columns is not None else None,
+        filters=filters or None,
+        use_pandas_metadata=True,
+    )
+    df = table.to_pandas()
+    if "experiment" in df.columns:  # partition columns are read last
+        df = df.reindex(
+            columns=["experiment"] + [c for c in df.columns if c != "experiment"]
+        )
+    if compact:
+        return _compact(df)
+    for c in ["experiment"] + DICTIONARY_COLUMNS:
+        if c in df.columns:
+            df[c] = df[c].astype(object)
+    return df
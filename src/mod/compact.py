@@ -0,0 +1,140 @@
+"""
+Compact dtypes for aggregated system and phase tables, storing repeated
+identifiers as categoricals and, optionally, compositions as single-precision
+floats.
+"""
+import numpy as np
+import pandas as pd
+
+IDENTIFIERS = ["experiment", "phase", "phaseID", "structure"]
+# alphaMELTS tables are written to six significant figures, which single precision
+# (~7 significant figures) holds within this relative tolerance
+FLOAT32_RTOL = 1e-6
+
+
+def _float32_safe(values, rtol=0.0):
+    """
+    Check whether an array of values can be stored in single precision, either
+    exactly or within a relative tolerance.
+
+    Parameters
+    -----------
+    values : :class:`numpy.ndarray`
+        Values to check.
+    rtol : :class:`float`
+        Maximum relative error to accept, where zero requires the values to be
+        recovered exactly.
+
+    Returns
+    -------
+    :class:`bool`
+    """
+    values = np.asarray(values, dtype=float)
+    finite = np.isfinite(values)
+    with np.errstate(over="ignore"):
+        downcast = values[finite].astype(np.float32).astype(float)
+    return bool(
+        np.isfinite(downcast).all()
+        and np.allclose(downcast, values[finite], rtol=rtol, atol=0)
+    )
+
+
+def compact(df, identifiers=IDENTIFIERS, float32=None, rtol=None):
+    """
+    Reduce the memory used by an aggregated table by converting identifiers to
+    categoricals and, where a tolerance is given, downcasting compositional columns
+    to single precision.
+
+    Parameters
+    -----------
+    df : :class:`pandas.DataFrame`
+        Aggregated system or phase table.
+    identifiers : :class:`list`
+        Columns to convert to categoricals, where present.
+    float32 : :class:`list`
+        Columns to consider for downcasting, defaulting to the oxide columns.
+    rtol : :class:`float`
+        Maximum relative error to accept for downcast values. By default columns
+        are left in double precision, such that results and figures are unchanged;
+        parsed values are seldom exactly representable in single precision, so
+        requiring an exact round trip would downcast next to nothing. A tolerance
+        of :data:`FLOAT32_RTOL` downcasts values parsed from alphaMELTS tables
+        without loss of meaningful precision, but can shift plotted points by a
+        fraction of a pixel.
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+        Table with compact dtypes.
+
+    Notes
+    -----
+    Only compositional columns are considered for downcasting; temperatures,
+    pressures and steps are left in double precision such that comparisons against
+    them are unchanged.
+    """
+    df = df.copy()
+    for c in identifiers:
+        if c in df.columns and not isinstance(df[c].dtype, pd.CategoricalDtype):
+            df[c] = df[c].astype("category")
+    if rtol is None:
+        return df
+    if float32 is None:
+        from pyrolite.geochem.ind import common_oxides
+
+        oxides = set(common_oxides())
+        float32 = [c for c in df.columns if c in oxides]
+    for c in float32:
+        if (
+            c in df.columns
+            and df[c].dtype == np.float64
+            and _float32_safe(df[c].values, rtol=rtol)
+        ):
+            df[c] = df[c].astype(np.float32)
+    return df
+
+
+def memory_usage(df):
+    """
+    Get the memory used by a table, including that of its object columns.
+
+    Parameters
+    -----------
+    df : :class:`pandas.DataFrame`
+        Table to measure.
+
+    Returns
+    -------
+    :class:`int`
+        Memory use in bytes.
+    """
+    return int(df.memory_usage(deep=True, index=True).sum())
+
+
+def memory_report(tables, **kwargs):
+    """
+    Report the memory used by tables before and after compaction.
+
+    Parameters
+    -----------
+    tables : :class:`dict`
+        Dictionary of named tables.
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+        Memory use (MB) before and after compaction, and the proportional reduction.
+    """
+    rows = []
+    for name, df in tables.items():
+        before, after = memory_usage(df), memory_usage(compact(df, **kwargs))
+        rows.append(
+            {
+                "table": name,
+                "rows": df.index.size,
+                "before (MB)": before / 2 ** 20,
+                "after (MB)": after / 2 ** 20,
+                "reduction": 1 - after / before,
+            }
+        )
+    return pd.DataFrame(rows).set_index("table")
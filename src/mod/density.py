@@ -0,0 +1,328 @@
+"""
+Cached kernel density grids for overlays of observed compositions, such that the
+density estimate for a dataset and projection is evaluated once and reused across
+figures and figure builds.
+"""
+import os
+import pickle
+import hashlib
+from pathlib import Path
+import numpy as np
+import scipy.stats
+import scipy.special
+from pyrolite.comp.codata import close, ILR
+from pyrolite.util.math import flattengrid
+from pyrolite.util.plot.axes import init_axes, label_axes
+from pyrolite.util.plot.style import DEFAULT_CONT_COLORMAP
+from pyrolite.util.plot.density import (
+    get_axis_density_methods,
+    percentile_contour_values_from_meshz,
+    plot_Z_percentiles,
+)
+from pyrolite.plot.density.grid import DensityGrid
+from pyrolite.plot.density.ternary import ternary_heatmap
+from .cache import digest
+
+
+class KernelDensity(object):
+    """
+    Gaussian kernel density estimate, equivalent to
+    :class:`scipy.stats.gaussian_kde`. Data and samples are whitened by the kernel
+    covariance, such that the kernel distances for blocks of samples are evaluated
+    as matrix products, and the whitened data are kept such that the estimate can
+    be evaluated repeatedly.
+
+    Parameters
+    -----------
+    data : :class:`numpy.ndarray`
+        Data to estimate the density from, of shape :code:`(n, d)`.
+    bw_method : :class:`str` | :class:`float` | :class:`callable`
+        Bandwidth method (see :class:`scipy.stats.gaussian_kde`).
+    """
+
+    def __init__(self, data, bw_method=None):
+        data = np.atleast_2d(data)
+        self.covariance = scipy.stats.gaussian_kde(
+            data.T, bw_method=bw_method
+        ).covariance
+        self._whiten = np.linalg.cholesky(np.linalg.inv(self.covariance))
+        self._X = data @ self._whiten
+        self._xx = (self._X ** 2).sum(axis=1)
+        n = self._X.shape[0]
+        self._norm = n * np.sqrt(np.linalg.det(2 * np.pi * self.covariance))
+
+    def _exponents(self, samples, blocksize):
+        """
+        Get the kernel exponents for blocks of samples.
+
+        Parameters
+        -----------
+        samples : :class:`numpy.ndarray`
+            Points to evaluate the density at, of shape :code:`(m, d)`.
+        blocksize : :class:`int`
+            Maximum number of sample-data pairs to evaluate at a time.
+
+        Yields
+        -------
+        :class:`tuple`
+            Slice of the samples and the exponents for each sample-data pair.
+        """
+        Y = np.atleast_2d(samples) @ self._whiten
+        step = max(1, blocksize // self._X.shape[0])
+        for lo in range(0, Y.shape[0], step):
+            y = Y[lo : lo + step]
+            # -0.5 * squared distances, evaluated in place
+            e = y @ self._X.T
+            e -= 0.5 * (y ** 2).sum(axis=1)[:, None]
+            e -= 0.5 * self._xx[None, :]
+            np.minimum(e, 0, out=e)
+            yield slice(lo, lo + step), e
+
+    def evaluate(self, samples, blocksize=2 ** 22):
+        """
+        Evaluate the density at a set of points.
+
+        Parameters
+        -----------
+        samples : :class:`numpy.ndarray`
+            Points to evaluate the density at, of shape :code:`(m, d)`.
+        blocksize : :class:`int`
+            Maximum number of sample-data pairs to evaluate at a time.
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            Density at each sample point.
+        """
+        density = np.empty(np.atleast_2d(samples).shape[0])
+        for block, e in self._exponents(samples, blocksize):
+            np.exp(e, out=e)
+            density[block] = e.sum(axis=1)
+        return density / self._norm
+
+    def logpdf(self, samples, blocksize=2 ** 22):
+        """
+        Evaluate the log-density at a set of points, which remains finite for
+        points far from the data.
+
+        Parameters
+        -----------
+        samples : :class:`numpy.ndarray`
+            Points to evaluate the density at, of shape :code:`(m, d)`.
+        blocksize : :class:`int`
+            Maximum number of sample-data pairs to evaluate at a time.
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            Log-density at each sample point.
+        """
+        logdensity = np.empty(np.atleast_2d(samples).shape[0])
+        for block, e in self._exponents(samples, blocksize):
+            logdensity[block] = scipy.special.logsumexp(e, axis=1)
+        return logdensity - np.log(self._norm)
+
+
+def kde(data, samples, bw_method=None, blocksize=2 ** 22):
+    """
+    Evaluate a Gaussian kernel density estimate at a set of points (see
+    :class:`KernelDensity`).
+
+    Parameters
+    -----------
+    data : :class:`numpy.ndarray`
+        Data to estimate the density from, of shape :code:`(n, d)`.
+    samples : :class:`numpy.ndarray`
+        Points to evaluate the density at, of shape :code:`(m, d)`.
+    bw_method : :class:`str` | :class:`float` | :class:`callable`
+        Bandwidth method (see :class:`scipy.stats.gaussian_kde`).
+    blocksize : :class:`int`
+        Maximum number of sample-data pairs to evaluate at a time.
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        Density at each sample point.
+    """
+    return KernelDensity(data, bw_method=bw_method).evaluate(samples, blocksize)
+
+
+def density_grid(
+    arr, bins=25, contours=[], logx=False, logy=False, vmin=0.02, bw_method=None
+):
+    """
+    Evaluate the density grid and contour levels for a binary or ternary density
+    plot, as drawn by :func:`pyrolite.plot.density.density` with percentile
+    contours.
+
+    Parameters
+    -----------
+    arr : :class:`numpy.ndarray`
+        Data of shape :code:`(n, 2)` or :code:`(n, 3)`, the latter being ternary.
+    bins : :class:`int`
+        Number of bins for the grid.
+    contours : :class:`list`
+        Percentile contours.
+    logx, logy : :class:`bool`
+        Whether to use log-spaced grids for binary plots.
+    vmin : :class:`float`
+        Fraction of the maximum density below which ternary grids are trimmed.
+    bw_method : :class:`str` | :class:`float` | :class:`callable`
+        Bandwidth method (see :class:`scipy.stats.gaussian_kde`).
+
+    Returns
+    -------
+    :class:`dict`
+        Projection, grid coordinates, density and contour levels.
+    """
+    arr = np.array(arr, dtype=float)
+    arr = arr[np.isfinite(arr).all(axis=-1)]
+    if arr.shape[-1] == 3:
+        arr[~(arr > 0).all(axis=1), :] = np.nan
+        arr = close(arr)
+        # the grid is taken from the histogram mode, which doesn't evaluate a KDE
+        _, _, data = ternary_heatmap(arr, bins=bins, mode="histogram")
+        tdata = close(arr)  # as for the grid
+        tdata = ILR(tdata[np.isfinite(tdata).all(axis=1)])
+        zi = kde(tdata, flattengrid(data["tfm_edges"]), bw_method=bw_method)
+        zi = zi.reshape(data["tfm_edges"][0].shape)
+        zi[~np.isfinite(zi)] = 0
+        vmin = percentile_contour_values_from_meshz(zi, [1.0 - vmin])[1][0]
+        fltr = (zi != 0) & (zi >= vmin)
+        coords = list(data["tern_edges"][fltr.flatten(), :].T)
+        zi = zi[fltr].flatten()
+        projection = "ternary"
+    else:
+        x, y = arr.T
+        grid = DensityGrid(x, y, bins=bins, logx=logx, logy=logy)
+        xt, yt = [[lambda v: v, np.log][log] for log in [logx, logy]]
+        samples = flattengrid(np.meshgrid(xt(grid.grid_xe), yt(grid.grid_ye)))
+        zi = kde(np.vstack([xt(x), yt(y)]).T, samples, bw_method=bw_method)
+        zi = zi.reshape(grid.grid_xei.shape)
+        coords = [grid.grid_xei, grid.grid_yei]
+        projection = None
+    labels, levels = percentile_contour_values_from_meshz(zi, percentiles=contours)
+    return dict(
+        projection=projection,
+        coords=coords,
+        zi=zi,
+        contours=list(contours),
+        labels=list(labels),
+        levels=np.asarray(levels),
+    )
+
+
+def cached_density_grid(df, name=None, cache=None, **kwargs):
+    """
+    Get the density grid for a table of observations (see :func:`density_grid`),
+    cached on disk keyed by a name (e.g. the mineral), the columns, the content of
+    the data and the grid parameters.
+
+    Parameters
+    -----------
+    df : :class:`pandas.DataFrame`
+        Observations, with two or three columns.
+    name : :class:`str`
+        Name of the dataset.
+    cache : :class:`str` | :class:`pathlib.Path`
+        Folder to cache density grids within.
+
+    Returns
+    -------
+    :class:`dict`
+    """
+    arr = df.values.astype(float)
+    if cache is None:
+        return density_grid(arr, **kwargs)
+    cache = Path(cache)
+    cache.mkdir(parents=True, exist_ok=True)
+    key = digest(
+        {
+            "name": name,
+            "columns": [str(c) for c in df.columns],
+            "data": hashlib.sha1(np.ascontiguousarray(arr).tobytes()).hexdigest(),
+            "grid": {k: repr(v) for k, v in kwargs.items()},
+        }
+    )
+    path = cache / ("density_" + key + ".pkl")
+    if path.exists():
+        with open(str(path), "rb") as f:
+            return pickle.load(f)
+    grid = density_grid(arr, **kwargs)
+    tmp = path.with_suffix(".tmp")
+    with open(str(tmp), "wb") as f:
+        pickle.dump(grid, f)
+    os.replace(str(tmp), str(path))
+    return grid
+
+
+def density(
+    df,
+    ax=None,
+    name=None,
+    cache=None,
+    bins=25,
+    contours=[0.95, 0.66, 0.33],
+    label_contours=True,
+    cmap=DEFAULT_CONT_COLORMAP,
+    axlabels=True,
+    **kwargs
+):
+    """
+    Draw percentile density contours for a table of observations, as for
+    :code:`df.pyroplot.density(contours=...)`, using a cached density grid (see
+    :func:`cached_density_grid`).
+
+    Parameters
+    -----------
+    df : :class:`pandas.DataFrame`
+        Observations, with two or three columns.
+    ax : :class:`matplotlib.axes.Axes`
+        Axes to draw on.
+    name : :class:`str`
+        Name of the dataset (e.g. the mineral), used to key the cache.
+    cache : :class:`str` | :class:`pathlib.Path`
+        Folder to cache density grids within.
+    bins : :class:`int`
+        Number of bins for the grid.
+    contours : :class:`list`
+        Percentile contours.
+    label_contours : :class:`bool`
+        Whether to label the contours.
+    cmap : :class:`matplotlib.colors.Colormap`
+        Colormap for the contours, where colors aren't given.
+    axlabels : :class:`bool`
+        Whether to label the axes with the column names.
+
+    Returns
+    -------
+    :class:`matplotlib.axes.Axes`
+    """
+    grid = cached_density_grid(
+        df,
+        name=name,
+        cache=cache,
+        bins=bins,
+        contours=contours,
+        **{k: kwargs.pop(k) for k in ["logx", "logy", "bw_method"] if k in kwargs}
+    )
+    ax = init_axes(ax=ax, projection=grid["projection"], **kwargs)
+    if label_contours:
+        plot_Z_percentiles(
+            *grid["coords"],
+            zi=grid["zi"],
+            ax=ax,
+            percentiles=contours,
+            cmap=cmap,
+            **kwargs
+        )
+    else:
+        _, contour, _ = get_axis_density_methods(ax)
+        if kwargs.get("colors") is not None:
+            cmap = None
+        contour(*grid["coords"], grid["zi"], levels=grid["levels"], cmap=cmap, **kwargs)
+    if grid["projection"] == "ternary":
+        ax.set_aspect("equal")
+    if axlabels:
+        label_axes(ax, labels=df.columns)
+    return ax
@@ -0,0 +1,602 @@
+"""
+Surrogate models of alphaMELTS crystallisation sequences, trained on aggregated
+experiments such that candidate compositions and configurations can be screened
+before they're run.
+"""
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.model_selection import KFold, GroupKFold
+from pyrolite.comp.codata import close, ILR
+from pyrolite.geochem.ind import common_oxides
+from pyrolite_meltsutil.util.tables import phasename
+from pyrolite_meltsutil.util.log import Handle
+from .sequence import appearance_table, get_appearance_sequence, rank_experiments
+
+logger = Handle(__name__)
+
+# configuration keys used as features, and their defaults where not given
+NUMERIC = {
+    "H2O": 0.0,
+    "Initial Pressure": np.nan,
+    "Initial Temperature": np.nan,
+    "Final Temperature": np.nan,
+    "Log fO2 Delta": 0.0,
+}
+CATEGORICAL = {"Log fO2 Path": "None"}
+STATUSES = ["reject", "uncertain", "promising"]
+
+
+def config_records(config):
+    """
+    Flatten a batch configuration to a table of compositions and configuration
+    values, with one row per experiment.
+
+    Parameters
+    -----------
+    config : :class:`dict` | :class:`mod.catalog.BatchCatalog`
+        Batch configuration, indexed by experiment hashes.
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+    """
+    records = pd.DataFrame.from_dict(
+        {hsh: cfg for hsh, (name, cfg, env) in config.items()}, orient="index"
+    )
+    records.index.name = "experiment"
+    return records
+
+
+def appearance_temperatures(phases, ignore=["bulk", "cumulate", "solid"]):
+    """
+    Get the temperature at which each phase first appears within each experiment.
+
+    Parameters
+    -----------
+    phases : :class:`pandas.DataFrame`
+        Multi-experiment phase table.
+    ignore : :class:`list`
+        Phases to ignore.
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+        Appearance temperatures indexed by experiment, with a column for each phase
+        name, which are missing where a phase doesn't appear.
+    """
+    table = appearance_table(phases, ignore=ignore)
+    names = {p: phasename(p) for p in pd.unique(table["phaseID"].values)}
+    table["phase"] = [names[p] for p in table["phaseID"].values]
+    temperatures = table.groupby(["experiment", "phase"], sort=False)["first"].max()
+    temperatures = temperatures.unstack("phase")
+    temperatures.columns.name = None
+    return temperatures
+
+
+def design_matrix(records, components=None, defaults={}, columns=None):
+    """
+    Build features for a set of experiments; the composition in isometric
+    log-ratio (ILR) space, H2O, pressure, temperature range, oxygen buffer and
+    modes.
+
+    Parameters
+    -----------
+    records : :class:`pandas.DataFrame`
+        Compositions and configuration values for each experiment (see
+        :func:`config_records`). Where a :code:`modifychem` column is present (e.g.
+        for sampled replicates), its values override the composition.
+    components : :class:`list`
+        Anhydrous components to transform to ILR space, defaulting to the oxides
+        which are positive for all experiments.
+    defaults : :class:`dict`
+        Configuration values for those not given within the records (e.g. the
+        :code:`default_config` of a batch).
+    columns : :class:`list`
+        Feature columns to return (e.g. those a model was trained with), where
+        missing buffers and modes are filled with zeros.
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+        Features indexed as the records.
+    """
+    records = records.copy()
+    for key, value in defaults.items():
+        if key not in records.columns:
+            records[key] = [value] * records.index.size
+        else:
+            records[key] = [value if _isnull(v) else v for v in records[key].values]
+    if "modifychem" in records.columns:
+        for ix, changes in enumerate(records["modifychem"].values):
+            for key, value in (changes or {}).items():
+                records.iloc[ix, records.columns.get_loc(key)] = value
+    if components is None:
+        components = _components(records)
+    arr = records[list(components)].apply(pd.to_numeric, errors="coerce").values
+    if not (arr > 0).all():
+        raise ValueError("Compositions must be positive for all components.")
+    features = pd.DataFrame(
+        ILR(close(arr)),
+        index=records.index,
+        columns=["ILR{}".format(ix) for ix in range(len(components) - 1)],
+    )
+    for key, default in NUMERIC.items():
+        values = records[key] if key in records.columns else default
+        features[key] = pd.to_numeric(values, errors="coerce")
+    for key, default in CATEGORICAL.items():
+        values = records[key] if key in records.columns else default
+        values = pd.Series(values, index=records.index).fillna(default).astype(str)
+        for value in sorted(values.unique()):
+            features["{}={}".format(key, value)] = (values == value).astype(float)
+    modes = records["modes"] if "modes" in records.columns else [[]] * len(records)
+    modes = [[m] if isinstance(m, str) else list(m or []) for m in modes]
+    for mode in sorted(set().union(*modes)):
+        features["mode={}".format(mode)] = [float(mode in m) for m in modes]
+    if columns is not None:
+        features = features.reindex(columns=columns, fill_value=0.0)
+    if features.isnull().values.any():
+        missing = features.columns[features.isnull().any(axis=0)]
+        raise ValueError("Missing features: {}".format(", ".join(missing)))
+    return features
+
+
+def _isnull(value):
+    return np.ndim(value) == 0 and pd.isnull(value)
+
+
+def _components(records):
+    """
+    Get the anhydrous oxides which are positive for all of a set of experiments.
+    """
+    oxides = [c for c in records.columns if c in common_oxides() and c != "H2O"]
+    values = records[oxides].apply(pd.to_numeric, errors="coerce")
+    return [c for c in oxides if (values[c] > 0).all()]
+
+
+def _sequence_ranks(temperatures):
+    """
+    Rank phases by their appearance temperatures, where phases which appear
+    together share a rank.
+
+    Parameters
+    -----------
+    temperatures : :class:`numpy.ndarray`
+        Appearance temperatures of shape :code:`(n, phases)`, which are missing
+        where phases don't appear.
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        Dense ranks in order of appearance, starting from one, with zeros for
+        phases which don't appear.
+    """
+    filled = np.where(np.isnan(temperatures), -np.inf, temperatures)
+    order = np.argsort(-filled, axis=1, kind="stable")
+    ordered = np.take_along_axis(filled, order, axis=1)
+    changes = np.ones(ordered.shape, dtype=int)
+    changes[:, 1:] = ordered[:, 1:] != ordered[:, :-1]
+    ranks = np.empty_like(changes)
+    np.put_along_axis(ranks, order, np.cumsum(changes, axis=1), axis=1)
+    ranks[np.isnan(temperatures)] = 0
+    return ranks
+
+
+def _distances(temperatures, phases, target_sequence, **kwargs):
+    """
+    Get distances to a target sequence for arrays of appearance temperatures,
+    computing the distance once for each distinct sequence.
+
+    Parameters
+    -----------
+    temperatures : :class:`numpy.ndarray`
+        Appearance temperatures of shape :code:`(n, phases)`, which are missing
+        where phases don't appear.
+    phases : :class:`list`
+        Names of the phases.
+    target_sequence : :class:`list`
+        Target sequence (see :func:`mod.sequence.rank_experiments`).
+    kwargs
+        Keyword arguments for :func:`mod.sequence.rank_experiments`.
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        Distance for each set of temperatures.
+    """
+    ranks = np.ascontiguousarray(_sequence_ranks(temperatures), dtype=np.uint8)
+    # sequences are hashed by the bytes of their ranks, rather than sorted
+    keys = ranks.view("S{}".format(ranks.shape[1])).ravel()
+    inverse, unique = pd.factorize(keys)
+    unique = ranks[np.unique(inverse, return_index=True)[1]]
+    sequence, phase = np.nonzero(unique)
+    table = pd.DataFrame(
+        {
+            "experiment": sequence,
+            "phaseID": np.array(phases, dtype=object)[phase],
+            "temperature": -unique[sequence, phase].astype(float),
+        }
+    )
+    distances = rank_experiments(table, target_sequence, **kwargs)
+    distances = distances.set_index("experiment")["distance"]
+    # sequences without any phases are only compared where trailing phases are
+    empty = 0 if kwargs.get("ignore_trailing") else len(target_sequence)
+    distances = distances.reindex(np.arange(unique.shape[0]), fill_value=empty)
+    return distances.values[inverse].astype(float)
+
+
+class SequenceEmulator(object):
+    """
+    Emulator for the temperatures at which phases appear during crystallisation,
+    and hence crystallisation sequences, of experiments given their composition
+    and configuration (see :func:`design_matrix`).
+
+    Appearance temperatures for all phases are predicted jointly with a random
+    forest, where phases which don't appear are given a temperature one step below
+    the final temperature of the experiment. Each tree gives a plausible set of
+    appearance temperatures, such that the probability of each phase appearing,
+    and the spread of sequence distances to a target sequence, follow from the
+    agreement between trees. Predictions for batches of candidates take
+    microseconds per candidate, compared to minutes for alphaMELTS.
+
+    Parameters
+    -----------
+    resolution : :class:`float`
+        Temperature step of the experiments, to which predicted appearance
+        temperatures are rounded such that phases can appear together.
+    model : :class:`sklearn.base.RegressorMixin`
+        Multi-output regressor, defaulting to a
+        :class:`~sklearn.ensemble.RandomForestRegressor`; estimates from
+        individual members are used where the model is an ensemble.
+    seed : :class:`int`
+        Random seed for the default model.
+    """
+
+    def __init__(self, resolution=10.0, model=None, seed=0):
+        self.resolution = resolution
+        if model is None:
+            model = RandomForestRegressor(
+                n_estimators=100, min_samples_leaf=1, random_state=seed, n_jobs=-1
+            )
+        self.model = model
+
+    def fit(self, records, temperatures, defaults={}):
+        """
+        Train the emulator.
+
+        Parameters
+        -----------
+        records : :class:`pandas.DataFrame`
+            Compositions and configuration values for each experiment (see
+            :func:`config_records`).
+        temperatures : :class:`pandas.DataFrame`
+            Appearance temperatures for each experiment (see
+            :func:`appearance_temperatures`).
+        defaults : :class:`dict`
+            Configuration values for those not given within the records.
+
+        Returns
+        -------
+        :class:`SequenceEmulator`
+        """
+        records = records.loc[records.index.isin(temperatures.index)]
+        self.components = _components(records)
+        X = design_matrix(records, components=self.components, defaults=defaults)
+        self.columns = list(X.columns)
+        self.phases = list(temperatures.columns)
+        Y = temperatures.reindex(index=records.index).values
+        floor = X["Final Temperature"].values[:, None] - self.resolution
+        self.model.fit(X.values, np.where(np.isnan(Y), floor, Y))
+        return self
+
+    def features(self, records, defaults={}):
+        """
+        Build features for a set of experiments, consistent with those the
+        emulator was trained with (see :func:`design_matrix`).
+        """
+        return design_matrix(
+            records, components=self.components, defaults=defaults, columns=self.columns
+        )
+
+    def _members(self, records, defaults={}):
+        """
+        Get appearance temperatures predicted by each member of the model.
+
+        Returns
+        -------
+        :class:`tuple`
+            Temperatures of shape :code:`(members, n, phases)`, which are missing
+            where phases aren't predicted to appear, and the features.
+        """
+        X = self.features(records, defaults=defaults)
+        members = getattr(self.model, "estimators_", [self.model])
+        T = np.stack([m.predict(X.values) for m in members]).reshape(
+            len(members), X.shape[0], len(self.phases)
+        )
+        threshold = X["Final Temperature"].values[None, :, None]
+        T[T < threshold - self.resolution / 2] = np.nan
+        return T, X
+
+    def predict(self, records, defaults={}):
+        """
+        Predict the probability that each phase appears, and the temperature at
+        which it does.
+
+        Parameters
+        -----------
+        records : :class:`pandas.DataFrame`
+            Compositions and configuration values for each candidate.
+        defaults : :class:`dict`
+            Configuration values for those not given within the records.
+
+        Returns
+        -------
+        :class:`tuple`
+            Appearance temperatures, which are missing for phases predicted not
+            to appear, and probabilities of appearance, each indexed as the records
+            with a column for each phase.
+        """
+        T, X = self._members(records, defaults=defaults)
+        present = np.isfinite(T)
+        probability = present.mean(axis=0)
+        with np.errstate(invalid="ignore"):
+            temperature = np.where(present, T, 0).sum(axis=0) / present.sum(axis=0)
+        temperature[probability < 0.5] = np.nan
+        temperatures, probabilities = [
+            pd.DataFrame(arr, index=records.index, columns=self.phases)
+            for arr in [temperature, probability]
+        ]
+        return temperatures, probabilities
+
+    def _rounded(self, T):
+        return np.round(T / self.resolution) * self.resolution
+
+    def predict_sequences(self, records, defaults={}, flatten=False):
+        """
+        Predict the crystallisation sequence for each candidate.
+
+        Parameters
+        -----------
+        records : :class:`pandas.DataFrame`
+            Compositions and configuration values for each candidate.
+        defaults : :class:`dict`
+            Configuration values for those not given within the records.
+        flatten : :class:`bool`
+            Whether to return flat lists of phases rather than lists of
+            (temperature, phases) tuples.
+
+        Returns
+        -------
+        :class:`dict`
+            Appearance sequences indexed by candidate (see
+            :func:`mod.sequence.get_appearance_sequence`).
+        """
+        temperatures, _ = self.predict(records, defaults=defaults)
+        table = temperatures.apply(self._rounded).rename_axis("experiment")
+        table = table.stack().rename("temperature").reset_index()
+        table = table.rename(columns={"level_1": "phaseID"})
+        sequences = get_appearance_sequence(table, flatten=flatten)
+        if len(records.index) == 1:  # single sequences aren't indexed
+            sequences = {records.index[0]: sequences}
+        return {e: sequences.get(e, []) for e in records.index}
+
+    def predict_distance(
+        self, records, target_sequence, defaults={}, quantiles=[0.1, 0.9], **kwargs
+    ):
+        """
+        Predict the distance between the crystallisation sequence of each candidate
+        and a target sequence, and its spread across the members of the model.
+
+        Parameters
+        -----------
+        records : :class:`pandas.DataFrame`
+            Compositions and configuration values for each candidate.
+        target_sequence : :class:`list`
+            Target sequence (see :func:`mod.sequence.rank_experiments`).
+        defaults : :class:`dict`
+            Configuration values for those not given within the records.
+        quantiles : :class:`list`
+            Quantiles of the distance across members to report.
+        kwargs
+            Keyword arguments for :func:`mod.sequence.rank_experiments` (e.g.
+            :code:`ignore_trailing`, :code:`metric`).
+
+        Returns
+        -------
+        :class:`pandas.DataFrame`
+            Distance for the predicted sequence and quantiles of the distance
+            across members, indexed as the records.
+        """
+        T, X = self._members(records, defaults=defaults)
+        temperatures, _ = self.predict(records, defaults=defaults)
+        n, m = X.shape[0], T.shape[0]
+        distances = _distances(
+            self._rounded(np.vstack([temperatures.values, T.reshape(m * n, -1)])),
+            self.phases,
+            target_sequence,
+            **kwargs
+        )
+        table = pd.DataFrame({"distance": distances[:n]}, index=records.index)
+        spread = np.quantile(distances[n:].reshape(m, n), quantiles, axis=0)
+        for q, values in zip(quantiles, spread):
+            table["q{:g}".format(q)] = values
+        return table
+
+    def triage(
+        self,
+        records,
+        target_sequence,
+        threshold,
+        defaults={},
+        quantiles=[0.1, 0.9],
+        **kwargs
+    ):
+        """
+        Triage candidates by their predicted distance to a target sequence, such
+        that only promising or uncertain candidates need to be run.
+
+        Candidates are rejected where even the lower quantile of the distance
+        across members exceeds the threshold, and are promising where the upper
+        quantile is within it; others are uncertain.
+
+        Parameters
+        -----------
+        records : :class:`pandas.DataFrame`
+            Compositions and configuration values for each candidate.
+        target_sequence : :class:`list`
+            Target sequence (see :func:`mod.sequence.rank_experiments`).
+        threshold : :class:`float`
+            Largest distance for a candidate to be of interest.
+        defaults : :class:`dict`
+            Configuration values for those not given within the records.
+        quantiles : :class:`list`
+            Lower and upper quantiles of the distance across members.
+        kwargs
+            Keyword arguments for :func:`mod.sequence.rank_experiments`.
+
+        Returns
+        -------
+        :class:`pandas.DataFrame`
+            Predicted distances (see :meth:`predict_distance`) and the status of
+            each candidate, one of :code:`"reject"`, :code:`"uncertain"` or
+            :code:`"promising"`.
+        """
+        table = self.predict_distance(
+            records, target_sequence, defaults=defaults, quantiles=quantiles, **kwargs
+        )
+        lower, upper = [table["q{:g}".format(q)].values for q in quantiles]
+        status = np.full(table.index.size, "uncertain", dtype=object)
+        status[upper <= threshold] = "promising"
+        status[lower > threshold] = "reject"
+        table["status"] = pd.Categorical(status, categories=STATUSES)
+        return table
+
+
+def cross_validate(
+    emulator,
+    records,
+    temperatures,
+    target_sequence=None,
+    threshold=None,
+    groups=None,
+    folds=5,
+    seed=0,
+    defaults={},
+    quantiles=[0.1, 0.9],
+    **kwargs
+):
+    """
+    Estimate the accuracy of an emulator by cross-validation over experiments.
+
+    Parameters
+    -----------
+    emulator : :class:`SequenceEmulator`
+        Emulator, which is copied and trained for each fold.
+    records : :class:`pandas.DataFrame`
+        Compositions and configuration values for each experiment.
+    temperatures : :class:`pandas.DataFrame`
+        Appearance temperatures for each experiment (see
+        :func:`appearance_temperatures`).
+    target_sequence : :class:`list`
+        Target sequence, for which the accuracy of predicted distances is also
+        reported.
+    threshold : :class:`float`
+        Largest distance for a candidate to be of interest, for which the outcome
+        of triage (see :meth:`SequenceEmulator.triage`) is also reported.
+    groups : :class:`pandas.Series`
+        Groups of experiments to keep within the same fold (e.g. the title of the
+        starting composition), such that accuracy is estimated for compositions
+        the emulator hasn't seen.
+    folds : :class:`int`
+        Number of folds.
+    seed : :class:`int`
+        Random seed for assigning experiments to folds, where not grouped.
+    defaults : :class:`dict`
+        Configuration values for those not given within the records.
+    quantiles : :class:`list`
+        Lower and upper quantiles of the distance across members, for triage.
+    kwargs
+        Keyword arguments for :func:`mod.sequence.rank_experiments`.
+
+    Returns
+    -------
+    :class:`dict`
+        Out-of-fold predictions for each experiment (:code:`"predictions"`), the
+        accuracy for each phase (:code:`"phases"`) and a summary of the accuracy
+        of sequences (:code:`"summary"`).
+    """
+    records = records.loc[records.index.isin(temperatures.index)]
+    temperatures = temperatures.reindex(index=records.index)
+    if groups is not None:
+        groups = pd.Series(groups).reindex(records.index).values
+        splitter = GroupKFold(n_splits=min(folds, len(set(groups))))
+    else:
+        splitter = KFold(n_splits=folds, shuffle=True, random_state=seed)
+    predicted, probabilities, distances = [], [], []
+    for train, test in splitter.split(records, groups=groups):
+        model = SequenceEmulator(
+            resolution=emulator.resolution, model=clone(emulator.model)
+        )
+        model.fit(records.iloc[train], temperatures.iloc[train], defaults=defaults)
+        T, P = model.predict(records.iloc[test], defaults=defaults)
+        predicted.append(T.reindex(columns=temperatures.columns))
+        probabilities.append(P.reindex(columns=temperatures.columns, fill_value=0.0))
+        if target_sequence is not None:
+            distances.append(
+                model.predict_distance(
+                    records.iloc[test],
+                    target_sequence,
+                    defaults=defaults,
+                    quantiles=quantiles,
+                    **kwargs
+                )
+            )
+    predicted = pd.concat(predicted).reindex(index=records.index)
+    probabilities = pd.concat(probabilities).reindex(index=records.index)
+
+    observed = temperatures.notnull()
+    error = predicted - temperatures
+    phases = pd.DataFrame(
+        {
+            "n": observed.sum(axis=0),
+            "accuracy": ((probabilities >= 0.5) == observed).mean(axis=0),
+            "MAE": error.abs().mean(axis=0),
+            "RMSE": np.sqrt((error ** 2).mean(axis=0)),
+        }
+    )
+    predictions = pd.concat(
+        {
+            "observed": temperatures,
+            "predicted": predicted,
+            "probability": probabilities,
+        },
+        axis=1,
+    )
+    summary = {
+        "experiments": records.index.size,
+        "presence accuracy": ((probabilities >= 0.5) == observed).values.mean(),
+        "temperature MAE": np.nanmean(np.abs(error.values)),
+    }
+    if target_sequence is not None:
+        distances = pd.concat(distances).reindex(index=records.index)
+        distances["observed"] = _distances(
+            temperatures.values, list(temperatures.columns), target_sequence, **kwargs
+        )
+        error = distances["distance"] - distances["observed"]
+        summary["distance MAE"] = error.abs().mean()
+        summary["distance exact"] = (error == 0).mean()
+        if threshold is not None:
+            rejected = distances["q{:g}".format(quantiles[0])] > threshold
+            of_interest = distances["observed"] <= threshold
+            summary["rejected"] = rejected.mean()
+            # fraction of experiments of interest which triage would have rejected
+            summary["missed"] = (rejected & of_interest).sum() / max(
+                of_interest.sum(), 1
+            )
+        predictions["distance"] = distances["distance"]
+        predictions["observed distance"] = distances["observed"]
+    logger.debug("Cross-validated over {} experiments.".format(records.index.size))
+    return dict(
+        predictions=predictions, phases=phases, summary=pd.Series(summary, name="value")
+    )
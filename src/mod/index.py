@@ -0,0 +1,162 @@
+"""
+Row index for aggregated phase tables, such that the rows for sets of phases and
+experiments can be extracted repeatedly without building full-length masks.
+"""
+import numpy as np
+import pandas as pd
+
+
+def _ranges(starts, stops):
+    """
+    Concatenate a set of ranges of positions.
+
+    Parameters
+    -----------
+    starts, stops : :class:`numpy.ndarray`
+        Start and stop of each range.
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+    """
+    lengths = stops - starts
+    total = lengths.sum()
+    if not total:
+        return np.empty(0, dtype=np.intp)
+    # offset a single arange by the start of the range each position falls within
+    shift = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return np.arange(total, dtype=np.intp) + shift
+
+
+class PhaseIndex(object):
+    """
+    Index of the rows of a phase table for each (phase, experiment) pair, and for
+    named groups of experiments (e.g. suites), such that selections cost time in
+    proportion to the rows selected rather than the size of the table.
+
+    Rows are ordered by phase and experiment once, with the range of each pair
+    recorded, such that a selection is a concatenation of ranges. Selections keep
+    the order of rows within the table, and are sliced rather than taken where
+    they're contiguous.
+
+    Parameters
+    -----------
+    df : :class:`pandas.DataFrame`
+        Phase table, with :code:`experiment` and :code:`phase` columns.
+    groups : :class:`dict`
+        Lists of experiments for named groups.
+    """
+
+    def __init__(self, df, groups={}):
+        self.df = df
+        experiments, uniques = pd.factorize(df["experiment"])
+        self.experiments = pd.Index(uniques)
+        phases, uniques = pd.factorize(df["phase"])
+        self.phases = pd.Index(uniques)
+        # phase-major order, keeping the order of rows within each pair
+        self._order = np.lexsort((experiments, phases))
+        keys = self._key(phases[self._order], experiments[self._order])
+        boundaries = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+        self._starts = np.r_[0, boundaries] if keys.size else boundaries
+        self._stops = np.r_[boundaries, keys.size] if keys.size else boundaries
+        self._keys = keys[self._starts]
+        self.groups = {}
+        self._cache = {}
+        for name, members in groups.items():
+            self.add_group(name, members)
+
+    def add_group(self, name, experiments):
+        """
+        Add a named group of experiments.
+
+        Parameters
+        -----------
+        name : :class:`str`
+            Name of the group.
+        experiments : :class:`list`
+            Experiments within the group.
+        """
+        self.groups[name] = list(experiments)
+        self._cache = {k: v for k, v in self._cache.items() if k[1] != name}
+
+    def _key(self, phases, experiments):
+        # missing values are coded as -1, so codes are offset to keep keys unique
+        return (phases + 1) * (len(self.experiments) + 1) + experiments + 1
+
+    def _codes(self, index, values):
+        if values is None:
+            return np.arange(len(index))
+        if isinstance(values, str):
+            values = [values]
+        codes = index.get_indexer(list(values))
+        return np.unique(codes[codes >= 0])
+
+    def positions(self, phases=None, experiments=None, group=None):
+        """
+        Get the positions of the rows for a set of phases and experiments.
+
+        Parameters
+        -----------
+        phases : :class:`str` | :class:`list`
+            Phase names (e.g. :code:`"clinopyroxene"`), defaulting to all.
+        experiments : :class:`list`
+            Experiments, defaulting to all.
+        group : :class:`str`
+            Named group of experiments, used in place of a list of experiments.
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            Positions in the order of the table.
+        """
+        if group is not None:
+            key = (None if phases is None else tuple(np.atleast_1d(phases)), group)
+            if key not in self._cache:
+                self._cache[key] = self.positions(phases, self.groups[group])
+            return self._cache[key]
+        if phases is None and experiments is None:
+            return np.arange(self.df.shape[0])
+        p = self._codes(self.phases, phases)
+        e = self._codes(self.experiments, experiments)
+        wanted = self._key(p[:, None], e[None, :]).ravel()
+        found = np.searchsorted(self._keys, wanted)
+        present = found < self._keys.size
+        found, wanted = found[present], wanted[present]
+        found = found[self._keys[found] == wanted]
+        rows = _ranges(self._starts[found], self._stops[found])
+        return np.sort(self._order[rows])
+
+    def take(self, phases=None, experiments=None, group=None, columns=None):
+        """
+        Get the rows for a set of phases and experiments (see :meth:`positions`).
+
+        Parameters
+        -----------
+        phases : :class:`str` | :class:`list`
+            Phase names (e.g. :code:`"clinopyroxene"`), defaulting to all.
+        experiments : :class:`list`
+            Experiments, defaulting to all.
+        group : :class:`str`
+            Named group of experiments, used in place of a list of experiments.
+        columns : :class:`list`
+            Columns to get, defaulting to all.
+
+        Returns
+        -------
+        :class:`pandas.DataFrame`
+
+        Raises
+        ------
+        KeyError
+            Where any of the columns aren't within the table.
+        """
+        rows = self.positions(phases=phases, experiments=experiments, group=group)
+        cols = slice(None)
+        if columns is not None:
+            cols = self.df.columns.get_indexer(pd.Index(columns))
+            if (cols < 0).any():
+                missing = [c for c, ix in zip(columns, cols) if ix < 0]
+                raise KeyError("Columns not in the table: {}".format(missing))
+        if rows.size and rows[-1] - rows[0] == rows.size - 1:
+            return self.df.iloc[rows[0] : rows[-1] + 1, cols]
+        return self.df.iloc[rows, cols]
@@ -0,0 +1,256 @@
+"""
+Scoring of the misfit between modelled mineral compositions and observed mineral
+chemistry, such that large batches of experiments can be screened and ranked
+without plotting them.
+"""
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+from pyrolite.comp.codata import close, ILR
+from pyrolite_meltsutil.util.log import Handle
+from .aggregate import stream_tables
+from .density import KernelDensity
+
+logger = Handle(__name__)
+
+SPACES = ["ilr", "standard", "log"]
+METRICS = ["distance", "loglik"]
+
+
+class MineralReference(object):
+    """
+    Observed compositions of a mineral, transformed to a space in which distances
+    are comparable and indexed once, such that modelled compositions can be scored
+    against them in bulk.
+
+    Compositional components are compared in isometric log-ratio (ILR) space after
+    closure, and other values (e.g. :code:`Mg#`) are standardised by the mean and
+    standard deviation of the observations, optionally after a log transform (e.g.
+    for trace element concentrations). Observations are indexed with a
+    :class:`scipy.spatial.cKDTree` for nearest-neighbour distances, and a kernel
+    density estimate (see :class:`mod.density.KernelDensity`) is built on first
+    use for log-likelihoods.
+
+    Parameters
+    -----------
+    observed : :class:`pandas.DataFrame`
+        Observed compositions.
+    components : :class:`list`
+        Columns to compare.
+    phase : :class:`str`
+        Name of the modelled phase to compare (e.g. :code:`"clinopyroxene"`).
+    space : :class:`str`
+        Space to compare compositions in, one of :code:`"ilr"`, :code:`"standard"`
+        or :code:`"log"`.
+    bw_method : :class:`str` | :class:`float` | :class:`callable`
+        Bandwidth method for the density estimate (see
+        :class:`scipy.stats.gaussian_kde`).
+    """
+
+    def __init__(self, observed, components, phase, space="ilr", bw_method=None):
+        if space not in SPACES:
+            raise ValueError("Unknown space {}, use one of {}".format(space, SPACES))
+        self.components = list(components)
+        self.phase = phase
+        self.space = space
+        self.bw_method = bw_method
+        arr = self._values(observed)
+        if space != "ilr":
+            self._loc, self._scale = 0.0, 1.0
+            values = self.transform(arr)
+            self._loc = np.nanmean(values, axis=0)
+            self._scale = np.nanstd(values, axis=0)
+        X = self.transform(arr)
+        self.data = X[np.isfinite(X).all(axis=1)]
+        if self.data.shape[0] <= self.data.shape[1]:
+            raise ValueError(
+                "Too few observations of {} to score against.".format(phase)
+            )
+        self.tree = cKDTree(self.data)
+        self._kde = None
+
+    def _values(self, df):
+        return df[self.components].apply(pd.to_numeric, errors="coerce").values
+
+    def transform(self, arr):
+        """
+        Transform compositions to the space they're compared in.
+
+        Parameters
+        -----------
+        arr : :class:`numpy.ndarray`
+            Compositions, with columns for each component.
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            Transformed compositions, with non-finite rows for those which can't be
+            transformed.
+        """
+        arr = np.array(arr, dtype=float)
+        if self.space == "log":
+            with np.errstate(divide="ignore", invalid="ignore"):
+                arr = np.where(arr > 0, np.log10(arr), np.nan)
+        if self.space != "ilr":
+            return (arr - self._loc) / self._scale
+        valid = (arr > 0).all(axis=1) & np.isfinite(arr).all(axis=1)
+        X = np.full((arr.shape[0], arr.shape[1] - 1), np.nan)
+        if valid.any():
+            X[valid] = ILR(close(arr[valid]))
+        return X
+
+    @property
+    def kde(self):
+        """
+        Kernel density estimate for the observations.
+        """
+        if self._kde is None:
+            self._kde = KernelDensity(self.data, bw_method=self.bw_method)
+        return self._kde
+
+    def score(self, df, metrics=METRICS):
+        """
+        Score modelled compositions against the observations.
+
+        Parameters
+        -----------
+        df : :class:`pandas.DataFrame`
+            Modelled compositions.
+        metrics : :class:`list`
+            Metrics to calculate; the distance to the nearest observation
+            (:code:`"distance"`) and the log-likelihood under the density estimate
+            (:code:`"loglik"`).
+
+        Returns
+        -------
+        :class:`dict`
+            Arrays of each metric, being non-finite where compositions can't be
+            scored.
+        """
+        X = self.transform(self._values(df))
+        valid = np.isfinite(X).all(axis=1)
+        scores = {}
+        for metric in metrics:
+            values = np.full(X.shape[0], np.nan)
+            if valid.any():
+                if metric == "distance":
+                    values[valid] = self.tree.query(X[valid], k=1, workers=-1)[0]
+                elif metric == "loglik":
+                    values[valid] = self.kde.logpdf(X[valid])
+                else:
+                    raise ValueError(
+                        "Unknown metric {}, use one of {}".format(metric, METRICS)
+                    )
+            scores[metric] = values
+        return scores
+
+
+def score_phases(phases, references, metrics=METRICS):
+    """
+    Score the modelled trajectory of each phase within each experiment against
+    observed mineral chemistry.
+
+    Parameters
+    -----------
+    phases : :class:`pandas.DataFrame`
+        Phase table, with :code:`experiment` and :code:`phase` columns.
+    references : :class:`list`
+        References for each mineral (see :class:`MineralReference`).
+    metrics : :class:`list`
+        Metrics to calculate (see :meth:`MineralReference.score`).
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+        Number of compositions scored and the mean of each metric along the
+        trajectory, indexed by experiment and phase.
+    """
+    tables = []
+    for reference in references:
+        subset = phases.loc[phases["phase"].values == reference.phase]
+        if subset.empty:
+            continue
+        scores = pd.DataFrame(
+            reference.score(subset, metrics=metrics), index=subset.index
+        )
+        scores["n"] = np.isfinite(scores[metrics[0]].values).astype(int)
+        scores["experiment"] = subset["experiment"].values
+        scores["phase"] = reference.phase
+        table = scores.groupby(
+            ["experiment", "phase"], sort=False, observed=True
+        ).agg({"n": "sum", **{m: "mean" for m in metrics}})
+        tables.append(table.loc[table["n"] > 0])
+    if not tables:
+        index = pd.MultiIndex.from_tuples([], names=["experiment", "phase"])
+        return pd.DataFrame(columns=["n"] + list(metrics), index=index)
+    return pd.concat(tables)
+
+
+def score_folders(folders, references, metrics=METRICS, processes=None):
+    """
+    Score a set of experiment folders against observed mineral chemistry, parsing
+    them in chunks such that large studies needn't be aggregated first.
+
+    Parameters
+    -----------
+    folders : :class:`list`
+        Experiment folders.
+    references : :class:`list`
+        References for each mineral (see :class:`MineralReference`).
+    metrics : :class:`list`
+        Metrics to calculate (see :meth:`MineralReference.score`).
+    processes : :class:`int`
+        Number of worker processes to parse the experiment folders with.
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+        Scores for each experiment and phase (see :func:`score_phases`).
+    """
+    tables = [
+        score_phases(phases, references, metrics=metrics)
+        for _, phases in stream_tables(folders, processes=processes)
+    ]
+    if not tables:
+        return score_phases(pd.DataFrame(columns=["experiment", "phase"]), [])
+    return pd.concat(tables)
+
+
+def rank_misfit(scores, metric="distance", phases=None):
+    """
+    Rank experiments by their misfit to observed mineral chemistry across phases.
+
+    Experiments are ranked within each phase by the chosen metric, and ranked
+    overall by the mean of their percentile ranks across phases, such that metrics
+    in different units (e.g. ILR distances and standardised values) are weighted
+    equally. Experiments in which an observed phase doesn't crystallise are given
+    the worst rank for that phase.
+
+    Parameters
+    -----------
+    scores : :class:`pandas.DataFrame`
+        Scores for each experiment and phase (see :func:`score_phases`).
+    metric : :class:`str`
+        Metric to rank by, one of :code:`"distance"` or :code:`"loglik"`.
+    phases : :class:`list`
+        Phases to rank by, defaulting to all those scored.
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+        Metric for each phase, the number of phases which are missing, the overall
+        score (between zero and one, lower being a better fit) and rank, indexed by
+        experiment and sorted by rank.
+    """
+    table = scores[metric].unstack("phase")
+    if phases is not None:
+        table = table.reindex(columns=phases)
+    # misfit increases with distance and decreases with likelihood
+    ascending = metric != "loglik"
+    percentiles = table.rank(ascending=ascending, pct=True).fillna(1.0)
+    table["missing"] = table.isnull().sum(axis=1)
+    table["score"] = percentiles.mean(axis=1)
+    table = table.sort_values(["score", "missing"], kind="mergesort")
+    table["rank"] = np.arange(1, table.shape[0] + 1)
+    table.columns.name = None
+    return table
@@ -0,0 +1,393 @@
+"""
+Reproducible sampling of compositions for uncertainty studies, where replicates
+are drawn in isometric log-ratio (ILR) space and streamed in chunks.
+"""
+import warnings
+import numpy as np
+import pandas as pd
+import scipy.stats
+from scipy.stats import qmc
+from pyrolite.comp.codata import ILR, inverse_ILR, helmert_basis
+from pyrolite.geochem.ind import common_oxides
+
+
+METHODS = ["normal", "sobol", "lhs"]
+
+
+class CompositionSampler(object):
+    """
+    Sampler for replicates of a composition with multivariate normal noise in ILR
+    space, optionally jointly with choices for configuration axes (e.g. those of a
+    :code:`config_grid`).
+
+    Replicates are drawn in fixed-size blocks, each from a
+    :class:`numpy.random.Generator` seeded from the sampler seed and the block
+    number, such that any replicate can be regenerated from the seed and its index
+    alone, independent of how replicates are chunked. Quasi-Monte Carlo designs
+    (:code:`method="sobol"` or :code:`method="lhs"`) instead spread replicates
+    evenly across the joint space of ILR coordinates and axes, such that the spread
+    of outcomes is resolved with fewer experiments; Sobol points are taken from a
+    scrambled sequence seeded by the sampler seed, and Latin hypercube designs are
+    determined by the seed and the size of the study.
+
+    Parameters
+    -----------
+    composition : :class:`pandas.Series`
+        Composition to sample around, which may include non-compositional values
+        (e.g. :code:`Title`) which are copied to each replicate.
+    uncertainties : :class:`pandas.Series` | :class:`dict`
+        Standard deviations for each component, in the units of the composition.
+        These are propagated to ILR space to first order; note that closure of the
+        sampled compositions reduces the spread of major components.
+    covariance : :class:`numpy.ndarray`
+        Covariance matrix in ILR space, of shape :code:`(D-1, D-1)`.
+    noise : :class:`float`
+        Standard deviation of isotropic noise in ILR space, used where neither
+        uncertainties nor a covariance are given.
+    components : :class:`list`
+        Components to sample, defaulting to the positive oxides within the
+        composition.
+    seed : :class:`int`
+        Seed for the sampler.
+    scale : :class:`float`
+        Total to close sampled compositions to.
+    blocksize : :class:`int`
+        Number of replicates drawn from each generator.
+    method : :class:`str`
+        Sampling method, one of :code:`"normal"` (pseudo-random), :code:`"sobol"`
+        or :code:`"lhs"` (Latin hypercube).
+    axes : :class:`dict`
+        Configuration axes to sample jointly with compositions, as a dictionary of
+        lists of choices (as for a :code:`config_grid`, but with explicit values
+        rather than :code:`None`). Each replicate is assigned one choice for each
+        axis, recorded as a column such that it overrides the batch configuration.
+    size : :class:`int`
+        Number of replicates in the study, required for Latin hypercube designs.
+    """
+
+    def __init__(
+        self,
+        composition,
+        uncertainties=None,
+        covariance=None,
+        noise=0.02,
+        components=None,
+        seed=0,
+        scale=100,
+        blocksize=1024,
+        method="normal",
+        axes={},
+        size=None,
+    ):
+        if method not in METHODS:
+            raise ValueError("Unknown method {}, use one of {}".format(method, METHODS))
+        if method == "lhs" and size is None:
+            raise ValueError("The size of the study is needed for a Latin hypercube.")
+        self.method = method
+        self.axes = {k: list(v) for k, v in axes.items()}
+        self.size = size
+        self.composition = pd.Series(composition)
+        if components is None:
+            oxides = set(common_oxides())
+            values = pd.to_numeric(self.composition, errors="coerce")
+            components = [
+                c for c in self.composition.index if c in oxides and values[c] > 0
+            ]
+        # components set by an axis aren't sampled
+        modified = set().union(
+            *[
+                choice.keys()
+                for choices in self.axes.values()
+                for choice in choices
+                if isinstance(choice, dict)
+            ]
+        )
+        self.components = [c for c in components if c not in modified]
+        self.seed = seed
+        self.scale = scale
+        self.blocksize = blocksize
+        x = self.composition[self.components].values.astype(float)[None, :]
+        self.mean = ILR(x)[0]
+        D = len(self.components)
+        if covariance is None:
+            if uncertainties is not None:
+                # relative uncertainties map to CLR space, then onto the ILR basis
+                rel = (
+                    pd.Series(uncertainties)
+                    .reindex(self.components)
+                    .fillna(0)
+                    .values.astype(float)
+                    / x[0]
+                )
+                psi = helmert_basis(D=D)
+                covariance = psi @ np.diag(rel ** 2) @ psi.T
+            else:
+                covariance = np.eye(D - 1) * noise ** 2
+        self.covariance = np.asarray(covariance, dtype=float)
+        # use an eigendecomposition, such that singular covariances are supported
+        w, v = np.linalg.eigh(self.covariance)
+        self._transform = v * np.sqrt(np.clip(w, 0, None))
+        self._strata = None
+
+    @property
+    def dimension(self):
+        """
+        Number of dimensions sampled, being the ILR coordinates and the axes.
+        """
+        return self.mean.size + len(self.axes)
+
+    def _deviates(self, block):
+        """
+        Draw the pseudo-random deviates for a block of replicates, being standard
+        normal deviates for the ILR coordinates and uniform deviates for the axes.
+
+        Parameters
+        -----------
+        block : :class:`int`
+            Block number.
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            Array of shape :code:`(blocksize, dimension)`.
+        """
+        seq = np.random.SeedSequence(self.seed, spawn_key=(block,))
+        rng = np.random.default_rng(seq)
+        Z = rng.standard_normal((self.blocksize, self.mean.size))
+        if not self.axes:
+            return Z
+        return np.hstack([Z, rng.random((self.blocksize, len(self.axes)))])
+
+    def _blocks(self, start, stop):
+        """
+        Get the pseudo-random deviates for a range of replicates.
+
+        Parameters
+        -----------
+        start, stop : :class:`int`
+            Range of replicate indexes.
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            Array of shape :code:`(stop - start, dimension)`.
+        """
+        first, last = start // self.blocksize, (stop - 1) // self.blocksize
+        Z = np.vstack([self._deviates(b) for b in range(first, last + 1)])
+        offset = start - first * self.blocksize
+        return Z[offset : offset + (stop - start)]
+
+    def _uniform(self, start, stop):
+        """
+        Get the quasi-Monte Carlo design points for a range of replicates, on the
+        unit hypercube.
+
+        Parameters
+        -----------
+        start, stop : :class:`int`
+            Range of replicate indexes.
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            Array of shape :code:`(stop - start, dimension)`.
+        """
+        if self.method == "sobol":
+            engine = qmc.Sobol(self.dimension, scramble=True, seed=self.seed)
+            if start:
+                engine.fast_forward(start)
+            with warnings.catch_warnings():  # balance isn't needed for each chunk
+                warnings.simplefilter("ignore")
+                return engine.random(stop - start)
+        # latin hypercube; each replicate is jittered within its stratum
+        if stop > self.size:
+            raise IndexError("Replicates beyond the size of the study.")
+        if self._strata is None:
+            rng = np.random.default_rng(np.random.SeedSequence(self.seed))
+            self._strata = np.stack(
+                [rng.permutation(self.size) for _ in range(self.dimension)], axis=1
+            )
+        first, last = start // self.blocksize, (stop - 1) // self.blocksize
+        jitter = np.vstack(
+            [
+                np.random.default_rng(
+                    np.random.SeedSequence(self.seed, spawn_key=(b,))
+                ).random((self.blocksize, self.dimension))
+                for b in range(first, last + 1)
+            ]
+        )
+        offset = start - first * self.blocksize
+        jitter = jitter[offset : offset + (stop - start)]
+        return (self._strata[start:stop] + jitter) / self.size
+
+    def _design(self, start, stop):
+        """
+        Get standard normal deviates for the ILR coordinates and uniform deviates
+        for the axes for a range of replicates.
+
+        Parameters
+        -----------
+        start, stop : :class:`int`
+            Range of replicate indexes.
+
+        Returns
+        -------
+        :class:`tuple`
+            Arrays of shape :code:`(stop - start, D-1)` and
+            :code:`(stop - start, len(axes))`.
+        """
+        D = self.mean.size
+        if self.method == "normal":
+            X = self._blocks(start, stop)
+            return X[:, :D], X[:, D:]
+        U = np.clip(self._uniform(start, stop), 1e-12, 1 - 1e-12)
+        return scipy.stats.norm.ppf(U[:, :D]), U[:, D:]
+
+    def _sample(self, start, stop):
+        """
+        Get the sampled compositions and uniform deviates for the axes for a range
+        of replicates.
+
+        Parameters
+        -----------
+        start, stop : :class:`int`
+            Range of replicate indexes.
+
+        Returns
+        -------
+        :class:`tuple`
+            Arrays of shape :code:`(stop - start, D)` and
+            :code:`(stop - start, len(axes))`.
+
+        Notes
+        -----
+        Compositions are transformed a whole block at a time and then sliced, as
+        matrix products can differ in the last bit for arrays of different shapes.
+        Replicates are hence identical however a study is chunked, and so are the
+        hashes of their experiment configurations.
+        """
+        first, last = start // self.blocksize, (stop - 1) // self.blocksize
+        X, U = [], []
+        for b in range(first, last + 1):
+            lo, hi = b * self.blocksize, (b + 1) * self.blocksize
+            if self.method == "lhs":
+                hi = min(hi, self.size)
+            Z, u = self._design(lo, hi)
+            X.append(inverse_ILR(self.mean + Z @ self._transform.T) * self.scale)
+            U.append(u)
+        offset = start - first * self.blocksize
+        X, U = np.vstack(X), np.vstack(U)
+        return X[offset : offset + (stop - start)], U[offset : offset + (stop - start)]
+
+    def sample(self, start, stop):
+        """
+        Generate a range of replicates.
+
+        Parameters
+        -----------
+        start, stop : :class:`int`
+            Range of replicate indexes.
+
+        Returns
+        -------
+        :class:`pandas.DataFrame`
+            Replicates, indexed by replicate number, with the replicate number and
+            sampler seed recorded such that they're included in experiment
+            configurations.
+        """
+        index = pd.RangeIndex(start, stop)
+        df = pd.DataFrame(
+            np.repeat(self.composition.values[None, :], index.size, axis=0),
+            columns=self.composition.index,
+            index=index,
+        )
+        if stop > start:
+            X, U = self._sample(start, stop)
+            df[self.components] = X
+            for ix, (axis, choices) in enumerate(self.axes.items()):
+                picks = np.minimum(U[:, ix] * len(choices), len(choices) - 1)
+                df[axis] = [choices[p] for p in picks.astype(int)]
+        df[self.components] = df[self.components].astype(float)
+        df["Replicate"], df["Seed"] = index, self.seed
+        return df.infer_objects()
+
+    def replicate(self, index):
+        """
+        Regenerate a single replicate.
+
+        Parameters
+        -----------
+        index : :class:`int`
+            Replicate index.
+
+        Returns
+        -------
+        :class:`pandas.Series`
+        """
+        return self.sample(index, index + 1).iloc[0]
+
+    def chunks(self, n, chunksize=1000, start=0):
+        """
+        Generate replicates lazily in chunks.
+
+        Parameters
+        -----------
+        n : :class:`int`
+            Number of replicates.
+        chunksize : :class:`int`
+            Number of replicates per chunk.
+        start : :class:`int`
+            Index of the first replicate, such that a study can be extended.
+
+        Yields
+        -------
+        :class:`pandas.DataFrame`
+            Chunks of replicates (see :meth:`sample`).
+        """
+        for lo in range(start, start + n, chunksize):
+            yield self.sample(lo, min(lo + chunksize, start + n))
+
+
+def convergence_report(
+    distances, order=None, checkpoints=None, quantiles=[0.1, 0.25, 0.5, 0.75, 0.9]
+):
+    """
+    Report how the distribution of sequence distances (see
+    :func:`mod.sequence.rank_experiments`) stabilises as the number of sampled
+    experiments grows.
+
+    Parameters
+    -----------
+    distances : :class:`pandas.Series` | :class:`numpy.ndarray`
+        Distances for each experiment.
+    order : :class:`numpy.ndarray`
+        Order in which experiments were sampled (e.g. replicate indexes), such that
+        the report reflects stopping a study early. Defaults to the order given.
+    checkpoints : :class:`list`
+        Sample counts to report at, defaulting to powers of two.
+    quantiles : :class:`list`
+        Quantiles of the distance distribution to report.
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+        Mean, quantiles and Kolmogorov-Smirnov statistic relative to the full set of
+        distances at each checkpoint, indexed by sample count.
+    """
+    distances = np.asarray(distances, dtype=float)
+    if order is not None:
+        distances = distances[np.argsort(np.asarray(order), kind="mergesort")]
+    n = distances.size
+    if checkpoints is None:
+        checkpoints = [2 ** i for i in range(1, int(np.log2(max(n, 1))) + 1)]
+        if not checkpoints or checkpoints[-1] != n:
+            checkpoints.append(n)
+    rows = []
+    for k in checkpoints:
+        sample = distances[:k]
+        row = {"n": k, "mean": sample.mean()}
+        values = np.quantile(sample, quantiles)
+        row.update({"q{:g}".format(q): v for q, v in zip(quantiles, values)})
+        row["KS"] = scipy.stats.ks_2samp(sample, distances).statistic
+        rows.append(row)
+    return pd.DataFrame(rows).set_index("n")
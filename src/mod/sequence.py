@@ -1,8 +1,109 @@
 import pandas as pd
 import numpy as np
-from collections import defaultdict
-from pyrolite_meltsutil.util.tables import phasename
-from pyrolite.util.spatial import levenshtein_distance
+
+METRICS = ["levenshtein", "set"]
+
+
+def phasename(phaseID):
+    """
+    Get the name of a phase from its ID (e.g. :code:`clinopyroxene_0`), as for
+    :func:`pyrolite_meltsutil.util.tables.phasename`; this is defined here such that
+    sequences can be ranked without importing pyrolite (see :mod:`mod.cli`).
+
+    Parameters
+    -----------
+    phaseID : :class:`str`
+        Phase ID.
+
+    Returns
+    -------
+    :class:`str`
+    """
+    ix = phaseID.find("_")
+    return phaseID[:ix] if ix > 0 else phaseID
+
+
+
+def appearance_table(
+    phases,
+    ignore=["bulk", "cumulate", "solid"],
+    mode="descending",
+    variable="temperature",
+):
+    """
+    Get the first and last appearances of each phase within each experiment of a
+    phase table, computed in a single grouped pass over the dataframe.
+
+    Parameters
+    -----------
+    phases : :class:`pandas.DataFrame`
+        Phase table, optionally containing multiple experiments.
+    ignore : :class:`list`
+        Phases to ignore.
+    mode : :class:`str`
+        Ascending or descending.
+    variable : :class:`str`
+        Index varialbe. Typically temperature for melting or crystallisation
+        experiements.
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+        Table of first and last appearances with one row per (experiment, phaseID)
+        pair, ordered by experiment and then by order of appearance.
+    """
+    keys = ["experiment", "phaseID"] if "experiment" in phases.columns else ["phaseID"]
+    valid = phases.phaseID.notnull() & ~phases.phaseID.isin(ignore)
+    grp = phases.loc[valid, keys + [variable]].groupby(keys, sort=False, observed=True)
+    table = grp[variable].agg(["max", "min"]).dropna().reset_index()
+    if mode == "descending":
+        table = table.rename(columns={"max": "first", "min": "last"})
+        order = -np.trunc(table["first"].values)
+    else:
+        table = table.rename(columns={"min": "first", "max": "last"})
+        order = np.trunc(table["first"].values)
+    if "experiment" in keys:
+        # keep experiments in order of occurrence, ties in order of occurrence
+        expcodes = pd.factorize(table["experiment"])[0]
+        table = table.iloc[np.lexsort((np.arange(table.index.size), order, expcodes))]
+    else:
+        table = table.iloc[np.argsort(order, kind="stable")]
+    return table.reindex(columns=keys + ["first", "last"]).reset_index(drop=True)
+
+
+def sequences_from_table(table, flatten=False):
+    """
+    Convert an appearance table (see :func:`appearance_table`) to appearance
+    sequences, grouping phases which appear at the same (integer) value.
+
+    Parameters
+    -----------
+    table : :class:`pandas.DataFrame`
+        Appearance table.
+    flatten : :class:`bool`
+        Whether to return flat lists of phases rather than lists of
+        (value, phases) tuples.
+
+    Returns
+    -------
+    :class:`dict`
+        Appearance sequences indexed by experiment (or :code:`None` where the table
+        has no experiment column).
+    """
+    if "experiment" in table.columns:
+        experiments = table["experiment"].values
+    else:
+        experiments = [None] * table.index.size
+    sequences = {}
+    for e, p, value in zip(experiments, table["phaseID"].values, table["first"].values):
+        seq = sequences.setdefault(e, [])
+        if flatten:
+            seq.append(p)
+        elif seq and seq[-1][0] == int(value):
+            seq[-1][1].append(p)
+        else:
+            seq.append((int(value), [p]))
+    return sequences
 
 
 def get_appearance_sequence(
@@ -13,41 +114,42 @@ def get_appearance_sequence(
     flatten=False,
 ):
     """
+    Get the sequence in which phases appear within one or more experiments.
+
+    Parameters
+    -----------
+    phases : :class:`pandas.DataFrame`
+        Phase table, optionally containing multiple experiments.
+    ignore : :class:`list`
+        Phases to ignore.
+    mode : :class:`str`
+        Ascending or descending.
+    variable : :class:`str`
+        Index varialbe. Typically temperature for melting or crystallisation
+        experiements.
+    flatten : :class:`bool`
+        Whether to return a flat list of phases rather than a list of
+        (value, phases) tuples.
 
+    Returns
+    -------
+    :class:`list` | :class:`dict`
+        Appearance sequence, or for multi-experiment dataframes a dictionary of
+        sequences indexed by experiment.
+
+    Notes
+    -----
     Could use a masking approach as below to get multiple-appearances of phases
     for weird PT paths.
     """
+    table = appearance_table(phases, ignore=ignore, mode=mode, variable=variable)
+    sequences = sequences_from_table(table, flatten=flatten)
     if "experiment" in phases.columns:
-        if len(phases.experiment.unique()) > 1:
+        experiments = phases.experiment.unique()
+        if len(experiments) > 1:
             # multi-experiment dataframe, return dictionary indexed by experiment
-            return {
-                e: get_appearance_sequence(
-                    phases.loc[phases.experiment == e],
-                    ignore=ignore,
-                    mode=mode,
-                    variable=variable,
-                )
-                for e in phases.experiment.unique()
-            }
-    _phaseIDs = phases.phaseID.unique()
-    sequence = defaultdict(list)
-    if mode == "descending":
-        reverse = True
-        first_appearance = lambda phs: phases.loc[phases.phaseID == p, variable].max()
-    else:
-        reverse = False
-        first_appearance = lambda phs: phases.loc[phases.phaseID == p, variable].min()
-
-    for p in _phaseIDs:
-        if p not in ignore and not pd.isnull(p):
-            sequence[int(first_appearance(p))].append(p)
-    appearances = sorted(
-        [(k, v) for (k, v) in sequence.items()], key=lambda x: x[0], reverse=reverse,
-    )
-    if not flatten:
-        return appearances
-    else:
-        return [p for (value, phs) in appearances for p in phs]
+            return {e: sequences.get(e, []) for e in experiments}
+    return next(iter(sequences.values()), [])
 
 
 def get_assemblage_sequence(
@@ -55,41 +157,97 @@ def get_assemblage_sequence(
     ignore=["bulk", "cumulate", "solid"],
     mode="descending",
     variable="temperature",
+    phaseIDs=None,
 ):
     """
     Get change points for assemblages, indexed by a specific variable.
+
+    Parameters
+    -----------
+    phases : :class:`pandas.DataFrame`
+        Phase table, optionally containing multiple experiments.
+    ignore : :class:`list`
+        Phases to ignore.
+    mode : :class:`str`
+        Ascending or descending.
+    variable : :class:`str`
+        Index varialbe. Typically temperature for melting or crystallisation
+        experiements.
+    phaseIDs : :class:`list`
+        Phase IDs to use for the assemblage bits, allowing assemblages to be compared
+        across calls. Defaults to the phase IDs in order of occurrence.
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+        Table of assemblages with start and end values for each, where each
+        assemblage is encoded as an integer bitmask with bit :code:`i` corresponding
+        to :code:`phaseIDs[i]`. The list of phase IDs is kept in the table attributes
+        (:code:`table.attrs["phaseIDs"]`); see :func:`decode_assemblage`.
     """
-    if "experiment" in phases.columns:
-        if len(phases.experiment.unique()) > 1:
-            # multi-experiment dataframe, return dictionary indexed by experiment
-            return {
-                e: get_assemblage_sequence(
-                    phases.loc[phases.experiment == e],
-                    ignore=ignore,
-                    mode=mode,
-                    variable=variable,
-                )
-                for e in phases.experiment.unique()
-            }
+    phases = phases.loc[phases[variable].notnull(), :]
+    valid = (phases.phaseID.notnull() & ~phases.phaseID.isin(ignore)).values
+    if phaseIDs is None:
+        phaseIDs = pd.unique(phases.phaseID.values[valid])
+    phaseIDs = list(phaseIDs)
+    if len(phaseIDs) > 63:
+        raise ValueError("Assemblage bitmasks are limited to 63 phases.")
+    codes = pd.Index(phaseIDs).get_indexer(phases.phaseID.values)
+    bits = np.where(valid & (codes >= 0), np.left_shift(1, np.maximum(codes, 0)), 0)
 
-    phase_seq = get_appearance_sequence(
-        phases, flatten=True, ignore=ignore, mode=mode, variable=variable
+    if "experiment" in phases.columns:
+        expcodes, expnames = pd.factorize(phases.experiment.values)
+    else:
+        expcodes, expnames = np.zeros(phases.index.size, dtype=int), [None]
+    values = phases[variable].values
+    order = np.lexsort((-values if mode == "descending" else values, expcodes))
+    expcodes, values, bits = expcodes[order], values[order], bits[order]
+    # combine the phases present at each step with a bitwise or
+    steps = np.flatnonzero(
+        np.r_[True, (expcodes[1:] != expcodes[:-1]) | (values[1:] != values[:-1])]
+    )
+    expcodes, values = expcodes[steps], values[steps]
+    assemblages = np.bitwise_or.reduceat(bits.astype(np.int64), steps)
+    # change points are where the experiment or the assemblage changes
+    changes = np.flatnonzero(
+        np.r_[
+            True,
+            (expcodes[1:] != expcodes[:-1]) | (assemblages[1:] != assemblages[:-1]),
+        ]
+    )
+    ends = np.r_[changes[1:], expcodes.size] - 1
+    table = pd.DataFrame(
+        {
+            "experiment": np.asarray(expnames, dtype=object)[expcodes[changes]],
+            "start": values[changes],
+            "end": values[ends],
+            "assemblage": assemblages[changes],
+        }
     )
+    if "experiment" not in phases.columns:
+        table = table.drop(columns="experiment")
+    table.attrs["phaseIDs"] = phaseIDs
+    return table
 
-    mask = pd.DataFrame(index=phases.index.unique(), columns=phase_seq, dtype=bool)
-    mask.loc[:, :] = False
 
-    for p in mask.columns:
-        subdf = phases.loc[phases.phaseID == p, :]
-        mask[p] = ~pd.isnull(subdf.reindex(index=mask.index)["phase"])
+def decode_assemblage(assemblage, phaseIDs):
+    """
+    Decode an assemblage bitmask (see :func:`get_assemblage_sequence`) to a list of
+    phase IDs.
 
-    assemblage_sequence = mask @ np.array(mask.columns)
+    Parameters
+    -----------
+    assemblage : :class:`int`
+        Assemblage bitmask.
+    phaseIDs : :class:`list`
+        Phase IDs corresponding to the assemblage bits.
 
-    change_indexes = pd.Series(index=assemblage_sequence.index, dtype=bool)
-    change_indexes[1:] = ~(
-        assemblage_sequence[1:].values == assemblage_sequence[:-1].values
-    )
-    return assemblage_sequence, change_indexes
+    Returns
+    -------
+    :class:`list`
+        Phase IDs present in the assemblage.
+    """
+    return [p for ix, p in enumerate(phaseIDs) if (int(assemblage) >> ix) & 1]
 
 
 def sequence_distance(
@@ -100,6 +258,7 @@ def sequence_distance(
     ignore=["bulk", "cumulate", "solid"],
     mode="descending",
     variable="temperature",
+    metric="levenshtein",
 ):
     """
     Compute a distance between two sequences.
@@ -110,6 +269,8 @@ def sequence_distance(
         Experiment DataFrame to extract first sequence from.
     B : :class:`list` | :class:`pandas.DataFrame`
         List of minerals or second experiment DataFrame to extract sequence from.
+        For the set metric, items of the list can also be lists of minerals
+        which appear together.
     phasenames : :class:`bool`
         Whether to compare phase names rather than phase IDs (e.g. clinopyroxene_0).
     ignore_trailing : :class:`bool`
@@ -122,12 +283,55 @@ def sequence_distance(
     variable : :class:`str`
         Index varialbe. Typically temperature for melting or crystallisation
         experiements.
+    metric : :class:`str`
+        Either :code:`"levenshtein"` to compare flattened sequences, or :code:`"set"`
+        to compare sequences of the sets of phases which appear at each step (see
+        :func:`_set_substitution`).
 
     Returns
     -------
-    :class:`int`
+    :class:`int` | :class:`float`
         Distance between two sequences.
     """
+    if metric not in METRICS:
+        raise ValueError("Unknown metric {}, use one of {}".format(metric, METRICS))
+    if metric == "set":
+        seq_A = [
+            set(phs)
+            for (value, phs) in get_appearance_sequence(
+                A, ignore=ignore, mode=mode, variable=variable
+            )
+        ]
+        if isinstance(B, list):
+            seq_B = [{b} if isinstance(b, str) else set(b) for b in B]
+        elif isinstance(B, pd.DataFrame):
+            seq_B = [
+                set(phs)
+                for (value, phs) in get_appearance_sequence(
+                    B, ignore=ignore, mode=mode, variable=variable
+                )
+            ]
+        else:
+            raise TypeError("B should be a list of phases or an experiment table.")
+        if phasenames:
+            seq_A = [{phasename(a) for a in phs} for phs in seq_A]
+            seq_B = [{phasename(b) for b in phs} for phs in seq_B]
+        vocabulary = set().union(*seq_A, *seq_B)
+        if len(vocabulary) > 63:
+            raise ValueError("Set distances are limited to 63 distinct phases.")
+        lookup = {p: ix for ix, p in enumerate(vocabulary)}
+        encoded_A, encoded_B = [
+            np.array([_encode_set(phs, lookup) for phs in seq], dtype=np.int64)
+            for seq in [seq_A, seq_B]
+        ]
+        distance = _edit_distances(
+            encoded_A.reshape(1, -1),
+            np.array([len(seq_A)]),
+            encoded_B,
+            ignore_trailing=ignore_trailing,
+            substitution=_set_substitution,
+        )[0]
+        return seq_A, seq_B, distance
 
     seq_A = get_appearance_sequence(
         A, ignore=ignore, mode=mode, variable=variable, flatten=True
@@ -139,14 +343,223 @@ def sequence_distance(
             B, ignore=ignore, mode=mode, variable=variable, flatten=True
         )
     else:
-        raise NotImplementedError
+        raise TypeError("B should be a list of phases or an experiment table.")
 
     if phasenames:
         seq_A = [phasename(a) for a in seq_A]
         seq_B = [phasename(b) for b in seq_B]
 
+    from pyrolite.util.spatial import levenshtein_distance
+
     if ignore_trailing:
         min_len = min(len(seq_A), len(seq_B))
         return seq_A, seq_B, levenshtein_distance(seq_A[:min_len], seq_B[:min_len])
     else:
         return seq_A, seq_B, levenshtein_distance(seq_A, seq_B)
+
+
+def _popcount(x):
+    """
+    Count the set bits of each element of an integer array.
+
+    Parameters
+    -----------
+    x : :class:`numpy.ndarray`
+        Integer array.
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        Number of set bits for each element.
+    """
+    x = np.ascontiguousarray(x, dtype=np.int64)
+    table = np.array([bin(i).count("1") for i in range(256)], dtype=np.int64)
+    return table[x.view(np.uint8).reshape(x.shape + (8,))].sum(axis=-1)
+
+
+def _encode_set(phases, lookup):
+    """
+    Encode a set of phases as an integer bitmask.
+
+    Parameters
+    -----------
+    phases : :class:`set`
+        Set of phases to encode.
+    lookup : :class:`dict`
+        Bit index for each phase.
+
+    Returns
+    -------
+    :class:`int`
+    """
+    return sum(1 << lookup[p] for p in set(phases))
+
+
+def _set_substitution(a, b):
+    """
+    Cost of substituting one set of phases for another, taken as the Jaccard
+    distance between the sets (0 for identical sets, 1 for disjoint sets).
+
+    Parameters
+    -----------
+    a, b : :class:`numpy.ndarray`
+        Arrays of bitmask-encoded sets.
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        Substitution costs.
+    """
+    return 1.0 - _popcount(a & b) / np.maximum(_popcount(a | b), 1)
+
+
+def _edit_distances(
+    sequences, lengths, target, ignore_trailing=False, substitution=None
+):
+    """
+    Compute Levenshtein distances between a set of integer-coded sequences and a
+    target sequence, with the dynamic programming recurrence vectorized across
+    sequences.
+
+    Parameters
+    -----------
+    sequences : :class:`numpy.ndarray`
+        Array of shape (n, l) of integer codes, padded beyond the sequence lengths.
+    lengths : :class:`numpy.ndarray`
+        Length of each of the n sequences.
+    target : :class:`numpy.ndarray`
+        Integer-coded target sequence.
+    ignore_trailing : :class:`bool`
+        Whether to clip sequences to the minimum length (i.e. compare only the first
+        few items).
+    substitution : :class:`callable`
+        Function returning the cost of substituting one array of codes for another.
+        Defaults to a cost of one for any differing items.
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        Distance between each sequence and the target.
+    """
+    n, m = lengths.size, target.size
+    if ignore_trailing:
+        stop = np.minimum(lengths, m)  # compare prefixes of the same length
+    else:
+        stop = lengths
+    dtype = int if substitution is None else float
+    prev = np.tile(np.arange(m + 1, dtype=dtype), (n, 1))
+    distances = np.where(stop == 0, 0 if ignore_trailing else m, 0).astype(dtype)
+    for i in range(1, stop.max(initial=0) + 1):
+        cur = np.empty_like(prev)
+        cur[:, 0] = i
+        for j in range(1, m + 1):
+            if substitution is None:
+                cost = sequences[:, i - 1] != target[j - 1]
+            else:
+                cost = substitution(sequences[:, i - 1], target[j - 1])
+            cur[:, j] = np.minimum(
+                np.minimum(prev[:, j], cur[:, j - 1]) + 1, prev[:, j - 1] + cost
+            )
+        finished = stop == i
+        distances[finished] = cur[finished, i if ignore_trailing else m]
+        prev = cur
+    return distances
+
+
+def rank_experiments(
+    phases,
+    target_sequence,
+    phasenames=True,
+    ignore_trailing=False,
+    ignore=["bulk", "cumulate", "solid"],
+    mode="descending",
+    variable="temperature",
+    metric="levenshtein",
+):
+    """
+    Rank experiments by the distance between their appearance sequence and a
+    target sequence.
+
+    Parameters
+    -----------
+    phases : :class:`pandas.DataFrame`
+        Multi-experiment phase table.
+    target_sequence : :class:`list`
+        List of minerals to compare sequences against. For the set metric, items
+        can also be lists of minerals which appear together.
+    phasenames : :class:`bool`
+        Whether to compare phase names rather than phase IDs (e.g. clinopyroxene_0).
+    ignore_trailing : :class:`bool`
+        Whether to clip sequences to the minimum length (i.e. compare only the first
+        few items).
+    ignore : :class:`list`
+        Phases to ignore.
+    mode : :class:`str`
+        Ascending or descending.
+    variable : :class:`str`
+        Index varialbe. Typically temperature for melting or crystallisation
+        experiements.
+    metric : :class:`str`
+        Either :code:`"levenshtein"` or :code:`"set"`; see
+        :func:`sequence_distance`.
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+        Table of experiments and their distances to the target sequence, sorted by
+        distance.
+
+    Notes
+    -----
+    Phase names are interned to integer codes once for the whole table, such that
+    distances for all experiments are calculated together (see
+    :func:`_edit_distances`) rather than per-experiment.
+    """
+    if metric not in METRICS:
+        raise ValueError("Unknown metric {}, use one of {}".format(metric, METRICS))
+    table = appearance_table(phases, ignore=ignore, mode=mode, variable=variable)
+    tokens = table["phaseID"].values
+    if phasenames:
+        names = {p: phasename(p) for p in pd.unique(tokens)}
+        tokens = np.array([names[p] for p in tokens], dtype=object)
+    experiments = pd.unique(phases.experiment)
+    expcodes = pd.Index(experiments).get_indexer(table["experiment"].values)
+
+    if metric == "set":
+        target_sets = [{t} if isinstance(t, str) else set(t) for t in target_sequence]
+        vocabulary = pd.unique(np.r_[tokens, list(set().union(*target_sets))])
+        if vocabulary.size > 63:
+            raise ValueError("Set distances are limited to 63 distinct phases.")
+        lookup = {p: ix for ix, p in enumerate(vocabulary)}
+        bits = np.left_shift(1, pd.Index(vocabulary).get_indexer(tokens)).astype(
+            np.int64
+        )
+        # combine phases which appear at the same step into a single set
+        values = np.trunc(table["first"].values)
+        steps = np.flatnonzero(
+            np.r_[True, (expcodes[1:] != expcodes[:-1]) | (values[1:] != values[:-1])]
+        )
+        codes, expcodes = np.bitwise_or.reduceat(bits, steps), expcodes[steps]
+        target = np.array([_encode_set(t, lookup) for t in target_sets], dtype=np.int64)
+        substitution = _set_substitution
+    else:
+        codes, _ = pd.factorize(np.r_[tokens, np.array(target_sequence, dtype=object)])
+        codes, target = codes[: tokens.size], codes[tokens.size :]
+        substitution = None
+
+    lengths = np.bincount(expcodes, minlength=experiments.size)
+    offsets = np.r_[0, np.cumsum(lengths)[:-1]]
+    # table is grouped by experiment, so positions follow from the offsets
+    positions = np.arange(expcodes.size) - offsets[expcodes]
+    sequences = np.full((experiments.size, lengths.max(initial=0)), -1, dtype=np.int64)
+    sequences[expcodes, positions] = codes
+
+    distances = _edit_distances(
+        sequences,
+        lengths,
+        target,
+        ignore_trailing=ignore_trailing,
+        substitution=substitution,
+    )
+    ranked = pd.DataFrame({"experiment": experiments, "distance": distances})
+    return ranked.sort_values("distance", kind="mergesort").reset_index(drop=True)
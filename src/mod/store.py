@@ -0,0 +1,192 @@
+"""
+On-disk stores for aggregated system and phase tables, which can be appended to
+chunk by chunk.
+"""
+import pandas as pd
+from .compact import compact as _compact
+
+CHUNK_PREFIX = "chunk_"
+
+
+def _normalise_index(df):
+    """
+    Convert the tuple index of alphaMELTS tables (see
+    :func:`pyrolite_meltsutil.util.tables.tuple_reindex`) to a
+    :class:`~pandas.MultiIndex` such that it can be serialized.
+
+    Parameters
+    -----------
+    df : :class:`pandas.DataFrame`
+        Table to normalise.
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+    """
+    if not isinstance(df.index, pd.MultiIndex) and df.index.size:
+        df.index = pd.MultiIndex.from_tuples([tuple(i) for i in df.index])
+    return df
+
+
+def chunk_keys(path):
+    """
+    Get the keys of the chunks within a store, in the order they were written.
+
+    Parameters
+    -----------
+    path : :class:`str` | :class:`pathlib.Path`
+        Path to the HDF store.
+
+    Returns
+    -------
+    :class:`list`
+    """
+    with pd.HDFStore(str(path), mode="r") as store:
+        return sorted(k for k in store.keys() if k.lstrip("/").startswith(CHUNK_PREFIX))
+
+
+def append_chunk(path, df, key=None):
+    """
+    Append a chunk of rows to a store.
+
+    Parameters
+    -----------
+    path : :class:`str` | :class:`pathlib.Path`
+        Path to the HDF store.
+    df : :class:`pandas.DataFrame`
+        Chunk to append.
+    key : :class:`str`
+        Key for the chunk, defaulting to the next in sequence. Used to keep the
+        chunks of paired stores aligned.
+
+    Returns
+    -------
+    :class:`str`
+        Key for the chunk within the store.
+    """
+    with pd.HDFStore(str(path), mode="a") as store:
+        existing = [
+            int(k.lstrip("/")[len(CHUNK_PREFIX) :])
+            for k in store.keys()
+            if k.lstrip("/").startswith(CHUNK_PREFIX)
+        ]
+        if key is None:
+            # chunks may have been removed, so number from the last rather than count
+            key = "{}{:06d}".format(CHUNK_PREFIX, max(existing, default=-1) + 1)
+        store.put(key, _normalise_index(df), format="fixed")
+    return key
+
+
+def drop_experiments(path, experiments, keys=None):
+    """
+    Remove the rows for a set of experiments from a store, rewriting the chunks
+    which contain them and removing chunks which would be left empty.
+
+    Parameters
+    -----------
+    path : :class:`str` | :class:`pathlib.Path`
+        Path to the HDF store.
+    experiments : :class:`list`
+        Names of experiments to remove.
+    keys : :class:`list`
+        Keys for the chunks to check, defaulting to all chunks in the store.
+
+    Returns
+    -------
+    :class:`int`
+        Number of rows removed.
+    """
+    experiments = set(experiments)
+    if not experiments:
+        return 0
+    removed = 0
+    with pd.HDFStore(str(path), mode="a") as store:
+        present = [k.lstrip("/") for k in store.keys()]
+        present = sorted(k for k in present if k.startswith(CHUNK_PREFIX))
+        if keys is not None:
+            keys = {k.lstrip("/") for k in keys}
+            present = [k for k in present if k in keys]
+        for key in present:
+            df = store[key]
+            drop = df["experiment"].isin(experiments).values
+            if not drop.any():
+                continue
+            removed += drop.sum()
+            if drop.all():
+                store.remove(key)
+            else:
+                store.put(key, df.loc[~drop, :], format="fixed")
+    return int(removed)
+
+
+def iter_store(path):
+    """
+    Iterate over the chunks of a store, such that it can be processed without
+    reading it into memory at once. Stores written as a single dataframe are
+    yielded whole.
+
+    Parameters
+    -----------
+    path : :class:`str` | :class:`pathlib.Path`
+        Path to the HDF store.
+
+    Yields
+    -------
+    :class:`pandas.DataFrame`
+    """
+    keys = chunk_keys(path)
+    if not keys:
+        yield pd.read_hdf(str(path))
+        return
+    for key in keys:
+        yield pd.read_hdf(str(path), key=key)
+
+
+def _concat_categoricals(frames):
+    """
+    Concatenate frames with categorical columns, unifying the categories such that
+    the columns aren't converted back to objects.
+
+    Parameters
+    -----------
+    frames : :class:`list`
+        List of :class:`pandas.DataFrame`.
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+    """
+    columns = [
+        c
+        for c, dtype in frames[0].dtypes.items()
+        if isinstance(dtype, pd.CategoricalDtype)
+    ]
+    for c in columns:
+        categories = pd.api.types.union_categoricals(
+            [df[c] for df in frames], ignore_order=True
+        ).categories
+        for df in frames:
+            df[c] = df[c].cat.set_categories(categories)
+    return pd.concat(frames, sort=False)
+
+
+def read_store(path, compact=False):
+    """
+    Read an aggregated table from a store, whether it was written chunk by chunk
+    (see :func:`append_chunk`) or as a single dataframe.
+
+    Parameters
+    -----------
+    path : :class:`str` | :class:`pathlib.Path`
+        Path to the HDF store.
+    compact : :class:`bool`
+        Whether to convert the table to compact dtypes (see
+        :func:`mod.compact.compact`) chunk by chunk as it's read.
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+    """
+    if not compact:
+        return pd.concat(list(iter_store(path)), sort=False)
+    return _concat_categoricals([_compact(df) for df in iter_store(path)])
@@ -0,0 +1,69 @@
+"""
+Definition of the Noril'sk crystallisation study: the starting compositions,
+alphaMELTS environment and configurations of the experiment batch.
+"""
+# configuration common to all experiments of the batch
+DEFAULT_CONFIG = {
+    "Initial Pressure": 500,
+    "Initial Temperature": 1250,
+    "Final Temperature": 800,
+    "modes": ["isobaric", "fractionate solids"],
+}
+# configuration axes of the batch, where None takes the default
+CONFIG_GRID = {
+    "Log fO2 Path": ["NNO"],
+    "modes": [None, ["isobaric"]],
+    "modifychem": [None, {"H2O": 0}, {"H2O": 1}],
+}
+
+
+def starting_compositions(path="../data/starting_compositions_all.csv"):
+    """
+    Read starting compositions (e.g. Naldrett 2004) and prepare them for
+    alphaMELTS, with elements converted to oxides in wt% and iron split between
+    FeO and Fe2O3.
+
+    Parameters
+    -----------
+    path : :class:`str` | :class:`pathlib.Path`
+        Table of starting compositions.
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+    """
+    from pyrolite.util.pd import read_table
+    from pyrolite.util.units import scale
+    import pyrolite.geochem
+
+    df = read_table(path).rename(columns={"FeOt": "FeO", "LOI": "H2O"})
+    df.pyrochem.elements *= scale("ppm", "wt%")
+    return df.pyrochem.convert_chemistry(
+        [i for i in df.pyrochem.oxides if "Fe" not in i]
+        + [{"FeO": 0.9, "Fe2O3": 0.1}]
+        + ["Cr2O3"],
+        renorm=True,
+    )
+
+
+def melts_env():
+    """
+    Get the alphaMELTS environment for the batch.
+
+    Returns
+    -------
+    :class:`pyrolite_meltsutil.env.MELTS_Env`
+    """
+    from pyrolite_meltsutil.env import MELTS_Env
+
+    env = MELTS_Env()
+    env.VERSION = "MELTS"
+    env.MODE = "isobaric"
+    env.MINP = 100
+    env.MAXP = 10000
+    env.MINT = 500
+    env.MAXT = 1500
+    env.DELTAT = -10
+    env.DELTAP = 0
+    return env
+
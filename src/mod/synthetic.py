@@ -0,0 +1,315 @@
+"""
+Synthetic alphaMELTS-like tables for testing and benchmarking at batch scale.
+"""
+import os
+import json
+import shutil
+from pathlib import Path
+import pandas as pd
+import numpy as np
+from pyrolite_meltsutil.util.tables import phasename
+from .cache import MANIFEST
+
+PHASEIDS = [
+    "olivine_0",
+    "clinopyroxene_0",
+    "feldspar_0",
+    "orthopyroxene_0",
+    "spinel_0",
+    "water",
+    "rhm-oxide_0",
+    "apatite",
+    "clinopyroxene_1",
+    "feldspar_1",
+    "whitlockite",
+    "quartz",
+]
+
+OXIDES = [
+    "SiO2",
+    "TiO2",
+    "Al2O3",
+    "Fe2O3",
+    "Cr2O3",
+    "FeO",
+    "MnO",
+    "MgO",
+    "CaO",
+    "Na2O",
+    "K2O",
+    "P2O5",
+    "H2O",
+]
+
+
+def experiment_hashes(n, seed=None):
+    """
+    Generate unique experiment hashes in the style of those used for experiment
+    folder names.
+
+    Parameters
+    -----------
+    n : :class:`int`
+        Number of hashes to generate.
+    seed : :class:`int`
+        Random seed.
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        Array of 10-character hexadecimal strings.
+    """
+    rng = np.random.default_rng(seed)
+    values = rng.choice(16 ** 9, size=n, replace=False) + 16 ** 9
+    return np.array(["{:010x}".format(v)[-10:] for v in values])
+
+
+def synthetic_phases(
+    n_experiments=100,
+    phaseIDs=PHASEIDS,
+    tlim=(800, 1250),
+    deltaT=10,
+    pressure=500,
+    seed=None,
+):
+    """
+    Generate a synthetic multi-experiment phase table with the same shape as that
+    produced by aggregating alphaMELTS experiment folders.
+
+    Parameters
+    -----------
+    n_experiments : :class:`int`
+        Number of experiments to generate.
+    phaseIDs : :class:`list`
+        Solid phase IDs which may crystallise, in approximate order of appearance.
+    tlim : :class:`tuple`
+        Temperature range for the experiments.
+    deltaT : :class:`float`
+        Temperature step.
+    pressure : :class:`float`
+        Pressure for the (isobaric) experiments.
+    seed : :class:`int`
+        Random seed.
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+        Phase table, including liquid, bulk, solid and cumulate rows.
+
+    Notes
+    -----
+    Solid phases appear at a random step (later on average for phases further
+    down the list of phaseIDs), and some are resorbed before the final step.
+    """
+    rng = np.random.default_rng(seed)
+    T = np.arange(tlim[1], tlim[0] - 1, -deltaT, dtype=float)
+    nT, nP = T.size, len(phaseIDs)
+    # first and last step for each solid phase within each experiment
+    centres = np.linspace(0.1, 1.5, nP) * nT
+    start = np.round(rng.normal(centres, nT / 6, size=(n_experiments, nP)))
+    end = np.where(
+        rng.random((n_experiments, nP)) < 0.2,
+        start + rng.integers(2, nT // 2, size=(n_experiments, nP)),
+        nT,
+    )
+    steps = np.arange(nT)
+    present = (steps >= start[..., None]) & (steps < end[..., None])
+    ids = ["liquid_0"] + list(phaseIDs)
+    present = np.concatenate(
+        [np.ones((n_experiments, 1, nT), dtype=bool), present], axis=1
+    )
+    solids = present[:, 1:, :].any(axis=1)
+    # bulk, solid and cumulate rows, as for aggregated tables
+    ids += ["bulk", "solid", "cumulate"]
+    cumulate = np.maximum.accumulate(solids, axis=1)
+    present = np.concatenate(
+        [
+            present,
+            np.ones((n_experiments, 1, nT), dtype=bool),
+            solids[:, None, :],
+            cumulate[:, None, :],
+        ],
+        axis=1,
+    )
+    e_ix, p_ix, t_ix = np.nonzero(present)
+    experiments = experiment_hashes(n_experiments, seed=rng.integers(2 ** 32))
+    ids = np.array(ids, dtype=object)
+    df = pd.DataFrame(
+        {
+            "experiment": experiments[e_ix],
+            "step": t_ix,
+            "pressure": float(pressure),
+            "temperature": T[t_ix],
+            "mass": rng.gamma(2.0, 5.0, size=e_ix.size),
+        }
+    )
+    comp = rng.dirichlet(np.ones(len(OXIDES)), size=e_ix.size) * 100
+    for ix, ox in enumerate(OXIDES):
+        df[ox] = comp[:, ix]
+    df["phaseID"] = ids[p_ix]
+    df["phase"] = np.array([phasename(p) for p in ids], dtype=object)[p_ix]
+    df["mass%"] = df["mass"] / df["mass"].max() * 100
+    df["volume%"] = df["mass%"] * rng.uniform(0.9, 1.1, size=e_ix.size)
+    df.index = pd.MultiIndex.from_arrays(
+        [df["pressure"].astype(int).values, df["temperature"].astype(int).values]
+    )
+    return df
+
+
+# location and scale of the thermodynamic variables of the system table
+SYSTEM = {
+    "entropy": (270.0, 5.0),
+    "enthalpy": (-1.18e6, 1e4),
+    "volume": (38.0, 1.0),
+    "dVdP*10^6": (-385.0, 5.0),
+    "dVdT*10^6": (3620.0, 20.0),
+    "Cp": (145.0, 2.0),
+    "logfO2-NNO": (0.0, 0.0),
+    "rhol": (2.55, 0.05),
+    "viscosity": (2.5, 0.5),
+    "aH2O": (0.35, 0.05),
+    "chisqr": (0.0, 0.0),
+}
+
+
+def synthetic_system(phases, seed=None):
+    """
+    Generate a synthetic multi-experiment system table for a synthetic phase table
+    (see :func:`synthetic_phases`), with a row for each step of each experiment.
+
+    Parameters
+    -----------
+    phases : :class:`pandas.DataFrame`
+        Synthetic phase table.
+    seed : :class:`int`
+        Random seed.
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+        System table, with the columns of an aggregated system table.
+    """
+    rng = np.random.default_rng(seed)
+    phaseIDs = phases["phaseID"].values
+    # bulk and liquid rows are present for every step, in the same order
+    bulk, liquid = phases.loc[phaseIDs == "bulk"], phases.loc[phaseIDs == "liquid_0"]
+    solid = phases.loc[phaseIDs == "solid", ["experiment", "step"]]
+    df = bulk[["experiment", "step", "pressure", "temperature", "mass"]].copy()
+    n = df.index.size
+    df["F"] = np.clip(liquid["mass"].values / df["mass"].values, 0, 1)
+    df["phi"] = df["F"]
+    for column, (loc, scale) in SYSTEM.items():
+        df[column] = rng.normal(loc, scale, size=n) if scale else loc
+    df["logfO2(absolute)"] = -7.0 - 0.011 * (1250 - df["temperature"].values)
+    crystallised = pd.MultiIndex.from_frame(df[["experiment", "step"]]).isin(
+        pd.MultiIndex.from_frame(solid)
+    )
+    df["rhos"] = np.where(crystallised, rng.normal(3.2, 0.1, size=n), 0.0)
+    initial = df.groupby("experiment", sort=False)["mass"].transform("first")
+    df["mass%"] = df["mass"] / initial * 100
+    df["volume%"] = df["mass%"] * rng.uniform(0.9, 1.1, size=n)
+    columns = ["experiment", "step", "pressure", "temperature", "mass", "F", "phi"]
+    columns += list(SYSTEM)[:6] + ["logfO2(absolute)", "logfO2-NNO", "rhol", "rhos"]
+    return df[columns + ["viscosity", "aH2O", "chisqr", "mass%", "volume%"]]
+
+
+def synthetic_config(experiments, seed=None):
+    """
+    Generate a synthetic batch configuration for a set of experiments, in the form
+    of that serialized by a batch (see :class:`mod.catalog.BatchCatalog`).
+
+    Parameters
+    -----------
+    experiments : :class:`list`
+        Experiment hashes.
+    seed : :class:`int`
+        Random seed.
+
+    Returns
+    -------
+    :class:`dict`
+        Configuration dictionary indexed by hashes.
+    """
+    rng = np.random.default_rng(seed)
+    suites = {
+        "Nadezhdinsky": ["Nd1", "Nd2", "Nd3"],
+        "Morongovsky": ["Mr1", "Mr2"],
+        "Mokulaevsky": ["Mk"],
+        "Kharaelakhsky": ["Hr"],
+    }
+    titles = [(s, t) for s, ts in suites.items() for t in ts]
+    modes = [["isobaric", "fractionate solids"], ["isobaric"]]
+    config = {}
+    for hsh in experiments:
+        suite, title = titles[rng.integers(len(titles))]
+        mode = modes[rng.integers(len(modes))]
+        cfg = {
+            "Title": title,
+            "Suite": suite,
+            "modes": mode,
+            "H2O": float(rng.choice([0.0, 1.0, rng.uniform(0.5, 3)])),
+            "Initial Pressure": 500,
+            "Initial Temperature": 1250,
+            "Final Temperature": 800,
+            "Log fO2 Path": "NNO",
+        }
+        name = "{}isobar{}0kbar1250-800CNNO{}".format(
+            title, "frac" if len(mode) > 1 else "", hsh
+        )
+        config[hsh] = (name, cfg, {})
+    return config
+
+
+def synthetic_folders(outputfolder, experiments, templates, config=None, link=True):
+    """
+    Generate experiment folders of the same shape as those of a batch, from the
+    tables of template experiment folders (e.g. those of a real batch), such that
+    parsing and aggregation can be exercised at scale.
+
+    Parameters
+    -----------
+    outputfolder : :class:`str` | :class:`pathlib.Path`
+        Folder to create the experiment folders in.
+    experiments : :class:`list`
+        Experiment hashes, used for the folder names.
+    templates : :class:`list`
+        Template experiment folders, which are cycled through.
+    config : :class:`dict`
+        Batch configuration to serialize alongside the folders (see
+        :func:`synthetic_config`).
+    link : :class:`bool`
+        Whether to hard link the template tables rather than copying them, such
+        that large batches take little space; files are copied where they can't
+        be linked (e.g. across filesystems).
+
+    Returns
+    -------
+    :class:`list`
+        Experiment folders.
+    """
+    outputfolder = Path(outputfolder)
+    outputfolder.mkdir(parents=True, exist_ok=True)
+    files = []
+    for template in templates:
+        # completion manifests are left out, as they refer to the template folder
+        paths = sorted(p for p in Path(template).iterdir() if p.is_file())
+        files.append([p for p in paths if p.name != MANIFEST])
+    folders = []
+    for ix, hsh in enumerate(experiments):
+        folder = outputfolder / hsh
+        folder.mkdir(exist_ok=True)
+        for src in files[ix % len(files)]:
+            dst = folder / src.name
+            if dst.exists():
+                continue
+            try:
+                if not link:
+                    raise OSError
+                os.link(str(src), str(dst))
+            except OSError:
+                shutil.copy2(str(src), str(dst))
+        folders.append(folder)
+    if config is not None:
+        with open(str(outputfolder / "meltsBatchConfig.json"), "w") as f:
+            f.write(json.dumps(config))
+    return folders
@@ -0,0 +1,416 @@
+"""
+Block-aware parsing of alphaMELTS output tables, where each file is read once,
+split into blocks of whitespace-delimited values and converted a column at a time,
+as a faster equivalent of :func:`pyrolite_meltsutil.tables.load.import_tables`.
+"""
+import re
+import functools
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import periodictable as pt
+from pyrolite.util.pd import zero_to_nan
+from pyrolite_meltsutil.parse import from_melts_cstr
+from pyrolite_meltsutil.tables.load import (
+    convert_thermo_names,
+    read_phase_table,
+    read_melts_tablefile,
+)
+from pyrolite_meltsutil.util.tables import (
+    phasename,
+    tuple_reindex,
+    integrate_solid_composition,
+)
+from pyrolite_meltsutil.util.log import Handle
+
+logger = Handle(__name__)
+
+STRING_COLUMNS = ["structure", "formula"]
+# rows of Trace_main_tbl.txt other than those for individual phases
+TRACE_ROWS = {
+    "Partition": "partition",
+    "Bulk": "bulk",
+    "Liquid": "liquid",
+    "Solid": "solid",
+}
+NUMBER = re.compile(r"[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?$|---$|nan$")
+# blocks are separated by blank lines, and sections of alphaMELTS_tbl.txt by titles
+BLOCK = re.compile(r"[\n\r][\n\r]+")
+SECTION = re.compile(r"Title: .*[\n\r][\n\r]+")
+# elements with valences marked by primes (e.g. Fe''), groups, and their counts
+COUNT = r"((?:0|[1-9][0-9]*|)[.][0-9]*|0|[1-9][0-9]*|)"
+FRAGMENT = re.compile(r"([A-Z][a-z]?)('*)" + COUNT + r"|(\()|\)" + COUNT)
+
+
+def _count(s):
+    if not s:
+        return 1
+    return float(s) if "." in s else int(s)
+
+
+@functools.lru_cache(maxsize=2 ** 16)
+def melts_formula(composition_str):
+    """
+    Parse a melts composition string to a formula, equivalent to
+    :func:`pyrolite_meltsutil.parse.from_melts_cstr`, but building the formula
+    structure directly rather than with the general formula grammar. Strings which
+    aren't simple sequences of elements and groups are passed to
+    :func:`~pyrolite_meltsutil.parse.from_melts_cstr`.
+
+    Parameters
+    -----------
+    composition_str : :class:`str`
+        Composition to parse.
+
+    Returns
+    -------
+    :class:`periodictable.formulas.Formula`
+    """
+    s = str(composition_str).replace("nan", "").replace("-0.0", "0.0")
+    s = s.replace("[]", "")
+    stack, position = [[]], 0
+    for m in FRAGMENT.finditer(s):
+        if m.start() != position:
+            break
+        position = m.end()
+        symbol, primes, count, opening, group_count = m.groups()
+        if symbol is not None:
+            atom = pt.elements.symbol(symbol)
+            if primes:
+                atom = atom.ion[len(primes)]
+            stack[-1].append((_count(count), atom))
+        elif opening:
+            stack.append([])
+        elif len(stack) > 1:
+            group = tuple(stack.pop())
+            stack[-1].append((_count(group_count), group))
+        else:
+            break
+    if position != len(s) or len(stack) != 1:
+        return from_melts_cstr(composition_str)
+    return pt.formula(tuple(stack[0]))
+
+
+def read_block(headers, lines, strings=STRING_COLUMNS, pad=False):
+    """
+    Convert the lines of a block of whitespace-delimited values to a table, a
+    column at a time, with values converted as by the pandas parser.
+
+    Parameters
+    -----------
+    headers : :class:`list`
+        Column names.
+    lines : :class:`list`
+        Lines of values.
+    strings : :class:`list`
+        Columns to keep as strings; other columns are converted to numbers, except
+        where they contain values which aren't numeric (e.g. :code:`---`).
+    pad : :class:`bool`
+        Whether to pad lines with fewer values than columns with missing values.
+
+    Returns
+    -------
+    :class:`pandas.DataFrame` | :code:`None`
+        Table, or :code:`None` where lines don't have a value for each column.
+    """
+    width = len(headers)
+    tokens = " ".join(lines).split()
+    if len(tokens) != len(lines) * width:
+        rows = [l.split() for l in lines]
+        if not pad or any(len(r) > width for r in rows):
+            return None
+        tokens = [t for r in rows for t in r + [None] * (width - len(r))]
+    columns = {}  # by position, as names can be duplicated
+    for ix, name in enumerate(headers):
+        values = np.array(tokens[ix::width], dtype=object)
+        if name in strings:
+            columns[ix] = values
+            continue
+        numbers = pd.to_numeric(values, errors="coerce")
+        missing = np.isnan(numbers) if numbers.dtype.kind == "f" else []
+        if np.any(missing):
+            invalid = [v not in (None, "nan", "NaN") for v in values[missing]]
+            if any(invalid):  # kept as strings
+                numbers = np.array([np.nan if v is None else v for v in values])
+        columns[ix] = numbers
+    df = pd.DataFrame(columns, index=pd.RangeIndex(len(lines)))
+    df.columns = headers
+    return df
+
+
+def _finish_table(df, kelvin=False, mgno=True):
+    """
+    Apply the conventions of the pyrolite-meltsutil table readers: expanded
+    thermodynamic names, temperatures in Celsius, Mg# and a (pressure,
+    temperature) index.
+    """
+    df = convert_thermo_names(df)
+    if ("temperature" in df.columns) and not kelvin:
+        df["temperature"] -= 273.15
+    if mgno and ("MgO" in df.columns) and ("FeO" in df.columns):
+        df.pyrochem.add_MgNo()
+    df = zero_to_nan(df)
+    return tuple_reindex(df)
+
+
+def read_table_file(filepath, kelvin=False, skiprows=3, mgno=True):
+    """
+    Read a single-table alphaMELTS file (e.g. :code:`System_main_tbl.txt`),
+    equivalent to :func:`pyrolite_meltsutil.tables.load.read_melts_tablefile`.
+    Rows with fewer values than columns (e.g. where no solids are present) are
+    padded with missing values.
+
+    Parameters
+    -----------
+    filepath : :class:`str` | :class:`pathlib.Path`
+        Path to the table.
+    kelvin : :class:`bool`
+        Whether to keep temperatures in kelvin.
+    skiprows : :class:`int`
+        Number of rows above the table headers.
+    mgno : :class:`bool`
+        Whether to calculate Mg#.
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+    """
+    with open(str(filepath)) as f:
+        lines = f.read().splitlines()[skiprows:]
+    headers, lines = lines[0].split(), [l for l in lines[1:] if l.strip()]
+    df = read_block(headers, lines, strings=[], pad=True)
+    if df is None:  # lines with more values than columns
+        return read_melts_tablefile(filepath, kelvin=kelvin, skiprows=skiprows)
+    # logfO2(absolute) is sometimes duplicated, where the first is kept
+    df = df.loc[:, ~df.columns.duplicated()]
+    df = df.dropna(how="all", axis=1)
+    return _finish_table(df, kelvin=kelvin, mgno=mgno)
+
+
+def read_phase_block(block):
+    """
+    Read the table for a single phase from a block of a phase table file.
+
+    Parameters
+    -----------
+    block : :class:`str`
+        Block including the phase title and column headers.
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+    """
+    lines = [l for l in block.splitlines() if l.strip()]
+    phaseID = lines[0].split()[0].strip()
+    df = read_block(lines[1].split(), lines[2:])
+    if df is None:  # inconsistent headers are handled by pyrolite-meltsutil
+        return read_phase_table(block)
+    df["phaseID"] = phaseID
+    df["phase"] = phasename(phaseID)
+    return df
+
+
+def read_phase_file(filepath, kelvin=False, mgno=True):
+    """
+    Read the phase tables from :code:`alphaMELTS_tbl.txt` (or
+    :code:`Phase_main_tbl.txt`) into a single table, equivalent to
+    :func:`pyrolite_meltsutil.tables.load.phasetable_from_alphameltstxt`.
+
+    Parameters
+    -----------
+    filepath : :class:`str` | :class:`pathlib.Path`
+        Path to the table.
+    kelvin : :class:`bool`
+        Whether to keep temperatures in kelvin.
+    mgno : :class:`bool`
+        Whether to calculate Mg#.
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+    """
+    with open(str(filepath)) as f:
+        sections = [s for s in SECTION.split(f.read().strip()) if s]
+    # the phase tables are the only section with a lower case title
+    phasetbl = [s for s in sections if s[0] == s[0].lower()]
+    if len(phasetbl) != 1:
+        logger.warning("Imported alphaMELTS_tbl.txt incorrectly formatted.")
+        df = pd.DataFrame()
+    else:
+        blocks = BLOCK.split(phasetbl[0].strip())
+        df = pd.concat([read_phase_block(b) for b in blocks], sort=False)
+    df = convert_thermo_names(df)
+    numeric = [c for c in df.columns if c not in ["step", "phaseID", "phase"]]
+    numeric = [c for c in numeric if c not in STRING_COLUMNS]
+    df[numeric] = df[numeric].apply(pd.to_numeric, errors="coerce")
+    if "formula" in df.columns:
+        df["formula"] = [melts_formula(f) for f in df["formula"].values]
+    return _finish_table(df, kelvin=kelvin, mgno=mgno)
+
+
+def import_tables(pth, kelvin=False):
+    """
+    Import the system and phase tables from an experiment folder, equivalent to
+    :func:`pyrolite_meltsutil.tables.load.import_tables`.
+
+    Parameters
+    -----------
+    pth : :class:`pathlib.Path`
+        Experiment folder.
+    kelvin : :class:`bool`
+        Whether to keep temperatures in kelvin.
+
+    Returns
+    -------
+    :class:`tuple`
+        System and phase tables.
+    """
+    pth = Path(pth)
+    files = ["System_main_tbl.txt", "Bulk_comp_tbl.txt", "Solid_comp_tbl.txt"]
+    files += ["alphaMELTS_tbl.txt"]
+    if not all((pth / f).exists() for f in files):
+        msg = "File missing from {}: {}".format(
+            pth, ", ".join([i.name for i in pth.iterdir()])
+        )
+        raise FileNotFoundError(msg)
+    system = read_table_file(pth / "System_main_tbl.txt", kelvin=kelvin)
+    system["step"] = np.arange(system.index.size)
+    system["mass%"] = (system["mass"] / system["mass"].values[0]) * 100
+    system["volume%"] = (system["volume"] / system["volume"].values[0]) * 100
+    system = system.reindex(columns=["step"] + [c for c in system if c != "step"])
+
+    # Mg# is calculated row by row, so is added once the tables are combined
+    phase = read_phase_file(pth / "alphaMELTS_tbl.txt", kelvin=kelvin, mgno=False)
+    bulk = read_table_file(pth / "Bulk_comp_tbl.txt", kelvin=kelvin, mgno=False)
+    solid = read_table_file(pth / "Solid_comp_tbl.txt", kelvin=kelvin, mgno=False)
+    for df in [phase, bulk, solid]:
+        df["step"] = system.loc[df.index, "step"]
+    bulk["phase"] = "bulk"
+    solid["phase"] = "solid"
+    solid = solid.loc[solid["mass"] > 0.0, :]  # drop where no solids present
+    phase = pd.concat([phase, bulk, solid], sort=False)
+    phase.pyrochem.add_MgNo()
+    # integrated solids, where the system mass changes for fractionation
+    frac = system.mass.max() / system.mass.min() > 1.05
+    cumulate = integrate_solid_composition(phase, frac=frac)
+    cumulate["phase"] = "cumulate"
+    phase = pd.concat([phase, cumulate], sort=False)
+
+    phase["step"] = system.loc[phase.index, "step"]
+    phase = phase.reindex(columns=["step"] + [c for c in phase if c != "step"])
+    phase["mass%"] = phase["mass"] / system.loc[phase.index, "mass"].values[0] * 100
+    phase["volume%"] = (
+        phase["volume"] / system.loc[phase.index, "volume"].values[0] * 100
+    )
+    numeric = [c for c in phase.columns if c not in ["phaseID", "phase"]]
+    numeric = [c for c in numeric if c not in STRING_COLUMNS]
+    phase[numeric] = phase[numeric].apply(pd.to_numeric, errors="coerce")
+    return system, phase
+
+
+def melts_traces(filepath):
+    """
+    Get the trace elements specified within a melts file, in the order given.
+
+    Parameters
+    -----------
+    filepath : :class:`str` | :class:`pathlib.Path`
+        Path to the melts file.
+
+    Returns
+    -------
+    :class:`list`
+    """
+    elements = []
+    with open(str(filepath)) as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key.strip().lower() == "initial trace" and value.split():
+                elements.append(value.split()[0])
+    return elements
+
+
+def read_trace_file(filepath, elements=[], kelvin=False):
+    """
+    Read :code:`Trace_main_tbl.txt` into a single table, with a row for each
+    phase (and the partition, bulk, liquid and solid rows) at each step.
+
+    Parameters
+    -----------
+    filepath : :class:`str` | :class:`pathlib.Path`
+        Path to the table.
+    elements : :class:`list`
+        Trace elements, in the order of their columns (see :func:`melts_traces`).
+        Where the table includes a header of element names, it's used instead.
+    kelvin : :class:`bool`
+        Whether to keep temperatures in kelvin.
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+        Table with step, pressure, temperature, phaseID, phase and mass columns,
+        and a column for each trace element; values given as :code:`---` are
+        missing.
+    """
+    with open(str(filepath)) as f:
+        lines = f.read().splitlines()
+    steps, pressures, temperatures, labels, values = [], [], [], [], []
+    step, pressure, temperature = -1, np.nan, np.nan
+    for line in lines:
+        tokens = line.split()
+        if not tokens or tokens[0] == "Title:":
+            continue
+        if tokens[0] == "Pressure":
+            step, pressure, temperature = step + 1, tokens[1], tokens[3]
+            continue
+        if len(tokens) > 1 and NUMBER.match(tokens[1]) is None:
+            elements = tokens[2:]  # header of element names, following the mass
+            continue
+        if step < 0:
+            continue
+        steps.append(step)
+        pressures.append(pressure)
+        temperatures.append(temperature)
+        labels.append(TRACE_ROWS.get(tokens[0], tokens[0]))
+        # the partition and solid rows are marked by a trailing --- where empty
+        row = tokens[1 : len(elements) + 2]
+        values.extend(row + [None] * (len(elements) + 1 - len(row)))
+    values = pd.to_numeric(np.array(values, dtype=object), errors="coerce")
+    df = pd.DataFrame(
+        values.reshape(len(labels), len(elements) + 1),
+        columns=["mass"] + list(elements),
+    )
+    df.insert(0, "step", np.array(steps, dtype=int))
+    df.insert(1, "pressure", pd.to_numeric(np.array(pressures, dtype=object)))
+    df.insert(2, "temperature", pd.to_numeric(np.array(temperatures, dtype=object)))
+    df.insert(3, "phaseID", np.array(labels, dtype=object))
+    names = {p: phasename(p) for p in set(labels)}
+    df.insert(4, "phase", np.array([names[p] for p in labels], dtype=object))
+    if not kelvin:
+        df["temperature"] -= 273.15
+    return tuple_reindex(df)
+
+
+def import_traces(pth, kelvin=False):
+    """
+    Import the trace element table from an experiment folder, with the trace
+    elements taken from its melts file.
+
+    Parameters
+    -----------
+    pth : :class:`pathlib.Path`
+        Experiment folder.
+    kelvin : :class:`bool`
+        Whether to keep temperatures in kelvin.
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+        Trace element table (see :func:`read_trace_file`).
+    """
+    pth = Path(pth)
+    if not (pth / "Trace_main_tbl.txt").exists():
+        raise FileNotFoundError("File missing from {}: Trace_main_tbl.txt".format(pth))
+    meltsfiles = sorted(pth.glob("*.melts"))
+    elements = melts_traces(meltsfiles[0]) if meltsfiles else []
+    return read_trace_file(pth / "Trace_main_tbl.txt", elements, kelvin=kelvin)
@@ -0,0 +1,325 @@
+"""
+Runtime telemetry for batches of alphaMELTS experiments: per-experiment run
+metrics (wall time, steps completed, exit status and convergence warnings),
+live progress reporting, and summaries of compute cost by configuration.
+"""
+import re
+import json
+import time
+import datetime
+from pathlib import Path
+import pandas as pd
+
+METRICS = "run_metrics.jsonl"
+# lines of logfile.txt which indicate a calculation struggled to converge; the
+# environment variable echo (e.g. ALPHAMELTS_FAILED_ITER_PATIENCE) is skipped
+WARNING = re.compile(
+    r"warn|error|fail|converge|iteration|infeasible|singular|cannot|unable",
+    re.IGNORECASE,
+)
+NUMBER = re.compile(r"[-+]?\d[\d.]*(?:[eE][-+]?\d+)?")
+
+
+def logfile_warnings(path):
+    """
+    Get the convergence warnings reported in an alphaMELTS logfile.
+
+    Parameters
+    -----------
+    path : :class:`str` | :class:`pathlib.Path`
+        Path to :code:`logfile.txt`.
+
+    Returns
+    -------
+    :class:`dict`
+        Counts of each distinct warning, with numbers replaced by :code:`#` such
+        that repeated warnings for different steps are counted together.
+    """
+    counts = {}
+    try:
+        with open(str(path), "r", errors="replace") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith(("!", "ALPHAMELTS_")):
+                    continue
+                if WARNING.search(line):
+                    message = NUMBER.sub("#", line)
+                    counts[message] = counts.get(message, 0) + 1
+    except OSError:
+        pass
+    return counts
+
+
+def completed_steps(folder):
+    """
+    Count the steps completed by an experiment, from the rows of its
+    :code:`System_main_tbl.txt`, without parsing the table.
+
+    Parameters
+    -----------
+    folder : :class:`str` | :class:`pathlib.Path`
+        Experiment folder.
+
+    Returns
+    -------
+    :class:`tuple`
+        Number of steps and the temperature (in degrees C) of the last step,
+        which is None where no steps were completed.
+    """
+    steps, temperature, columns = 0, None, None
+    try:
+        with open(str(Path(folder) / "System_main_tbl.txt"), "r") as f:
+            for line in f:
+                values = line.split()
+                if columns is None:
+                    if values and values[0] == "Pressure":
+                        columns = values
+                    continue
+                if not values:
+                    break  # the system table is followed by other blocks
+                steps += 1
+                temperature = values[1]
+    except OSError:
+        pass
+    if temperature is not None:
+        try:
+            temperature = float(temperature) - 273.15
+        except ValueError:
+            temperature = None
+    return steps, temperature
+
+
+def experiment_metrics(folder, status, returncode=None, started=None, finished=None):
+    """
+    Record the run metrics of an experiment from its folder.
+
+    Parameters
+    -----------
+    folder : :class:`str` | :class:`pathlib.Path`
+        Experiment folder.
+    status : :class:`str`
+        Status of the experiment (e.g. :code:`"completed"` or :code:`"failed"`).
+    returncode : :class:`int`
+        Exit status of the alphaMELTS process.
+    started, finished : :class:`float`
+        Times at which the experiment started and finished, in seconds since the
+        epoch.
+
+    Returns
+    -------
+    :class:`dict`
+    """
+    folder = Path(folder)
+    finished = time.time() if finished is None else finished
+    steps, temperature = completed_steps(folder)
+    warnings = logfile_warnings(folder / "logfile.txt")
+    return {
+        "experiment": folder.name,
+        "status": status,
+        "returncode": returncode,
+        "seconds": None if started is None else finished - started,
+        "steps": steps,
+        "temperature": temperature,
+        "warnings": sum(warnings.values()),
+        "messages": warnings,
+        "started": started,
+        "finished": finished,
+    }
+
+
+def append_metrics(path, records):
+    """
+    Append run metrics to a metrics file, one json record per line.
+
+    Parameters
+    -----------
+    path : :class:`str` | :class:`pathlib.Path`
+        Path to the metrics file.
+    records : :class:`list`
+        Run metrics (see :func:`experiment_metrics`).
+    """
+    with open(str(path), "a") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+
+def read_metrics(outputfolder, latest=True):
+    """
+    Read the run metrics of a batch as a table.
+
+    Parameters
+    -----------
+    outputfolder : :class:`str` | :class:`pathlib.Path`
+        Folder containing the batch, or the path to a metrics file.
+    latest : :class:`bool`
+        Whether to keep only the most recent run of each experiment, rather than
+        all runs.
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+        Table of run metrics, with a row per run of each experiment.
+    """
+    path = Path(outputfolder)
+    if path.is_dir():
+        path = path / METRICS
+    records = []
+    if path.exists():
+        with open(str(path), "r") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue  # a line partially written by an interrupted run
+    columns = ["experiment", "status", "returncode", "seconds", "steps"]
+    df = pd.DataFrame.from_records(records, columns=None if records else columns)
+    if latest and not df.empty:
+        df = df.drop_duplicates("experiment", keep="last").reset_index(drop=True)
+    return df
+
+
+def cost_summary(metrics, catalog=None, by=["modes"]):
+    """
+    Summarise the compute cost of a batch by configuration, such that the
+    configurations or compositions which dominate the wall time can be found.
+
+    Parameters
+    -----------
+    metrics : :class:`pandas.DataFrame`
+        Run metrics (see :func:`read_metrics`).
+    catalog : :class:`mod.catalog.BatchCatalog`
+        Catalog of the batch, from which configuration columns are taken.
+    by : :class:`list`
+        Columns of the metrics or catalog (e.g. :code:`modes`, :code:`H2O`,
+        :code:`Title`) to group by.
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+        Number of experiments, total and mean wall time, share of the total wall
+        time, seconds per step, warnings per experiment and number of experiments
+        which didn't complete for each group, sorted by total wall time.
+    """
+    df = metrics
+    if catalog is not None:
+        df = df.join(catalog.table, on="experiment", rsuffix="_config")
+    df = df.assign(incomplete=df["status"] != "completed")
+    summary = df.groupby(list(by), dropna=False).agg(
+        experiments=("experiment", "size"),
+        seconds=("seconds", "sum"),
+        mean_seconds=("seconds", "mean"),
+        steps=("steps", "sum"),
+        warnings=("warnings", "mean"),
+        incomplete=("incomplete", "sum"),
+    )
+    summary.insert(2, "share", summary["seconds"] / summary["seconds"].sum())
+    steps = summary.pop("steps")
+    summary.insert(4, "seconds_per_step", summary["seconds"] / steps.where(steps > 0))
+    return summary.sort_values("seconds", ascending=False)
+
+
+class BatchProgress(object):
+    """
+    Progress of a running batch, reporting throughput and an estimated time to
+    completion.
+
+    Parameters
+    -----------
+    weights : :class:`dict`
+        Expected cost of each experiment to be run (e.g. expected steps; see
+        :func:`mod.batch.expected_steps`), used to estimate the remaining time.
+        As the batch is run longest-first, counts of experiments would
+        overestimate the remaining time.
+    logger : :class:`logging.Logger`
+        Logger to report progress to.
+    interval : :class:`float`
+        Minimum number of seconds between progress reports.
+    """
+
+    def __init__(self, weights, logger=None, interval=30.0):
+        self.weights = weights
+        self.logger = logger
+        self.interval = interval
+        self.started = self._reported = time.time()
+        self.done, self.failed, self.steps, self.cost = 0, 0, 0, 0.0
+
+    @property
+    def total(self):
+        return len(self.weights)
+
+    def update(self, record):
+        """
+        Update the progress with the metrics of a finished experiment.
+
+        Parameters
+        -----------
+        record : :class:`dict`
+            Run metrics (see :func:`experiment_metrics`).
+        """
+        self.done += 1
+        self.failed += record["status"] != "completed"
+        self.steps += record.get("steps") or 0
+        self.cost += self.weights.get(record["experiment"], 0.0)
+
+    @property
+    def elapsed(self):
+        return time.time() - self.started
+
+    @property
+    def throughput(self):
+        """
+        Experiments and steps completed per minute.
+
+        Returns
+        -------
+        :class:`tuple`
+        """
+        minutes = max(self.elapsed, 1e-9) / 60
+        return self.done / minutes, self.steps / minutes
+
+    @property
+    def eta(self):
+        """
+        Estimated time remaining, from the rate at which the expected cost of the
+        batch has been completed.
+
+        Returns
+        -------
+        :class:`datetime.timedelta`
+            Estimated time remaining, or None before any experiment has finished.
+        """
+        total = sum(self.weights.values())
+        if not self.cost or not total:
+            return None
+        remaining = self.elapsed * (total - self.cost) / self.cost
+        return datetime.timedelta(seconds=round(remaining))
+
+    def report(self, force=False):
+        """
+        Log the progress, where at least :attr:`interval` seconds have passed since
+        the last report.
+
+        Parameters
+        -----------
+        force : :class:`bool`
+            Whether to report regardless of the interval.
+
+        Returns
+        -------
+        :class:`str`
+            Progress message, or None where not reported.
+        """
+        if not force and time.time() - self._reported < self.interval:
+            return None
+        self._reported = time.time()
+        experiments, steps = self.throughput
+        message = "{}/{} calculations ({:.0%}), {:.2f}/min, {:.0f} steps/min".format(
+            self.done, self.total, self.done / max(self.total, 1), experiments, steps
+        )
+        if self.failed:
+            message += ", {} failed".format(self.failed)
+        if self.done < self.total and self.eta is not None:
+            message += ", ETA {}".format(self.eta)
+        if self.logger is not None:
+            self.logger.info(message)
+        return message
@@ -0,0 +1,169 @@
+"""
+Queries of aggregated trace element tables (see :func:`mod.tables.import_traces`),
+vectorized across experiments such that trace element evolution can be compared
+for a whole batch at once.
+"""
+import numpy as np
+import pandas as pd
+from .columnar import read_dataset
+
+# columns of trace tables other than the trace elements
+COLUMNS = ["experiment", "step", "pressure", "temperature", "phaseID", "phase", "mass"]
+KEYS = ["experiment", "step"]
+
+
+def trace_elements(traces):
+    """
+    Get the trace elements within a trace table.
+
+    Parameters
+    -----------
+    traces : :class:`pandas.DataFrame`
+        Trace table.
+
+    Returns
+    -------
+    :class:`list`
+    """
+    return [c for c in traces.columns if c not in COLUMNS]
+
+
+def read_traces(
+    path, experiments=None, phases=None, elements=None, temperature=None, **kwargs
+):
+    """
+    Read a trace table from a dataset (see :func:`mod.columnar.read_dataset`),
+    reading only the experiments, phases, elements and temperatures required.
+
+    Parameters
+    -----------
+    path : :class:`str` | :class:`pathlib.Path`
+        Root folder of the dataset.
+    experiments : :class:`list`
+        Experiments to read, defaulting to all.
+    phases : :class:`list`
+        Phase names (e.g. :code:`"liquid"`, :code:`"olivine"`) to read, defaulting
+        to all.
+    elements : :class:`list`
+        Trace elements to read, defaulting to all.
+    temperature : :class:`tuple`
+        Inclusive range of temperatures to read.
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+    """
+    columns = None if elements is None else COLUMNS + list(elements)
+    return read_dataset(
+        path,
+        experiments=experiments,
+        phases=phases,
+        temperature=temperature,
+        columns=columns,
+        **kwargs
+    )
+
+
+def trace_table(traces, phase="liquid", elements=None):
+    """
+    Get the trace element concentrations of a phase at each step of each
+    experiment, where multiple instances of a phase (e.g. two clinopyroxenes) are
+    combined by mass.
+
+    Parameters
+    -----------
+    traces : :class:`pandas.DataFrame`
+        Multi-experiment trace table.
+    phase : :class:`str`
+        Phase name, or one of :code:`"bulk"`, :code:`"liquid"`, :code:`"solid"` or
+        :code:`"partition"` (bulk partition coefficients, as reported by
+        alphaMELTS).
+    elements : :class:`list`
+        Trace elements, defaulting to all.
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+        Pressure, temperature, mass and concentrations, indexed by experiment and
+        step.
+    """
+    elements = trace_elements(traces) if elements is None else list(elements)
+    columns = KEYS + ["pressure", "temperature", "mass"] + elements
+    rows = traces.loc[np.asarray(traces["phase"] == phase), columns]
+    rows = rows.reset_index(drop=True)
+    if rows.duplicated(KEYS).any():
+        # concentrations are weighted by mass, ignoring instances where missing
+        weights = rows[elements].notnull().mul(rows["mass"], axis=0)
+        rows[elements] = rows[elements].mul(rows["mass"], axis=0)
+        for e in elements:
+            rows["weight_" + e] = weights[e]
+        table = rows.groupby(KEYS, sort=False, observed=True).agg(
+            {
+                "pressure": "first",
+                "temperature": "first",
+                "mass": "sum",
+                **{e: "sum" for e in elements},
+                **{"weight_" + e: "sum" for e in elements},
+            }
+        )
+        for e in elements:
+            table[e] = table[e] / table.pop("weight_" + e).replace(0, np.nan)
+        return table
+    return rows.set_index(KEYS)
+
+
+def partition_coefficients(traces, phase="solid", elements=None):
+    """
+    Get partition coefficients between a phase and the liquid at each step of each
+    experiment; those for :code:`"solid"` are bulk partition coefficients.
+
+    Parameters
+    -----------
+    traces : :class:`pandas.DataFrame`
+        Multi-experiment trace table.
+    phase : :class:`str`
+        Phase name, or :code:`"solid"` for the bulk solid.
+    elements : :class:`list`
+        Trace elements, defaulting to all.
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+        Pressure, temperature and partition coefficients, indexed by experiment and
+        step, for the steps at which the phase is present.
+    """
+    elements = trace_elements(traces) if elements is None else list(elements)
+    table = trace_table(traces, phase=phase, elements=elements)
+    table = table.loc[table["mass"] > 0]
+    liquid = trace_table(traces, phase="liquid", elements=elements)
+    liquid = liquid.reindex(index=table.index)
+    coefficients = table[elements] / liquid[elements].replace(0, np.nan)
+    return pd.concat([table[["pressure", "temperature"]], coefficients], axis=1)
+
+
+def element_ratios(traces, ratios, phase="liquid"):
+    """
+    Get ratios of trace element concentrations in a phase (e.g. :code:`Ni/Cu` in
+    the liquid) at each step of each experiment.
+
+    Parameters
+    -----------
+    traces : :class:`pandas.DataFrame`
+        Multi-experiment trace table.
+    ratios : :class:`list`
+        Ratios to calculate, given as strings (e.g. :code:`"Ni/Cu"`).
+    phase : :class:`str`
+        Phase name (see :func:`trace_table`).
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+        Pressure, temperature and ratios, indexed by experiment and step.
+    """
+    pairs = [r.split("/") for r in ratios]
+    elements = list(pd.unique([e for pair in pairs for e in pair]))
+    table = trace_table(traces, phase=phase, elements=elements)
+    values = {
+        r: table[a] / table[b].replace(0, np.nan) for r, (a, b) in zip(ratios, pairs)
+    }
+    return pd.concat([table[["pressure", "temperature"]], pd.DataFrame(values)], axis=1)
@@ -1,28 +1,204 @@
+import os
+import pickle
+import hashlib
+import tempfile
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 from collections import Counter
+from pyrolite.util.plot import save_figure
 from pyrolite.util.plot.legend import proxy_line
-from pyrolite_meltsutil.vis.style import phase_color, phaseID_linestyle
-from pyrolite_meltsutil.vis.templates import plot_phasevolumes
+from pyrolite_meltsutil.vis.style import (
+    phase_color,
+    phaseID_linestyle,
+    phaseID_marker,
+)
 from pyrolite_meltsutil.util.tables import phasename
-from ..sequence import get_appearance_sequence
+from ..cache import digest
+from ..sequence import appearance_table, sequences_from_table
 
+# records of the inputs each rendered figure was drawn from, one file per figure
+# within this folder of a cache folder
+FIGURES = "figures"
 
-def _phasevolumes(
-    phases,
-    config=None,
+
+def _write_atomic(path, data):
+    """
+    Write a file through a uniquely named temporary file in the same folder, such
+    that concurrent writers neither share temporary files nor leave partial files.
+
+    Parameters
+    -----------
+    path : :class:`pathlib.Path`
+        Path to write to.
+    data : :class:`bytes`
+        Content of the file.
+    """
+    with tempfile.NamedTemporaryFile(
+        dir=str(path.parent), prefix=path.name, suffix=".tmp", delete=False
+    ) as f:
+        f.write(data)
+    os.replace(f.name, str(path))
+
+
+def _signature(expdf, columns):
+    """
+    Get a digest of the content of columns of a table.
+
+    Parameters
+    -----------
+    expdf : :class:`pandas.DataFrame`
+        Table to digest.
+    columns : :class:`list`
+        Columns to digest.
+
+    Returns
+    -------
+    :class:`str`
+    """
+    hashes = pd.util.hash_pandas_object(expdf[columns], index=True).values
+    return hashlib.sha1(hashes.tobytes()).hexdigest()
+
+
+def panel_data(expdf, xvar="temperature", yvar="volume%"):
+    """
+    Get the data for the phase volume panel of a single experiment, being the
+    lines for each phase (as drawn by
+    :func:`~pyrolite_meltsutil.vis.templates.plot_phasevolumes`) and the
+    appearance sequence of the experiment.
+
+    Parameters
+    -----------
+    expdf : :class:`pandas.DataFrame`
+        Phase table for a single experiment.
+    xvar, yvar : :class:`str`
+        Variables to plot.
+
+    Returns
+    -------
+    :class:`dict`
+    """
+    xinds = expdf.step.drop_duplicates().sort_values().index  # steps are unique
+    groups = expdf.groupby("phaseID", sort=False, observed=True).indices
+    lines = {}
+    for phaseID in sorted(groups):
+        phasedf = expdf.take(groups[phaseID]).reindex(index=xinds)
+        lines[phaseID] = (phasedf[xvar].values, phasedf[yvar].values)
+    sequence = sequences_from_table(appearance_table(expdf))
+    return {
+        "xvar": xvar,
+        "yvar": yvar,
+        "lines": lines,
+        "sequence": next(iter(sequence.values()), []),
+    }
+
+
+def experiment_panels(phases, exprs=None, cache=None, **kwargs):
+    """
+    Get the panel data for each experiment within a phase table (see
+    :func:`panel_data`), grouping the table by experiment once. Where a cache
+    folder is given, panel data are stored keyed by the experiment hash, the
+    content of its table and the plotted variables, such that only experiments
+    which have been added or changed are recomputed.
+
+    Parameters
+    -----------
+    phases : :class:`pandas.DataFrame`
+        Phase table.
+    exprs : :class:`list`
+        Experiments to get panels for, defaulting to all within the table.
+    cache : :class:`str` | :class:`pathlib.Path`
+        Folder to cache panel data within.
+
+    Returns
+    -------
+    :class:`tuple`
+        Dictionaries of panel data and panel keys, indexed by experiment.
+    """
+    groups = phases.groupby("experiment", sort=False, observed=True).indices
+    xvar, yvar = kwargs.get("xvar", "temperature"), kwargs.get("yvar", "volume%")
+    columns = list(dict.fromkeys(["step", "phaseID", "temperature", xvar, yvar]))
+    if exprs is None:
+        exprs = list(groups)
+    if cache is not None:
+        cache = Path(cache)
+        cache.mkdir(parents=True, exist_ok=True)
+    panels, keys = {}, {}
+    for expr in exprs:
+        expdf = phases.take(groups.get(expr, []))
+        keys[expr] = digest(
+            {"experiment": expr, "data": _signature(expdf, columns), "style": kwargs}
+        )
+        path = None if cache is None else cache / (keys[expr] + ".pkl")
+        if path is not None and path.exists():
+            try:
+                with open(str(path), "rb") as f:
+                    panels[expr] = pickle.load(f)
+                continue
+            except Exception:  # an unreadable panel is a cache miss
+                pass
+        panels[expr] = panel_data(expdf, **kwargs)
+        if path is not None:
+            _write_atomic(path, pickle.dumps(panels[expr]))
+    return panels, keys
+
+
+def _draw_panel(ax, panel, **kwargs):
+    """
+    Draw the phase volume panel for a single experiment.
+
+    Parameters
+    -----------
+    ax : :class:`matplotlib.axes.Axes`
+        Axes to draw on.
+    panel : :class:`dict`
+        Panel data (see :func:`panel_data`).
+    """
+    ax.set_xlabel(panel["xvar"])
+    ax.set_ylabel(panel["yvar"])
+    for phaseID, (x, y) in panel["lines"].items():
+        style = dict(
+            ls=phaseID_linestyle(phaseID),
+            color=phase_color(phaseID),
+            markerfacecolor=phase_color(phaseID),
+            marker=phaseID_marker(phaseID),
+            markersize=3,
+        )
+        style = {**{k: v for k, v in style.items() if v is not None}, **kwargs}
+        ax.plot(x, y, **style)
+
+
+def _draw_phasevolumes(
+    panels,
+    titles,
+    phaseIDs,
     n_across=4,
     tlim=(800, 1250),
     unit_size=5,
     aspect=0.8,
-    exprs=None,
     legend_on=None,
 ):
-    if exprs is None:
-        exprs = phases["experiment"].unique()
-    ndown = len(exprs) // n_across
-    if len(exprs) % n_across:
+    """
+    Draw a grid of phase volume panels.
+
+    Parameters
+    -----------
+    panels : :class:`list`
+        Panel data for each experiment (see :func:`panel_data`).
+    titles : :class:`list`
+        Titles for each panel.
+    phaseIDs : :class:`list`
+        Phase IDs to include in the legend.
+
+    Returns
+    -------
+    :class:`tuple`
+        Figure and axes.
+    """
+    ndown = len(panels) // n_across
+    if len(panels) % n_across:
         ndown += 1
     figsize = (n_across * unit_size, aspect * ndown * unit_size)
     fig, ax = plt.subplots(ndown, n_across, sharex=True, sharey=True, figsize=figsize,)
@@ -31,11 +207,8 @@ def _phasevolumes(
     ax[0].set_ylim((0.1, 100))
     ax[0].set_xlim(tlim)
     sequences = []
-    for ix, expnumber in enumerate(exprs):
-        name = expnumber
-        exp_title, exp_config, exp_env = config[name]
-        expdf = phases.loc[phases.experiment == expnumber, :]
-        sequence = get_appearance_sequence(expdf)
+    for ix, (panel, title) in enumerate(zip(panels, titles)):
+        sequence = panel["sequence"]
         sequences.append(
             {
                 phs: sequence.index((v, _phases))
@@ -43,14 +216,12 @@ def _phasevolumes(
                 for phs in _phases
             }
         )
-        plot_phasevolumes(expdf, marker=None, ax=ax[ix], lw=4, legend=False)
-        ax[ix].set_title(exp_config["Suite"] + ": " + exp_config["Title"])
-
-        modes = exp_config["modes"]
+        _draw_panel(ax[ix], panel, marker=None, lw=4)
+        ax[ix].set_title(title)
     all_phaseIDs = sorted(
         [
             (p, np.mean([s.get(p, len(s.keys()) + 1) for s in sequences]))
-            for p in phases.phaseID.unique()
+            for p in phaseIDs
             if not pd.isnull(p)
         ],
         key=lambda x: x[1],
@@ -75,6 +246,173 @@ def _phasevolumes(
     return fig, ax
 
 
+def _phasevolumes(
+    phases,
+    config=None,
+    n_across=4,
+    tlim=(800, 1250),
+    unit_size=5,
+    aspect=0.8,
+    exprs=None,
+    legend_on=None,
+    cache=None,
+):
+    if exprs is None:
+        exprs = phases["experiment"].unique()
+    panels, _ = experiment_panels(phases, exprs=exprs, cache=cache)
+    return _draw_phasevolumes(
+        [panels[e] for e in exprs],
+        [config[e][1]["Suite"] + ": " + config[e][1]["Title"] for e in exprs],
+        phases.phaseID.unique(),
+        n_across=n_across,
+        tlim=tlim,
+        unit_size=unit_size,
+        aspect=aspect,
+        legend_on=legend_on,
+    )
+
+
+def _render_figure(name, panels, titles, phaseIDs, layout, off, hidden, save):
+    """
+    Draw and save a grid of phase volume panels, within a worker process.
+
+    Parameters
+    -----------
+    name : :class:`str`
+        Figure name.
+    panels, titles, phaseIDs
+        Panel data, titles and legend phase IDs (see :func:`_draw_phasevolumes`).
+    layout : :class:`dict`
+        Layout arguments for :func:`_draw_phasevolumes`.
+    off : :class:`list`
+        Indexes of axes to turn off.
+    hidden : :class:`list`
+        Indexes of axes to hide.
+    save : :class:`dict`
+        Arguments for :func:`~pyrolite.util.plot.save_figure`.
+
+    Returns
+    -------
+    :class:`str`
+        Figure name.
+    """
+    fig, ax = _draw_phasevolumes(panels, titles, phaseIDs, **layout)
+    for ix in off:
+        ax[ix].axis("off")
+    for ix in hidden:
+        ax[ix].set_visible(False)
+    save_figure(fig, name=name, **save)
+    plt.close(fig)
+    return name
+
+
+def render_phasevolumes(
+    figures,
+    phases,
+    config,
+    save_at="../img/",
+    save_fmts=["png", "pdf"],
+    cache=None,
+    processes=None,
+    force=False,
+):
+    """
+    Render a set of phase volume figures in parallel worker processes. Where a
+    cache folder is given, panel data are cached (see :func:`experiment_panels`)
+    and figures are only redrawn where their inputs have changed or their outputs
+    are missing.
+
+    Parameters
+    -----------
+    figures : :class:`dict`
+        Figures to render, indexed by name. Each is a dictionary with a list of
+        experiments (:code:`exprs`) and optionally the experiments whose phases are
+        included in the legend (:code:`legend_exprs`, defaulting to :code:`exprs`),
+        the indexes of axes to turn off (:code:`off`) or hide (:code:`hidden`), the
+        resolution (:code:`dpi`) and layout arguments for :func:`_phasevolumes`.
+    phases : :class:`pandas.DataFrame`
+        Phase table.
+    config : :class:`dict` | :class:`mod.catalog.BatchCatalog`
+        Batch configuration, used for panel titles.
+    save_at : :class:`str` | :class:`pathlib.Path`
+        Folder to save figures to.
+    save_fmts : :class:`list`
+        Formats to save figures in.
+    cache : :class:`str` | :class:`pathlib.Path`
+        Folder to cache panel data and the record of rendered figures within.
+    processes : :class:`int`
+        Number of worker processes, defaulting to the number of figures to render.
+        Where a single process is used, figures are rendered in the current
+        process.
+    force : :class:`bool`
+        Whether to redraw figures which are up to date.
+
+    Returns
+    -------
+    :class:`dict`
+        Whether each figure was :code:`"rendered"` or already :code:`"current"`.
+    """
+    exprs = {e for spec in figures.values() for e in spec["exprs"]}
+    exprs |= {e for spec in figures.values() for e in spec.get("legend_exprs", [])}
+    in_figures = phases.loc[phases.experiment.isin(exprs)]
+    panels, keys = experiment_panels(in_figures, exprs=list(exprs), cache=cache)
+    records = None
+    if cache is not None:
+        records = Path(cache) / FIGURES
+        records.mkdir(parents=True, exist_ok=True)
+    tasks, status, rendered = {}, {}, {}
+    for name, spec in figures.items():
+        spec = dict(spec)
+        fexprs = spec.pop("exprs")
+        legend_exprs = spec.pop("legend_exprs", fexprs)
+        off, hidden = spec.pop("off", []), spec.pop("hidden", [])
+        save = dict(save_at=str(save_at), save_fmts=save_fmts, dpi=spec.pop("dpi", 800))
+        titles = [config[e][1]["Suite"] + ": " + config[e][1]["Title"] for e in fexprs]
+        phaseIDs = in_figures.loc[
+            in_figures.experiment.isin(legend_exprs), "phaseID"
+        ].unique()
+        key = digest(
+            {
+                "panels": [keys[e] for e in fexprs],
+                "titles": titles,
+                "legend": [str(p) for p in phaseIDs],
+                "layout": spec,
+                "off": list(off),
+                "hidden": list(hidden),
+                "save": save,
+            }
+        )
+        outputs = [Path(save_at) / "{}.{}".format(name, fmt) for fmt in save_fmts]
+        record = None if records is None else records / (name + ".txt")
+        current = record is not None and record.exists() and record.read_text() == key
+        if not force and current and all(p.exists() for p in outputs):
+            status[name] = "current"
+            continue
+        rendered[name] = key
+        tasks[name] = (
+            name,
+            [panels[e] for e in fexprs],
+            titles,
+            list(phaseIDs),
+            spec,
+            off,
+            hidden,
+            save,
+        )
+    if tasks:
+        processes = processes or min(len(tasks), os.cpu_count())
+        if processes == 1:
+            for name in map(_render_figure, *zip(*tasks.values())):
+                status[name] = "rendered"
+        else:
+            with ProcessPoolExecutor(max_workers=processes) as pool:
+                for name in pool.map(_render_figure, *zip(*tasks.values())):
+                    status[name] = "rendered"
+    if records is not None:
+        for name, key in rendered.items():
+            _write_atomic(records / (name + ".txt"), key.encode())
+    return status
+
 """
 ax[ix].annotate(modes, xy=(0.1, 0.9), xycoords="axes fraction", ha="left")
 
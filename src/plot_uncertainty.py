@@ -1,5 +1,5 @@
+import functools
 import pandas as pd
-import numpy as np
 from pathlib import Path
 import matplotlib.pyplot as plt
 
@@ -7,7 +7,10 @@ import pyrolite.geochem
 from pyrolite.util.pd import read_table
 
 from pyrolite.util.plot import save_figure
-from pyrolite_meltsutil.tables.load import import_batch_config
+from mod.store import read_store
+from mod.catalog import BatchCatalog
+from mod.build import FigureBuild
+from mod.sampling import convergence_report
 from pyrolite_meltsutil.vis.style import (
     COLORS,
     phaseID_linestyle,
@@ -16,99 +19,153 @@ from pyrolite_meltsutil.vis.style import (
 )
 from pyrolite.util.plot.legend import proxy_line
 
-from mod.vis.phasevolumes import _phasevolumes
-from mod.sequence import (
-    get_appearance_sequence,
-    get_assemblage_sequence,
-    sequence_distance,
-)
+from mod.sequence import rank_experiments
 from pyrolite_meltsutil.util.tables import phasename
 from collections import Counter
 
 outputfolder = Path("../data/experiments_uncertainty")
 
-system, phases = (
-    pd.read_hdf(outputfolder / "system.h5"),
-    pd.read_hdf(outputfolder / "phases.h5"),
-)
-cfg = import_batch_config(outputfolder)
+# experiments present in the stores are taken from the aggregation index, such
+# that the stores are only read where figures need to be redrawn
+cfg = BatchCatalog.from_folder(outputfolder)
+build = FigureBuild(outputfolder)
+
+
+@functools.lru_cache(maxsize=None)
+def load_phases():
+    return read_store(outputfolder / "phases.h5", compact=True)
+
+
 #%%
-exprs = [
-    hsh
-    for (hsh, (name, c, e)) in cfg.items()
-    if (
-        (c["modes"] == ["isobaric"] and c["H2O"] == 1)
-        and (hsh in phases.experiment.unique())
-    )
-]
-
-phases.phase.unique()
-phaselist = [
-    "liquid",
-    "olivine",
-    "clinopyroxene",
-    "feldspar",
-    "orthopyroxene",
-    "spinel",
-]
-
-fig, ax = plt.subplots(
-    len(phaselist) // 2, 2, sharex=True, sharey=True, figsize=(8, 8)
-)
-xvar, yvar = "temperature", "volume%"
-[a.set_xlabel(xvar) for a in ax[-1, :]]
-[a.set_ylabel(yvar) for a in ax[:, 0]]
-name_counter = Counter(
-    [
-        phasename(pID)
-        for pID in phases.phaseID.unique()[~pd.isnull(phases.phaseID.unique())]
+exprs = cfg.select(modes="isobaric", H2O=1)
+
+
+@build.figure("Batch_Uncertainty_1Wt%H2O", experiments=exprs)
+def batch_uncertainty():
+    phases = load_phases()
+    phaselist = [
+        "liquid",
+        "olivine",
+        "clinopyroxene",
+        "feldspar",
+        "orthopyroxene",
+        "spinel",
     ]
-)
-for p, pax in zip(phaselist, ax.flat):
-    pdf = phases.loc[(phases.phase == p) & (phases.experiment.isin(exprs)), :]
-    proxies = {}
-    for phaseID in pdf.phaseID.unique():
-        style = dict(ls=phaseID_linestyle(phaseID), color=phase_color(phaseID))
-        for expr in pdf.experiment.unique():
-            e_p_df = pdf.loc[((pdf.phaseID == phaseID) & (pdf.experiment == expr)), :]
-            pax.plot(e_p_df[xvar], e_p_df[yvar], **style)
-            name = (
-                phasename(phaseID)
-                if ((name_counter[phasename(phaseID)] == 1) or (phaseID.endswith("_0")))
-                else phaseID
-            )
-            proxies[name] = proxy_line(**style)
-
-    pax.legend(
-        proxies.values(),
-        proxies.keys(),
-        bbox_to_anchor=None,
-        loc="best",
-        fontsize="large",
+
+    fig, ax = plt.subplots(
+        len(phaselist) // 2, 2, sharex=True, sharey=True, figsize=(8, 8)
     )
+    xvar, yvar = "temperature", "volume%"
+    [a.set_xlabel(xvar) for a in ax[-1, :]]
+    [a.set_ylabel(yvar) for a in ax[:, 0]]
+    name_counter = Counter(
+        [
+            phasename(pID)
+            for pID in phases.phaseID.unique()[~pd.isnull(phases.phaseID.unique())]
+        ]
+    )
+    for p, pax in zip(phaselist, ax.flat):
+        pdf = phases.loc[(phases.phase == p) & (phases.experiment.isin(exprs)), :]
+        proxies = {}
+        for phaseID in pdf.phaseID.unique():
+            style = dict(ls=phaseID_linestyle(phaseID), color=phase_color(phaseID))
+            for expr in pdf.experiment.unique():
+                e_p_df = pdf.loc[
+                    ((pdf.phaseID == phaseID) & (pdf.experiment == expr)), :
+                ]
+                pax.plot(e_p_df[xvar], e_p_df[yvar], **style)
+                name = (
+                    phasename(phaseID)
+                    if (
+                        (name_counter[phasename(phaseID)] == 1)
+                        or (phaseID.endswith("_0"))
+                    )
+                    else phaseID
+                )
+                proxies[name] = proxy_line(**style)
 
-plt.tight_layout()
+        pax.legend(
+            proxies.values(),
+            proxies.keys(),
+            bbox_to_anchor=None,
+            loc="best",
+            fontsize="large",
+        )
 
-save_figure(
-    fig, name="Batch_Uncertainty_1Wt%H2O", save_at="../img/", save_fmts=["png", "pdf"]
-)
-#%%
+    plt.tight_layout()
 
-better_models = sorted(
-    [
-        (
-            e,
-            sequence_distance(
-                phases.loc[phases.experiment == e],
-                ["liquid", "olivine", "feldspar", "clinopyroxene", "orthopyroxene",],
-                ignore_trailing=True,
-            )[-1],
+    save_figure(
+        fig,
+        name="Batch_Uncertainty_1Wt%H2O",
+        save_at="../img/",
+        save_fmts=["png", "pdf"],
+    )
+
+
+#%% how the distribution of distances stabilises as replicates are added
+def convergence_reports(distances):
+    """
+    Report the convergence of sequence distances for each configuration, as the
+    replicates of each configuration are run for the same compositions. Replicates
+    are taken in order of their replicate index, or where they have none (e.g. the
+    blurred batch) in the order they were configured.
+    """
+    table = cfg.table.loc[distances.index]
+    position = pd.Series(cfg.table.index.get_indexer(table.index), index=table.index)
+    order = table["Replicate"].fillna(position)
+    # water contents are either set for a configuration (0 or 1 wt%) or sampled
+    water = table["H2O"].where(table["H2O"].isin([0, 1]))
+    configs = pd.DataFrame(
+        {
+            "modes": table["modes"].map(", ".join),
+            "H2O": water.map(lambda h: "sampled" if pd.isnull(h) else "{:g}".format(h)),
+        }
+    )
+    return {
+        "{}, H2O {}".format(modes, h2o): convergence_report(
+            distances.loc[group.index], order=order.loc[group.index].values
         )
-        for e in phases.experiment.unique()
-    ],
-    key=lambda x: x[1],
+        for (modes, h2o), group in configs.groupby(["modes", "H2O"])
+    }
+
+
+@build.figure(
+    "Sequence_Distance_Convergence", experiments=cfg.select(), save_fmts=["png"]
+)
+def sequence_distance_convergence():
+    better_models = rank_experiments(
+        load_phases(),
+        ["liquid", "olivine", "feldspar", "clinopyroxene", "orthopyroxene",],
+        ignore_trailing=True,
+    )
+    reports = convergence_reports(better_models.set_index("experiment")["distance"])
+
+    fig, ax = plt.subplots(1)
+    for ix, (config, convergence) in enumerate(reports.items()):
+        color = "C{}".format(ix)
+        ax.plot(convergence.index, convergence.filter(like="q"), color=color, lw=0.5)
+        ax.plot(convergence.index, convergence["mean"], color=color, lw=2, label=config)
+    ax.legend(fontsize="small")
+    ax.set(xscale="log", xlabel="Number of Samples", ylabel="Sequence Distance")
+    save_figure(
+        fig, name="Sequence_Distance_Convergence", save_at="../img/", save_fmts=["png"]
+    )
+
+
+if __name__ == "__main__":  # worker processes may re-import this script
+    print(build.build())
+
+#%%
+phases = load_phases()
+better_models = rank_experiments(
+    phases,
+    ["liquid", "olivine", "feldspar", "clinopyroxene", "orthopyroxene",],
+    ignore_trailing=True,
 )
 
 fig, ax = plt.subplots(1)
 
-ax.hist2d(*np.array([(dist, cfg[e][1]["H2O"]) for (e, dist) in better_models]).T,)
+ax.hist2d(
+    better_models["distance"],
+    cfg.table.loc[better_models["experiment"], "H2O"],
+)
@@ -7,6 +7,7 @@ import pyrolite.geochem
 from pyrolite.util.text import slugify
 from pyrolite.util.pd import accumulate
 from pyrolite.util.plot import save_figure
+from mod.sampling import CompositionSampler
 
 np.random.seed(32)
 
@@ -31,9 +32,38 @@ df = read_table("../data/starting_compositions.csv").rename(
 )
 
 reps = 10  # increase this to perform more experiments
-df = accumulate([df.iloc[[-1], :]] * reps)
-df = df.reset_index()  # .drop(columns="index")
-df.pyrochem.compositional = blur_compositions(df.pyrochem.compositional)
+config_grid = {
+    "Log fO2 Path": ["NNO"],
+    "modes": [None, ["isobaric"]],
+    "modifychem": [None, {"H2O": 0}, {"H2O": 1}],
+}
+# by default, replicates are blurred and each is run for every configuration in the
+# grid. Alternatively, compositions and configuration axes can be sampled jointly
+# with a quasi-random design ("sobol" or "lhs"), spreading replicates evenly such
+# that fewer runs are needed (ideally by powers of two), or pseudo-randomly
+# ("normal"); any such replicate can be regenerated from the seed and its index with
+# sampler.replicate(index).
+method = "blur"
+if method == "blur":
+    sampler = None
+    df = accumulate([df.iloc[[-1], :]] * reps)
+    df = df.reset_index()  # .drop(columns="index")
+    df.pyrochem.compositional = blur_compositions(df.pyrochem.compositional)
+    chunks = [df]
+else:
+    # the modes and water contents of the grid are sampled jointly instead
+    axes = {
+        "modes": [["isobaric", "fractionate solids"], ["isobaric"]],
+        "modifychem": [{}, {"H2O": 0}, {"H2O": 1}],
+    }
+    config_grid = {"Log fO2 Path": ["NNO"]}
+    sampler = CompositionSampler(
+        df.iloc[-1], noise=0.02, seed=32, method=method, axes=axes, size=reps
+    )
+    df = sampler.sample(0, min(reps, 1000))  # for the figure
+    # replicates are generated and run a chunk at a time, such that a large study
+    # never exists in memory at once
+    chunks = sampler.chunks(reps, chunksize=1000)
 
 styles = {
     "Nadezhdinsky": {"c": "yellow", "marker": "D"},
@@ -56,7 +86,7 @@ save_figure(
 )
 #%%
 from pyrolite_meltsutil.env import MELTS_Env
-from pyrolite_meltsutil.automation import MeltsBatch
+from mod.batch import stream_batches
 
 env = MELTS_Env()
 env.VERSION = "MELTS"
@@ -68,24 +98,54 @@ env.MAXT = 1500
 env.DELTAT = -10
 env.DELTAP = 0
 
-batch = MeltsBatch(
-    df,
+# sampled replicates can instead be run in rounds, stopping once the appearance
+# temperatures of phases and sequence distances are known to within a tolerance
+# (95% confidence intervals on their means, in degrees and edits respectively)
+adaptive = False
+tolerance, tolerances = 5.0, {"distance": 0.1}
+target_sequence = ["liquid", "olivine", "feldspar", "clinopyroxene", "orthopyroxene"]
+
+batch_kwargs = dict(
+    run_kwargs=dict(overwrite=False),  # skip exp folders verified complete
     default_config={
         "Initial Pressure": 500,
         "Initial Temperature": 1250,
         "Final Temperature": 800,
         "modes": ["isobaric", "fractionate solids"],
     },
-    config_grid={
-        "Log fO2 Path": ["NNO"],
-        "modes": [None, ["isobaric"]],
-        "modifychem": [None, {"H2O": 0}, {"H2O": 1}],
-    },
+    config_grid=config_grid,
     env=env,
     fromdir=outputfolder,
     logger=logger,
+    processes=None,  # one worker process per core
 )
 
-batch.run(
-    overwrite=False
-)  # overwrite=False if you don't want to update existing exp folders
+if __name__ == "__main__":  # worker processes may re-import this script
+    if adaptive:
+        if sampler is None:
+            raise ValueError("Adaptive studies draw rounds from a sampler.")
+        from mod.adaptive import run_adaptive, outcome_statistics
+
+        def run_round(chunk):
+            # experiments skipped as already verified count towards the round, such
+            # that a resumed study converges on those already run
+            return [
+                outputfolder / hsh
+                for batch in stream_batches([chunk], **batch_kwargs)
+                for hsh in batch.experiments
+                if batch.is_complete(hsh)
+            ]
+
+        summary = run_adaptive(
+            sampler,
+            run=run_round,
+            evaluate=lambda folders: outcome_statistics(folders, target_sequence),
+            tolerance=tolerance,
+            tolerances=tolerances,
+            round_size=16,
+            max_samples=reps,
+        )
+        logger.info("\n{}".format(summary.table()))
+    else:
+        for batch in stream_batches(chunks, **batch_kwargs):
+            logger.info("Completed {} experiments.".format(len(batch.completed)))
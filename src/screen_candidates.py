@@ -0,0 +1,94 @@
+import itertools
+from pathlib import Path
+import pandas as pd
+from pyrolite.util.meta import stream_log
+from pyrolite.util.pd import read_table
+from pyrolite.util.units import scale
+import pyrolite.geochem
+from mod.catalog import BatchCatalog
+from mod.columnar import read_dataset
+from mod.sampling import CompositionSampler
+from mod.emulator import (
+    SequenceEmulator,
+    appearance_temperatures,
+    config_records,
+    cross_validate,
+)
+
+logger = stream_log("mod", level="INFO")
+outputfolder = Path("../data/experiments")
+
+# the emulator is trained on the aggregated experiments, to predict the temperatures
+# at which phases appear from the composition (in ILR space) and configuration
+cfg = BatchCatalog.from_folder(outputfolder)
+phases = read_dataset(
+    outputfolder / "phases.parquet",
+    experiments=list(cfg.present),
+    columns=["experiment", "phaseID", "temperature"],
+)
+temperatures = appearance_temperatures(phases)
+records = config_records(cfg)
+
+target_sequence = ["liquid", "olivine", "feldspar", "clinopyroxene", "orthopyroxene"]
+threshold = 3  # largest distance to the target sequence of interest
+distance_kw = dict(ignore_trailing=True)
+
+emulator = SequenceEmulator(resolution=10.0)
+
+#%% cross-validated accuracy
+# experiments from the same starting composition are kept within the same fold,
+# such that accuracy is estimated for compositions the emulator hasn't seen
+report = cross_validate(
+    emulator,
+    records,
+    temperatures,
+    target_sequence=target_sequence,
+    threshold=threshold,
+    groups=cfg.table["Title"],
+    **distance_kw
+)
+print(report["phases"].round(2))
+print(report["summary"].round(3))
+report["phases"].to_csv(outputfolder / "emulator_phases.csv")
+report["predictions"].to_csv(outputfolder / "emulator_predictions.csv")
+
+#%% triage of candidates
+emulator.fit(records, temperatures)
+
+# Naldrett 2004 compositions, for the configurations of run.py
+df = read_table("../data/starting_compositions_all.csv").rename(
+    columns={"FeOt": "FeO", "LOI": "H2O"}
+)
+df.pyrochem.elements *= scale("ppm", "wt%")
+df = df.pyrochem.convert_chemistry(
+    [i for i in df.pyrochem.oxides if "Fe" not in i]
+    + [{"FeO": 0.9, "Fe2O3": 0.1}]
+    + ["Cr2O3"],
+    renorm=True,
+)
+default_config = {
+    "Initial Pressure": 500,
+    "Initial Temperature": 1250,
+    "Final Temperature": 800,
+    "modes": ["isobaric", "fractionate solids"],
+    "Log fO2 Path": "NNO",
+}
+# as for the config_grid of the batch, where None takes the default
+grid = itertools.product([None, ["isobaric"]], [None, {"H2O": 0}, {"H2O": 1}])
+candidates = pd.concat(
+    [df.assign(modes=[m] * len(df), modifychem=[c] * len(df)) for m, c in grid],
+    ignore_index=True,
+)
+triaged = emulator.triage(
+    candidates, target_sequence, threshold, defaults=default_config, **distance_kw
+)
+print(triaged["status"].value_counts())
+candidates.join(triaged).to_csv(outputfolder / "candidates.csv")
+
+#%% triage of uncertainty replicates, before they're run
+sampler = CompositionSampler(df.iloc[-1], noise=0.02, seed=32, method="sobol")
+replicates = sampler.sample(0, 1024)
+triaged = emulator.triage(
+    replicates, target_sequence, threshold, defaults=default_config, **distance_kw
+)
+print(triaged["status"].value_counts())
@@ -0,0 +1,84 @@
+import functools
+from pathlib import Path
+import matplotlib.pyplot as plt
+from pyrolite.util.meta import stream_log
+from pyrolite.util.pd import read_table
+from pyrolite.util.plot import save_figure
+from mod.catalog import BatchCatalog
+from mod.build import FigureBuild
+from mod.misfit import MineralReference, score_phases, rank_misfit
+from mod.traces import (
+    read_traces,
+    trace_elements,
+    trace_table,
+    partition_coefficients,
+    element_ratios,
+)
+
+logger = stream_log("mod", level="INFO")
+outputfolder = Path("../data/experiments")
+
+cfg = BatchCatalog.from_folder(outputfolder)
+build = FigureBuild(outputfolder, save_at="../img")
+exprs = cfg.select(modes="isobaric")
+
+# chalcophile and compatible elements, where these were included in the runs
+targets = ["Ni", "Cu", "Cr"]
+
+
+@functools.lru_cache(maxsize=None)
+def load_traces():
+    traces = read_traces(outputfolder / "traces.parquet", experiments=exprs)
+    elements = [e for e in targets if e in trace_elements(traces)]
+    if not elements:
+        logger.warning("No traces for {} in the experiments.".format(targets))
+    return traces, elements
+
+
+#%% liquid compositions and bulk partition coefficients for all experiments at once
+def partitioning():
+    traces, elements = load_traces()
+    liquid = trace_table(traces, phase="liquid", elements=elements)
+    D = partition_coefficients(traces, phase="solid", elements=elements)
+    return liquid, D
+
+
+#%%
+def liquid_traces():
+    traces, elements = load_traces()
+    ratios = element_ratios(traces, ["Ni/Cu", "Cr/Ni"], phase="liquid")
+    fig, ax = plt.subplots(1, 2, figsize=(10, 4), sharex=True)
+    for a, ratio in zip(ax, ["Ni/Cu", "Cr/Ni"]):
+        a.scatter(ratios["temperature"], ratios[ratio], s=3, c="k", alpha=0.5)
+        a.set(xlabel="Temperature", ylabel="{} (liquid)".format(ratio))
+    save_figure(fig, name="Liquid-Traces", save_at="../img", save_fmts=["png", "pdf"])
+
+
+# the figure is only registered where the runs include trace elements
+_, elements = load_traces()
+if elements:
+    build.register("Liquid-Traces", liquid_traces, experiments=exprs)
+
+
+#%% screening the modelled minerals against observed trace element chemistry
+def trace_misfit(metric="distance"):
+    traces, elements = load_traces()
+    minchem = read_table("../data/all_traces.csv")
+    minchem.columns = [c.replace("_pct", "") for c in minchem.columns]
+    references = [
+        MineralReference(
+            minchem.loc[minchem.Mineral == mineral], elements, phase, space="log"
+        )
+        for mineral, phase in [("olivine", "olivine"), ("pyroxene", "clinopyroxene")]
+    ]
+    ranked = rank_misfit(score_phases(traces, references), metric=metric)
+    ranked.join(cfg.table[["name", "Title"]]).to_csv(outputfolder / "trace_misfit.csv")
+    return ranked
+
+
+#%%
+if __name__ == "__main__" and elements:  # workers may re-import this script
+    liquid, D = partitioning()
+    print(D.groupby("temperature")[elements].median())
+    print(build.build())
+    print(trace_misfit().head(20))
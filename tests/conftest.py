@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# the mod package and scripts are run from the src folder
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
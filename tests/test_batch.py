@@ -0,0 +1,93 @@
+import os
+import stat
+import logging
+import threading
+import pandas as pd
+import pytest
+from mod import cache
+from mod.batch import ParallelMeltsBatch, expected_steps
+
+# stands in for run_alphamelts.command: the output tables are written where the
+# calculation is run (menu option 4), and it exits at option 0; experiments with
+# titles starting with "Fail" exit with an error instead
+STUB = """#!/bin/sh
+meltsfile=$2
+while read line; do
+    case "$line" in
+        4)
+            case "$meltsfile" in Fail*) exit 3;; esac
+            for table in {tables}; do echo "Pressure Temperature" > "$table"; done
+            echo "done"
+            ;;
+        0) exit 0;;
+    esac
+done
+"""
+
+
+@pytest.fixture
+def executable(tmp_path):
+    path = tmp_path / "run_alphamelts.command"
+    path.write_text(STUB.replace("{tables}", " ".join(cache.OUTPUTS)))
+    path.chmod(path.stat().st_mode | stat.S_IXUSR)
+    return path
+
+
+def make_batch(folder, executable, titles, processes=2):
+    folder.mkdir(exist_ok=True)
+    comp_df = pd.DataFrame(
+        [{"Title": t, "SiO2": 50.0, "MgO": 10.0, "CaO": 10.0} for t in titles]
+    )
+    return ParallelMeltsBatch(
+        comp_df,
+        default_config={
+            "Initial Pressure": 500,
+            "Initial Temperature": 1250,
+            "modes": ["isobaric"],
+        },
+        config_grid={"Final Temperature": [1200, 800]},
+        fromdir=folder,
+        logger=logging.getLogger("test_batch"),
+        executable=executable,
+        processes=processes,
+    )
+
+
+def test_schedule_longest_first(tmp_path, executable):
+    batch = make_batch(tmp_path / "batch", executable, ["A"])
+    steps = [expected_steps(exp, env) for _, (_, exp, env) in batch.schedule()]
+    assert steps == sorted(steps, reverse=True) and steps[0] > steps[-1]
+
+
+def test_run_failures_and_rerun(tmp_path, executable):
+    batch = make_batch(tmp_path / "batch", executable, ["A", "Fail"])
+    batch.run()
+    titles = {hsh: title for hsh, (title, _, _) in batch.experiments.items()}
+    failed = {h for h, t in titles.items() if t.startswith("Fail")}
+    # failures are recorded by hash, as completed experiments are
+    assert set(batch.failed) == failed
+    assert set(batch.completed) == set(titles) - failed
+    for hsh in batch.completed:
+        assert cache.verify(tmp_path / "batch" / hsh)
+    for hsh in batch.failed:
+        manifest = cache.read_manifest(tmp_path / "batch" / hsh)
+        assert manifest["status"] == "failed" and manifest["returncode"] == 3
+    # verified experiments are skipped on rerun, and failed ones are run again
+    rerun = make_batch(tmp_path / "batch", executable, ["A", "Fail"])
+    rerun.run()
+    assert rerun.completed == [] and set(rerun.failed) == failed
+    assert {m["experiment"] for m in rerun.metrics} == failed
+
+
+def test_cancel(tmp_path, executable):
+    batch = make_batch(tmp_path / "batch", executable, ["A", "B"], processes=1)
+    timer = threading.Timer(0.5, batch.cancel)
+    timer.start()
+    batch.run()
+    timer.join()
+    # experiments queued to the worker still run, those pending are cancelled
+    assert batch.cancelled
+    finished = batch.completed + batch.failed + batch.cancelled
+    assert sorted(finished) == sorted(batch.experiments)
+    for hsh in batch.cancelled:
+        assert not cache.verify(tmp_path / "batch" / hsh)
@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+import pytest
+from mod.index import PhaseIndex
+from mod.synthetic import synthetic_phases
+
+PHASES = ["liquid", "olivine", "clinopyroxene", "feldspar", "orthopyroxene"]
+
+
+@pytest.fixture(scope="module")
+def phases():
+    df = synthetic_phases(30, seed=32)
+    # rows aren't necessarily grouped by experiment within an aggregated table
+    return df.sample(frac=1, random_state=32).reset_index(drop=True)
+
+
+@pytest.fixture(scope="module")
+def groups(phases):
+    experiments = phases["experiment"].unique()
+    return {
+        "first": experiments[:10],
+        "alternate": experiments[::2],
+        "none": [],
+    }
+
+
+@pytest.mark.parametrize("phase", PHASES + [["olivine", "feldspar"], None])
+def test_take_matches_masks(phases, groups, phase):
+    # selections are equivalent to the boolean masks they replace
+    ix = PhaseIndex(phases, groups=groups)
+    columns = ["experiment", "temperature", "MgO", "volume%"]
+    selected = np.ones(len(phases), dtype=bool)
+    if phase is not None:
+        selected = phases["phase"].isin(np.atleast_1d(phase))
+    for name, members in groups.items():
+        mask = selected & phases["experiment"].isin(members)
+        expected = phases.loc[mask, columns]
+        taken = ix.take(phase, group=name, columns=columns)
+        pd.testing.assert_frame_equal(taken, expected)
+        assert (ix.positions(phase, experiments=members) == np.flatnonzero(mask)).all()
+    pd.testing.assert_frame_equal(ix.take(phase), phases.loc[selected])
+
+
+def test_take_missing_column(phases):
+    ix = PhaseIndex(phases)
+    with pytest.raises(KeyError):
+        ix.take("olivine", columns=["MgO", "NotACol"])
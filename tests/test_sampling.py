@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+import pytest
+from mod.sampling import CompositionSampler
+
+COMPOSITION = pd.Series(
+    {
+        "Title": "Mr2",
+        "SiO2": 48.9,
+        "TiO2": 1.2,
+        "Al2O3": 15.1,
+        "FeO": 10.4,
+        "MgO": 8.7,
+        "CaO": 11.2,
+        "Na2O": 2.3,
+        "K2O": 0.4,
+    }
+)
+AXES = {
+    "modes": [["isobaric", "fractionate solids"], ["isobaric"]],
+    "modifychem": [{}, {"H2O": 0}, {"H2O": 1}],
+}
+
+
+@pytest.mark.parametrize("method", ["normal", "sobol", "lhs"])
+def test_sample_chunk_invariance(method):
+    # replicates are bitwise identical however a study is chunked, such that the
+    # hashes of their experiment configurations are too
+    n = 1500
+    sampler = CompositionSampler(
+        COMPOSITION, seed=32, method=method, axes=AXES, size=n, blocksize=256
+    )
+    full = sampler.sample(0, n)
+    cuts = np.unique(np.random.default_rng(0).integers(1, n, 40)).tolist()
+    pieces = [sampler.sample(a, b) for a, b in zip([0] + cuts, cuts + [n])]
+    assert full.equals(pd.concat(pieces))
+    assert full.equals(pd.concat(sampler.chunks(n, chunksize=100)))
+    assert sampler.replicate(777).equals(full.loc[777])